@@ -0,0 +1,118 @@
+import bisect
+
+# Tokens of the id, quotes and separators around each entry, in the prompt and again in the reply
+PER_ENTRY_OVERHEAD = 4
+
+
+class BatchPlan:
+    def __init__(self):
+        # (entries, input_tokens) where entries are (id, text) pairs
+        self.batches = []
+        # {id: chunks} of the entries that were too long for one request. Their chunks are batched
+        # as entries of their own, under the entry's id.
+        self.split_entries = {}
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.input_tokens + self.output_tokens
+
+    @property
+    def overhead_ratio(self):
+        # Share of the planned tokens spent on the instructions rather than on the entries
+        return self.prompt_tokens / self.total_tokens if self.total_tokens else 0.0
+
+
+class BatchPlanner:
+    """
+    Packs pending strings into requests that come close to the model's context budget.
+    Each request costs the fixed prompt, the entries and the expected reply, which is
+    about as long as the entries since they are keyed by short ids. Strings of the same event or database
+    entry are kept in one request where possible so that the model sees their context.
+    """
+
+    def __init__(self, context_budget=4096, prompt_overhead=0, output_ratio=1.0, per_entry_overhead=PER_ENTRY_OVERHEAD):
+        self.context_budget = context_budget
+        self.prompt_overhead = prompt_overhead
+        self.output_ratio = output_ratio
+        self.per_entry_overhead = per_entry_overhead
+        self.capacity = context_budget - prompt_overhead
+        if self.capacity <= self.entry_cost(1):
+            raise ValueError(f"Context budget {context_budget} is too small for a prompt of {prompt_overhead} tokens")
+        # Longest entry that still fits a request on its own; longer ones are split
+        self.max_entry_tokens = int((self.capacity - self.per_entry_overhead * (1 + output_ratio)) / (1 + output_ratio))
+
+    def entry_cost(self, token_count):
+        # Input and expected output tokens of one entry
+        return (token_count + self.per_entry_overhead) * (1 + self.output_ratio)
+
+    def batch_cost(self, entries, input_tokens):
+        # Same as the sum of entry_cost over the batch's entries
+        return (input_tokens + self.per_entry_overhead * len(entries)) * (1 + self.output_ratio)
+
+    def plan(self, rows, split_text=None):
+        """
+        rows: (id, text, token_count, group_key) in extraction order.
+        split_text(text, max_tokens) returns the (chunk, token_count) pairs of an entry that is too
+        long for one request; the chunks are packed with the entry's group like any other entry.
+        """
+        plan = BatchPlan()
+        groups = {}
+        # (position of the first entry, batch) so that the batches can be dispatched in file order
+        ordered = []
+        for index, (entry_id, text, token_count, group_key) in enumerate(rows):
+            if token_count > self.max_entry_tokens and split_text is not None:
+                chunks = split_text(text, self.max_entry_tokens)
+                plan.split_entries[entry_id] = [chunk for chunk, _ in chunks]
+                # Chunks without any text are put back as they are and never sent
+                groups.setdefault(group_key, []).extend(
+                    ((index, position), entry_id, chunk, chunk_tokens)
+                    for position, (chunk, chunk_tokens) in enumerate(chunks) if chunk.strip())
+                continue
+            groups.setdefault(group_key, []).append(((index, 0), entry_id, text, token_count))
+
+        for batch in self._pack(list(groups.values())):
+            batch.sort()
+            input_tokens = sum(token_count for _, _, _, token_count in batch)
+            ordered.append((batch[0][0], ([(entry_id, text) for _, entry_id, text, _ in batch], input_tokens)))
+            plan.requests += 1
+            plan.prompt_tokens += self.prompt_overhead
+            plan.input_tokens += input_tokens + self.per_entry_overhead * len(batch)
+            plan.output_tokens += int((input_tokens + self.per_entry_overhead * len(batch)) * self.output_ratio)
+
+        ordered.sort(key=lambda item: item[0])
+        plan.batches = [batch for _, batch in ordered]
+        return plan
+
+    def _pack(self, groups):
+        # Best fit decreasing over whole groups. Groups larger than a request are cut into
+        # consecutive runs that fill fresh requests, and their remainder is packed like a group.
+        items = []
+        for group in groups:
+            run, run_cost = [], 0
+            for entry in group:
+                cost = self.entry_cost(entry[3])
+                if run and run_cost + cost > self.capacity:
+                    items.append((run_cost, run))
+                    run, run_cost = [], 0
+                run.append(entry)
+                run_cost += cost
+            items.append((run_cost, run))
+        items.sort(key=lambda item: (-item[0], item[1][0][0]))
+
+        batches = []
+        # Open batches as (remaining capacity, batch index), sorted for bisect
+        remaining = []
+        for cost, entries in items:
+            position = bisect.bisect_left(remaining, (cost, -1))
+            if position < len(remaining):
+                capacity, batch_index = remaining.pop(position)
+                batches[batch_index].extend(entries)
+            else:
+                capacity, batch_index = self.capacity, len(batches)
+                batches.append(list(entries))
+            bisect.insort(remaining, (capacity - cost, batch_index))
+        return batches
@@ -0,0 +1,78 @@
+import argparse
+import random
+import re
+import time
+from rpgmv_translator.string_classifier import StringClassifier
+
+# Typical values found in RPG Maker data files: dialogue, control codes, file names, notes and plain numbers
+SAMPLE_STRINGS = [
+    'こんにちは、旅の方。',
+    '\\C[2]勇者\\C[0]は宝箱を開けた！',
+    'ありがとうございました！\\nまた来てね。',
+    '<hint:これはヒントです>',
+    '<Price: 500>',
+    'img/pictures/スライム_01',
+    'Actor1',
+    '$gameVariables.setValue(1, 2)',
+    '魔王城',
+    'ポーション',
+    'HP を 50 回復する。',
+    '',
+    '100',
+]
+
+
+def make_strings(count, unique_ratio, seed=0):
+    random.seed(seed)
+    unique_count = max(1, int(count * unique_ratio))
+    pool = [random.choice(SAMPLE_STRINGS) + str(i) for i in range(unique_count)]
+    return [random.choice(pool) for _ in range(count)]
+
+
+def _contains_japanese(text):
+    # Hiragana, Katakana or Kanji
+    return re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF]', text) is not None
+
+
+def _is_valid_field_to_translate(text):
+    # Japanese text without script characters or backslashes other than escaped newlines
+    if not _contains_japanese(text):
+        return False
+    if re.search(r'[$=/<>{}_]', text):
+        return False
+    return re.search(r'\\(?!n)', text) is None
+
+
+def legacy_classify(texts):
+    # The per-string checks JSONHandler used before StringClassifier, kept here as the baseline
+    return [('<' in text and '>' in text) or _is_valid_field_to_translate(text) for text in texts]
+
+
+def run(count=200000, unique_ratio=0.3, repeat=3):
+    texts = make_strings(count, unique_ratio)
+
+    legacy_time = min(_time(lambda: legacy_classify(texts)) for _ in range(repeat))
+    batch_time = min(_time(lambda: StringClassifier('Japanese').classify_batch(texts)) for _ in range(repeat))
+
+    print(f"Strings: {count} ({unique_ratio:.0%} unique)")
+    print(f"Per-string checks: {legacy_time * 1000:.1f} ms")
+    print(f"StringClassifier.classify_batch: {batch_time * 1000:.1f} ms")
+    print(f"Speedup: {legacy_time / batch_time:.1f}x")
+
+
+def _time(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="String classification micro-benchmark")
+    parser.add_argument('-count', '--count', type=int, default=200000, help='Number of strings to classify.')
+    parser.add_argument('-unique', '--unique', type=float, default=0.3, help='Ratio of distinct strings.')
+    args = parser.parse_args()
+    run(args.count, args.unique)
+
+
+if __name__ == '__main__':
+    main()
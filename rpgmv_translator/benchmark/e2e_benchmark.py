@@ -0,0 +1,164 @@
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from rpgmv_translator.benchmark.fake_openai_server import FakeOpenAIServer
+from rpgmv_translator.benchmark.project_generator import generate_project
+from rpgmv_translator.project_store import ProjectStore
+from rpgmv_translator.translate import RPGMVTranslator
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; only the tracemalloc figures are reported there
+    resource = None
+
+STAGE_NAMES = {
+    'duplicate_json_files': 'backup',
+    # Extraction, dispatch and reinjection overlapped, see -pipeline
+    'pipeline': 'pipeline',
+    'read_and_process_jsons': 'extraction',
+    'process_csv': 'dispatch',
+    'update_jsons_with_translations': 'reinjection',
+    # Request files written and results files imported, see -bulk
+    'bulk_export': 'bulk export',
+    'bulk_import': 'bulk import',
+}
+
+
+class StageRecorder:
+    """
+    Stage listener for RPGMVTranslator that records the peak traced memory of every step.
+    """
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.peaks = {}
+
+    def __call__(self, step, event):
+        if not self.trace_memory:
+            return
+        if event == 'start':
+            tracemalloc.reset_peak()
+        else:
+            self.peaks[step] = tracemalloc.get_traced_memory()[1]
+
+
+def run_benchmark(maps=20, events_per_map=20, lines_per_event=8, common_events=50, database_entries=100,
+                  latency=0.05, jitter=0.02, requests_per_minute=None, malformed_rate=0.0,
+                  concurrency=4, workers=1, streaming=False, backends=1, pipelined=False, bulk=False,
+                  trace_memory=False, keep_project=False):
+    directory = tempfile.mkdtemp(prefix='mvtrans-benchmark-')
+    try:
+        start = time.perf_counter()
+        generate_project(directory, maps=maps, events_per_map=events_per_map, lines_per_event=lines_per_event,
+                         common_events=common_events, database_entries=database_entries)
+        print(f"Generated project in {directory} ({time.perf_counter() - start:.2f} s)")
+
+        recorder = StageRecorder(trace_memory)
+        if trace_memory:
+            tracemalloc.start()
+        with contextlib.ExitStack() as stack:
+            # With several backends the n-th stub server is n times slower and gets 1/n of the weight
+            servers = [stack.enter_context(FakeOpenAIServer(latency=latency * (i + 1), jitter=jitter,
+                                                            requests_per_minute=requests_per_minute,
+                                                            malformed_rate=malformed_rate, seed=i))
+                       for i in range(backends)]
+            backend_configs = None
+            if backends > 1:
+                backend_configs = [{'name': f'stub{i}', 'base_url': server.base_url, 'weight': 1 / (i + 1)}
+                                   for i, server in enumerate(servers)]
+            translator = RPGMVTranslator(directory, concurrency=concurrency, use_translation_memory=False,
+                                         extraction_workers=workers, api_key='benchmark',
+                                         base_url=servers[0].base_url, stage_listener=recorder,
+                                         streaming=streaming, backends=backend_configs,
+                                         metrics_file=os.path.join(directory, 'metrics.jsonl'),
+                                         pipelined=pipelined)
+            if bulk:
+                _run_bulk_rounds(translator, servers[0], directory)
+            else:
+                translator.translate()
+        if trace_memory:
+            tracemalloc.stop()
+
+        server_stats = {}
+        for server in servers:
+            for key, value in server.stats.items():
+                server_stats[key] = server_stats.get(key, 0) + value
+
+        store = ProjectStore(directory)
+        string_count = store.count_strings()
+        store.close()
+
+        _print_report(translator.stage_timings, recorder.peaks, string_count, server_stats)
+        return translator.stage_timings
+    finally:
+        if not keep_project:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _run_bulk_rounds(translator, server, directory):
+    # The stub answers each request file the way the batch API would, until nothing is left to send
+    request_file = translator.export_bulk()
+    rounds = 0
+    while request_file:
+        rounds += 1
+        result_file = os.path.join(directory, f'bulk_results_{rounds}.jsonl')
+        server.answer_bulk_file(request_file, result_file)
+        request_file = translator.import_bulk([result_file])
+    print(f"Bulk rounds: {rounds}")
+
+
+def _print_report(timings, peaks, string_count, server_stats):
+    print(f"\nStrings: {string_count}")
+    print(f"{'Stage':<14}{'Time (s)':>10}{'Strings/s':>12}{'Peak (MB)':>12}")
+    for step, name in STAGE_NAMES.items():
+        if step not in timings:
+            continue
+        seconds = timings[step]
+        rate = string_count / seconds if seconds else float('inf')
+        peak = f"{peaks[step] / 1024 / 1024:.1f}" if step in peaks else '-'
+        print(f"{name:<14}{seconds:>10.2f}{rate:>12.0f}{peak:>12}")
+    total = sum(timings.values())
+    print(f"{'total':<14}{total:>10.2f}{string_count / total if total else 0:>12.0f}")
+
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    print("Server: " + ', '.join(f"{key}={value}" for key, value in server_stats.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark on a synthetic RPG Maker project")
+    parser.add_argument('-maps', '--maps', type=int, default=20, help='Number of map files.')
+    parser.add_argument('-events', '--events', type=int, default=20, help='Events per map.')
+    parser.add_argument('-lines', '--lines', type=int, default=8, help='Text lines per event.')
+    parser.add_argument('-commonevents', '--commonevents', type=int, default=50, help='Number of common events.')
+    parser.add_argument('-database', '--database', type=int, default=100, help='Entries per database file.')
+    parser.add_argument('-latency', '--latency', type=float, default=0.05, help='Stub server latency in seconds.')
+    parser.add_argument('-jitter', '--jitter', type=float, default=0.02, help='Random +/- latency in seconds.')
+    parser.add_argument('-rpm', '--rpm', type=int, default=None, help='Requests per minute enforced by the stub server.')
+    parser.add_argument('-malformed', '--malformed', type=float, default=0.0, help='Share of malformed replies.')
+    parser.add_argument('-concurrency', '--concurrency', type=int, default=4, help='Batches in flight.')
+    parser.add_argument('-workers', '--workers', type=int, default=1, help='Extraction processes.')
+    parser.add_argument('-stream', '--stream', action='store_true', help='Stream replies.')
+    parser.add_argument('-backends', '--backends', type=int, default=1, help='Stub servers to route the batches over.')
+    parser.add_argument('-pipeline', '--pipeline', action='store_true', help='Overlap extraction, dispatch and reinjection.')
+    parser.add_argument('-bulk', '--bulk', action='store_true', help='Translate through request and results files answered by the stub.')
+    parser.add_argument('-tracememory', '--tracememory', action='store_true', help='Record the peak memory of each stage (slower).')
+    parser.add_argument('-keep', '--keep', action='store_true', help='Keep the generated project.')
+    args = parser.parse_args()
+
+    run_benchmark(maps=args.maps, events_per_map=args.events, lines_per_event=args.lines,
+                  common_events=args.commonevents, database_entries=args.database, latency=args.latency,
+                  jitter=args.jitter, requests_per_minute=args.rpm, malformed_rate=args.malformed,
+                  concurrency=args.concurrency, workers=args.workers, streaming=args.stream, backends=args.backends,
+                  pipelined=args.pipeline, bulk=args.bulk, trace_memory=args.tracememory,
+                  keep_project=args.keep)
+
+
+if __name__ == '__main__':
+    main()
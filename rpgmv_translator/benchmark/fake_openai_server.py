@@ -0,0 +1,222 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rpgmv_translator.tokenizer.approximate_tokenizer import ApproximateTokenizer
+
+_KANA_REGEX = re.compile(r'[\u3040-\u309F\u30A0-\u30FF]')
+
+
+def fake_translate(text):
+    # Kana become a fixed ideograph so the reply passes the "no Japanese left" check; everything else is kept
+    return _KANA_REGEX.sub('中', text)
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the OpenAI chat completions endpoint, for benchmarks. It answers
+    translation prompts with fake translations after a configurable latency, enforces an
+    optional requests/min limit with HTTP 429 and returns malformed replies at a given rate.
+    Streamed requests get the reply as server-sent events spread over the latency; a
+    malformed streamed reply is cut off in the middle of the stream. answer_bulk_file()
+    stands in for the batch API without starting the server.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, requests_per_minute=None,
+                 malformed_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests_per_minute = requests_per_minute
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.tokenizer = ApproximateTokenizer()
+        self.lock = threading.Lock()
+        self.request_times = deque()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'malformed': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self.address = (host, port)
+        # Bound when the server starts
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(self.address, self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self.httpd is None:
+            return
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _allow_request(self):
+        with self.lock:
+            self.stats['requests'] += 1
+            if not self.requests_per_minute:
+                return True
+            now = time.monotonic()
+            while self.request_times and now - self.request_times[0] > 60:
+                self.request_times.popleft()
+            if len(self.request_times) >= self.requests_per_minute:
+                self.stats['rate_limited'] += 1
+                return False
+            self.request_times.append(now)
+            return True
+
+    def _roll_malformed(self):
+        with self.lock:
+            malformed = self.random.random() < self.malformed_rate
+            if malformed:
+                self.stats['malformed'] += 1
+            return malformed
+
+    def build_reply(self, prompt):
+        # The entries to translate are the first JSON object in the prompt; the instructions mention {c0} placeholders
+        decoder = json.JSONDecoder()
+        start = prompt.find('{')
+        while True:
+            try:
+                entries, _ = decoder.raw_decode(prompt, start)
+                break
+            except json.JSONDecodeError:
+                start = prompt.find('{', start + 1)
+        return json.dumps({key: fake_translate(text) for key, text in entries.items()}, ensure_ascii=False,
+                          separators=(',', ':'))
+
+    def reply_content(self, body):
+        prompt = '\n'.join(message['content'] for message in body['messages'])
+        content = self.build_reply(prompt)
+        if self._roll_malformed():
+            # Either prose without a dictionary or a reply cut off in the middle
+            content = "Sorry, I can't help with that." if self.random.random() < 0.5 else content[:len(content) // 2]
+        return prompt, content
+
+    def complete(self, body):
+        prompt, content = self.reply_content(body)
+        prompt_tokens, completion_tokens = self._count_tokens(prompt, content)
+        return {
+            "id": f"chatcmpl-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'fake'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def stream_chunks(self, body, pieces=8):
+        # Yields the reply as chat.completion.chunk payloads, and the usage last when the request asks for it
+        prompt, content = self.reply_content(body)
+        prompt_tokens, completion_tokens = self._count_tokens(prompt, content)
+        size = max(1, -(-len(content) // pieces))
+        deltas = [{"role": "assistant", "content": ""}] + [{"content": content[i:i + size]}
+                                                           for i in range(0, len(content), size)]
+        for i, delta in enumerate(deltas):
+            yield {
+                "id": f"chatcmpl-{self.stats['requests']}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get('model', 'fake'),
+                "choices": [{"index": 0, "delta": delta,
+                             "finish_reason": "stop" if i == len(deltas) - 1 else None}],
+            }
+        if (body.get('stream_options') or {}).get('include_usage'):
+            yield {
+                "id": f"chatcmpl-{self.stats['requests']}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get('model', 'fake'),
+                "choices": [],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            }
+
+    def answer_bulk_file(self, request_path, result_path):
+        # Writes a results line in the batch API's output format for every request of a JSONL request file.
+        # The latency and the requests/min limit don't apply; malformed replies do.
+        with open(request_path, 'r', encoding='utf-8') as requests, open(result_path, 'w', encoding='utf-8') as results:
+            for number, line in enumerate(requests):
+                request = json.loads(line)
+                with self.lock:
+                    self.stats['requests'] += 1
+                results.write(json.dumps({
+                    "id": f"batch_req_{number}",
+                    "custom_id": request['custom_id'],
+                    "response": {"status_code": 200, "request_id": f"req_{number}", "body": self.complete(request['body'])},
+                    "error": None,
+                }, ensure_ascii=False) + '\n')
+
+    def _count_tokens(self, prompt, content):
+        prompt_tokens = self.tokenizer.get_token_count(prompt)
+        completion_tokens = self.tokenizer.get_token_count(content)
+        with self.lock:
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['completion_tokens'] += completion_tokens
+        return prompt_tokens, completion_tokens
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if not self.path.endswith('/chat/completions'):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+                    return
+                if not server._allow_request():
+                    self._send_json(429, {"error": {"message": "Rate limit reached for requests", "type": "requests",
+                                                    "code": "rate_limit_exceeded"}})
+                    return
+
+                latency = max(0.0, server.latency + server.random.uniform(-server.jitter, server.jitter))
+                if body.get('stream'):
+                    self._send_stream(server.stream_chunks(body), latency)
+                    return
+                time.sleep(latency)
+                self._send_json(200, server.complete(body))
+
+            def _send_stream(self, chunks, latency):
+                # No Content-Length: the stream ends when the connection is closed
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                chunks = list(chunks)
+                for chunk in chunks:
+                    time.sleep(latency / len(chunks))
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
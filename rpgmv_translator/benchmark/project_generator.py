@@ -0,0 +1,147 @@
+import json
+import os
+import random
+
+SUBJECTS = ['勇者', '魔王', '村人', '王様', '姫', 'スライム', '商人', '騎士', '魔法使い', '旅人']
+OBJECTS = ['剣', '盾', 'ポーション', '宝箱', '鍵', '地図', '手紙', '指輪', '薬草', '金貨']
+PREDICATES = ['を見つけた。', 'を探している。', 'が欲しい！', 'はどこだ？', 'をありがとう。', 'を持っていない…',
+              'を渡してくれ。', 'が壊れてしまった。', 'を売ってください。', 'はもう必要ない。']
+GREETINGS = ['こんにちは。', 'おはようございます！', 'よく来たな。', 'ようこそ、旅の方。', 'またね！']
+# A share of the lines carries the control codes found in real games
+CONTROL_CODES = ['\\C[2]', '\\N[1]', '\\V[5]', '\\I[64]', '\\!', '\\.']
+
+
+def _clause(rng):
+    return rng.choice(SUBJECTS) + 'は' + rng.choice(OBJECTS) + rng.choice(PREDICATES)
+
+
+def _line(rng, control_code_ratio):
+    # Mostly two clause lines, so that large projects have mostly distinct strings like real games
+    roll = rng.random()
+    if roll < 0.15:
+        line = rng.choice(GREETINGS)
+    elif roll < 0.4:
+        line = _clause(rng)
+    else:
+        line = _clause(rng) + _clause(rng)
+    if rng.random() < control_code_ratio:
+        code = rng.choice(CONTROL_CODES)
+        line = code + line if rng.random() < 0.5 else line + code
+    return line
+
+
+def _command(code, parameters, indent=0):
+    return {"code": code, "indent": indent, "parameters": parameters}
+
+
+def _event_commands(rng, lines, control_code_ratio):
+    commands = [_command(101, ["Actor1", rng.randrange(8), 0, 2, rng.choice(SUBJECTS)])]
+    for _ in range(lines):
+        commands.append(_command(401, [_line(rng, control_code_ratio)]))
+    if rng.random() < 0.3:
+        choices = [rng.choice(OBJECTS) + 'をください', 'いいえ']
+        commands.append(_command(102, [choices, 1, 0, 2, 0]))
+        for i, choice in enumerate(choices):
+            commands.append(_command(402, [i, choice]))
+            commands.append(_command(401, [_line(rng, control_code_ratio)], indent=1))
+            commands.append(_command(0, [], indent=1))
+        commands.append(_command(404, []))
+    commands.append(_command(205, [-1, {"list": [{"code": 1, "indent": None}], "repeat": False}]))
+    commands.append(_command(0, []))
+    return commands
+
+
+def _map(rng, map_id, events, lines_per_event, width, height, control_code_ratio):
+    map_events = [None]
+    for event_id in range(1, events + 1):
+        map_events.append({
+            "id": event_id,
+            "name": f"EV{event_id:03d}",
+            "note": "",
+            "pages": [{
+                "conditions": {"actorValid": False, "switch1Valid": False, "variableValid": False},
+                "directionFix": False,
+                "image": {"characterIndex": 0, "characterName": "People1", "direction": 2, "pattern": 1, "tileId": 0},
+                "list": _event_commands(rng, lines_per_event, control_code_ratio),
+                "moveRoute": {"list": [{"code": 0, "parameters": []}], "repeat": True, "skippable": False, "wait": False},
+                "moveType": 0,
+                "trigger": 0,
+            }],
+            "x": rng.randrange(width),
+            "y": rng.randrange(height),
+        })
+    return {
+        "autoplayBgm": False,
+        "displayName": rng.choice(['はじまりの村', '魔王城', '森の奥', '港町', '地下迷宮']) + str(map_id),
+        "height": height,
+        "note": "",
+        "tilesetId": 1,
+        "width": width,
+        # Six tile layers, the bulk of every map file
+        "data": [rng.choice([0, 2816, 2818, 3200]) for _ in range(width * height * 6)],
+        "events": map_events,
+    }
+
+
+def _database(rng, count, fields):
+    entries = [None]
+    for entry_id in range(1, count + 1):
+        entry = {"id": entry_id, "iconIndex": rng.randrange(256), "note": "", "traits": []}
+        for field in fields:
+            if field == 'name':
+                entry[field] = rng.choice(SUBJECTS + OBJECTS) + str(entry_id)
+            else:
+                entry[field] = _line(rng, 0)
+        entries.append(entry)
+    return entries
+
+
+def generate_project(directory, maps=20, events_per_map=20, lines_per_event=8, common_events=50,
+                     database_entries=100, map_size=40, control_code_ratio=0.1, seed=0):
+    """
+    Writes a synthetic RPG Maker MV project (www/data, www/img, www/audio) with Japanese
+    text. The same seed always produces the same project.
+    """
+    rng = random.Random(seed)
+    www = os.path.join(directory, 'www')
+    data_directory = os.path.join(www, 'data')
+    for folder in ('audio', 'data', 'img'):
+        os.makedirs(os.path.join(www, folder), exist_ok=True)
+
+    def write(file_name, data):
+        with open(os.path.join(data_directory, file_name), 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, separators=(',', ':'))
+
+    for map_id in range(1, maps + 1):
+        write(f'Map{map_id:03d}.json',
+              _map(rng, map_id, events_per_map, lines_per_event, map_size, map_size, control_code_ratio))
+    write('MapInfos.json', [None] + [{"id": i, "name": f"MAP{i:03d}", "order": i, "parentId": 0}
+                                     for i in range(1, maps + 1)])
+
+    write('CommonEvents.json', [None] + [
+        {"id": i, "name": f"共通{i}", "switchId": 1, "trigger": 0,
+         "list": _event_commands(rng, lines_per_event * 2, control_code_ratio)}
+        for i in range(1, common_events + 1)])
+
+    write('Actors.json', _database(rng, max(1, database_entries // 10), ('name', 'nickname', 'profile')))
+    write('Items.json', _database(rng, database_entries, ('name', 'description')))
+    write('Weapons.json', _database(rng, database_entries, ('name', 'description')))
+    write('Armors.json', _database(rng, database_entries, ('name', 'description')))
+    write('Skills.json', _database(rng, database_entries, ('name', 'description', 'message1', 'message2')))
+    write('States.json', _database(rng, max(1, database_entries // 4),
+                                   ('name', 'message1', 'message2', 'message3', 'message4')))
+    write('System.json', {
+        "gameTitle": "ベンチマーク物語",
+        "currencyUnit": "G",
+        "elements": ["", "物理", "炎", "氷", "雷"],
+        "skillTypes": ["", "魔法", "必殺技"],
+        "weaponTypes": ["", "剣", "斧"],
+        "armorTypes": ["", "一般防具", "魔法防具"],
+        "equipTypes": ["", "武器", "盾", "頭", "身体", "装飾品"],
+        "terms": {
+            "basic": ["レベル", "Lv", "ＨＰ", "HP", "ＭＰ", "MP"],
+            "commands": ["戦う", "逃げる", "攻撃", "防御", "アイテム", "スキル"],
+            "params": ["最大ＨＰ", "最大ＭＰ", "攻撃力", "防御力"],
+            "messages": {"actionFailure": "%1には効かなかった！", "victory": "%1の勝利！"},
+        },
+    })
@@ -0,0 +1,130 @@
+import argparse
+import pickle
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+import uuid
+from rpgmv_translator.benchmark.project_generator import _line
+from rpgmv_translator.project_store import ProjectStore
+from rpgmv_translator.string_pool import StringPool
+
+# Namespace of the uuid5 string IDs used before the integer IDs
+LEGACY_NAMESPACE = uuid.UUID('79c8c3dc-8626-4994-8e53-5d8f37d4b5c0')
+
+
+def make_files(lines, files, unique_ratio, seed=0):
+    # Lines of a large game spread over files, with (start, end) spans as in the data files
+    rng = random.Random(seed)
+    pool = [_line(rng, 0.0) + str(i) for i in range(max(1, int(lines * unique_ratio)))]
+    per_file = max(1, lines // files)
+    return [[(i * 64, i * 64 + 60, rng.choice(pool)) for i in range(per_file)] for _ in range(files)]
+
+
+def legacy_extract(files):
+    # uuid strings reused through a {text: id} map that grows with the game, and per-file dicts keyed by text
+    existing_entries = {}
+    sizes = []
+    for spans in files:
+        new_entries, groups, locations = {}, {}, []
+        for start, end, text in spans:
+            entry_uuid = existing_entries.get(text) or str(uuid.uuid5(LEGACY_NAMESPACE, text))
+            existing_entries[text] = entry_uuid
+            new_entries[text] = entry_uuid
+            groups.setdefault(text, 'Map001.json')
+            locations.append((start, end, entry_uuid, None))
+        sizes.append(len(pickle.dumps((new_entries, groups, locations))))
+    return existing_entries, sizes
+
+
+def pooled_extract(files):
+    sizes = []
+    for spans in files:
+        pool = StringPool()
+        for start, end, text in spans:
+            pool.locate(start, end, pool.add(text, 'Map001.json'))
+        sizes.append(len(pickle.dumps(pool)))
+    return sizes
+
+
+def fill_store(store, files):
+    for index, spans in enumerate(files):
+        pool = StringPool()
+        for start, end, text in spans:
+            pool.locate(start, end, pool.add(text, 'Map001.json'))
+        store.add_strings(pool.entries())
+        store.replace_locations(f'Map{index:03}.json', pool.locations())
+    store.save_translations((entry_id, text[::-1]) for entry_id, text in store.connection.execute(
+        "SELECT uuid, text FROM strings").fetchall())
+
+
+def legacy_reinject(store, files):
+    # Every translation loaded into one dict, then looked up for each span. Keyed by the integer IDs,
+    # which if anything favours it over the uuid strings it used to hold.
+    translations = dict(store.connection.execute("SELECT uuid, translated_text FROM translations"))
+    found = 0
+    for index in range(len(files)):
+        for start, end, entry_id, args in store.connection.execute(
+                "SELECT start, end, uuid, args FROM locations WHERE path = ? ORDER BY start", (f'Map{index:03}.json',)):
+            found += entry_id in translations
+    return found
+
+
+def joined_reinject(store, files):
+    found = 0
+    for index in range(len(files)):
+        for start, end, entry_id, args, translation in store.get_located_translations(f'Map{index:03}.json'):
+            found += translation is not None
+    return found
+
+
+def measure(func, *args):
+    # (result, seconds, peak traced bytes); timed in a run of its own, since tracing slows everything down
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run(lines=300000, files=300, unique_ratio=0.6):
+    files_spans = make_files(lines, files, unique_ratio)
+    print(f"Lines: {lines} in {files} files ({unique_ratio:.0%} distinct)")
+
+    (_, legacy_sizes), legacy_time, legacy_peak = measure(legacy_extract, files_spans)
+    pooled_sizes, pooled_time, pooled_peak = measure(pooled_extract, files_spans)
+    print(f"{'Extraction':<28}{'Time (s)':>10}{'Peak (MB)':>12}{'Result (KB/file)':>18}")
+    print(f"{'uuid5 strings, text maps':<28}{legacy_time:>10.2f}{legacy_peak / 1e6:>12.1f}"
+          f"{sum(legacy_sizes) / len(legacy_sizes) / 1024:>18.1f}")
+    print(f"{'integer IDs, StringPool':<28}{pooled_time:>10.2f}{pooled_peak / 1e6:>12.1f}"
+          f"{sum(pooled_sizes) / len(pooled_sizes) / 1024:>18.1f}")
+
+    directory = tempfile.mkdtemp(prefix='mvtrans-ids-')
+    try:
+        store = ProjectStore(directory)
+        fill_store(store, files_spans)
+        legacy_found, legacy_time, legacy_peak = measure(legacy_reinject, store, files_spans)
+        joined_found, joined_time, joined_peak = measure(joined_reinject, store, files_spans)
+        store.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(f"{'Reinjection lookups':<28}{'Time (s)':>10}{'Peak (MB)':>12}{'Found':>18}")
+    print(f"{'all translations in a dict':<28}{legacy_time:>10.2f}{legacy_peak / 1e6:>12.1f}{legacy_found:>18}")
+    print(f"{'per-file join in the store':<28}{joined_time:>10.2f}{joined_peak / 1e6:>12.1f}{joined_found:>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="String ID and lookup table micro-benchmark")
+    parser.add_argument('-lines', '--lines', type=int, default=300000, help='Number of text lines.')
+    parser.add_argument('-files', '--files', type=int, default=300, help='Number of data files.')
+    parser.add_argument('-unique', '--unique', type=float, default=0.6, help='Ratio of distinct lines.')
+    args = parser.parse_args()
+    run(args.lines, args.files, args.unique)
+
+
+if __name__ == '__main__':
+    main()
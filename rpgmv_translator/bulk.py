@@ -0,0 +1,176 @@
+import json
+import os
+from tqdm import tqdm
+from rpgmv_translator.batch_planner import PER_ENTRY_OVERHEAD
+from rpgmv_translator.metrics import BULK_PRICE_FACTOR
+from rpgmv_translator.translator.prompts import build_prompt, parse_reply, accept_entries
+
+# Endpoint of every request in a bulk file, as the batch API expects it
+BULK_ENDPOINT = '/v1/chat/completions'
+# custom_id of a request: the prefix followed by the ID of its batch in the store
+CUSTOM_ID_PREFIX = 'batch-'
+
+
+class BulkJob:
+    """
+    Offline translation through the OpenAI batch API, which answers within a day at half the
+    price of interactive requests. export() writes one chat completions request per planned
+    batch of the pending strings to a JSONL file; import_results() reads the JSONL files the
+    API returns and commits every reply through the controller, checked exactly like an
+    interactive reply. Entries that came back missing or invalid are pending again and go into
+    the next request file.
+    """
+
+    def __init__(self, controller, store):
+        self.controller = controller
+        self.store = store
+        # The batch API takes one model per request and no fallbacks, so the first candidate is used
+        self.model = controller.models[0]
+
+    def export(self, file_path=None):
+        """
+        Writes the requests for the pending strings to file_path, by default a file named after
+        its first batch in the project directory, and returns its path, or None when there is
+        nothing to send. Strings already out in a submitted batch are left out.
+        """
+        controller = self.controller
+        store = self.store
+        controller._count_missing_tokens(store)
+        submitted = store.get_submitted_ids()
+        rows = [row for row in store.get_pending_strings() if row[0] not in submitted]
+        rows = controller._apply_translation_memory(rows, store)
+        if not rows:
+            return None
+
+        plan = controller._plan(rows)
+        print(f"Bulk requests: {plan.requests} for {len(rows)} strings, "
+              f"{plan.total_tokens} tokens with replies (prompt overhead {plan.overhead_ratio:.1%})")
+        _, estimated_price, _ = controller._count_tokens_and_estimate_price(plan)
+        print(f"Estimated price for translation: ${estimated_price * BULK_PRICE_FACTOR:.2f} at the batch API's price")
+
+        store.save_split_entries((entry_id, controller.split_entries[entry_id][0]) for entry_id in plan.split_entries)
+        batch_ids = store.submit_batches(plan.batches)
+        file_path = file_path or os.path.join(store.directory, f'bulk_requests_{batch_ids[0]}.jsonl')
+        temporary_path = file_path + '.tmp'
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                for batch_id, (entries, _) in zip(batch_ids, plan.batches):
+                    file.write(json.dumps(self._request(batch_id, entries), ensure_ascii=False) + '\n')
+            os.replace(temporary_path, file_path)
+        except BaseException:
+            # Batches that never made it into a file would otherwise keep their strings out of every later file
+            store.release_batches(batch_ids, abandon=True)
+            raise
+        print(f"Wrote {len(batch_ids)} requests to {file_path}")
+        return file_path
+
+    def _request(self, batch_id, entries):
+        # The body is what GPTTranslator sends for the batch's first request
+        texts = list(dict.fromkeys(text for _, text in entries))
+        return {"custom_id": f"{CUSTOM_ID_PREFIX}{batch_id}", "method": "POST", "url": BULK_ENDPOINT,
+                "body": {"model": self.model, "messages": [{"role": "system", "content": build_prompt(texts)}]}}
+
+    def import_results(self, file_paths):
+        """
+        Commits the replies in the results files. Returns (batches committed, batches that failed);
+        lines of batches that are not waiting for results, e.g. of a file imported before, are skipped.
+        """
+        store = self.store
+        committed = {}
+        imported = failed_batches = skipped = 0
+        with tqdm(desc="Importing...", unit=' entries') as progress_bar:
+            for record in self._read_results(file_paths):
+                batch_id = self._batch_id(record.get('custom_id'))
+                entries = store.get_submitted_entries(batch_id) if batch_id is not None else None
+                if not entries:
+                    skipped += 1
+                    continue
+                self._load_split_entries(entries)
+                results, error = self._outcome(batch_id, entries, record)
+                failed, _ = self.controller._commit_event(store, ((batch_id, entries), results, error, True),
+                                                          committed, progress_bar)
+                store.release_batches([batch_id])
+                imported += 1
+                failed_batches += failed
+
+        print(f"Imported {imported} batches, {failed_batches} with entries to send again"
+              + (f", skipped {skipped} lines of batches not waiting for results" if skipped else ""))
+        self.controller._print_summary()
+        return imported, failed_batches
+
+    def _read_results(self, file_paths):
+        for file_path in file_paths:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                for number, line in enumerate(file, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        print(f"Skipping line {number} of {file_path}: not valid JSON")
+
+    def _batch_id(self, custom_id):
+        if not isinstance(custom_id, str) or not custom_id.startswith(CUSTOM_ID_PREFIX):
+            return None
+        suffix = custom_id[len(CUSTOM_ID_PREFIX):]
+        return int(suffix) if suffix.isdigit() else None
+
+    def _load_split_entries(self, entries):
+        # Chunks of a long entry may be spread over several batches of the file; the controller joins them
+        # as it does for interactive batches, so chunks already imported in this run are kept
+        split_entries = self.controller.split_entries
+        missing = {entry_id for entry_id, _ in entries if entry_id not in split_entries}
+        for entry_id, chunks in self.store.load_split_entries(missing).items():
+            split_entries[entry_id] = [chunks, {}, None]
+
+    def _outcome(self, batch_id, entries, record):
+        # (results, error) of one results line: (id, original_text, translated_text) triples for the
+        # entries whose translation passed the same checks as an interactive reply
+        texts = list(dict.fromkeys(text for _, text in entries))
+        content, usage, error = self._reply(record)
+        accepted = {}
+        reply = None
+        if content is not None:
+            reply = parse_reply(content)
+            if reply is None:
+                print(f"Batch {batch_id}: failed to find an id-keyed JSON object in the response.")
+            accepted, _ = accept_entries(texts, reply)
+
+        results = [(entry_id, text, accepted[text]) for entry_id, text in entries if text in accepted]
+        if error is None:
+            results, error = self.controller._batch_outcome(results, len(texts) - len(accepted))
+        self._record(batch_id, entries, texts, usage, len(accepted), len(results),
+                     content is not None and reply is None, error)
+        return results, error
+
+    def _reply(self, record):
+        # (content, usage, error) of a results line; see the output file format of the batch API
+        error = record.get('error')
+        if error:
+            return None, None, Exception(error.get('message') if isinstance(error, dict) else error)
+        response = record.get('response') or {}
+        body = response.get('body') or {}
+        if response.get('status_code') != 200:
+            message = (body.get('error') or {}).get('message') or f"status {response.get('status_code')}"
+            return None, None, Exception(message)
+        try:
+            content = body['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            return None, body.get('usage'), Exception("The response holds no message")
+        return content, body.get('usage'), None
+
+    def _record(self, batch_id, entries, texts, usage, accepted, translated, parse_failed, error):
+        metrics = self.controller.metrics
+        if metrics is None:
+            return
+        token_counter = self.controller.token_counter
+        usage = usage or {}
+        metrics.record_request('bulk', self.model, 0, len(texts), 0.0,
+                               prompt_tokens=usage.get('prompt_tokens'),
+                               completion_tokens=usage.get('completion_tokens'),
+                               estimated_prompt_tokens=token_counter.get_token_count(build_prompt(texts)),
+                               estimated_completion_tokens=sum(token_counter.get_token_counts(texts))
+                               + PER_ENTRY_OVERHEAD * len(texts),
+                               accepted=accepted, rejected=len(texts) - accepted, parse_failed=parse_failed,
+                               error=str(error) if error is not None else None, bulk=True)
+        metrics.record_batch(batch_id, len(entries), translated, 0.0, str(error) if error is not None else None)
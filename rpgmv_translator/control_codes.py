@@ -0,0 +1,50 @@
+import re
+
+# RPG Maker message escape codes: \C[2], \N[1], \V[5], \I[64] and plugin codes with an argument
+# such as \FS[24] or \n<Name>, single letter codes such as \G, and symbol codes such as \{ \} \! \. \| \^ \\
+CONTROL_CODE_REGEX = re.compile(r'\\[A-Za-z]+\[[^\]\n]*\]|\\[A-Za-z]+<[^>\n]*>|\\[A-Za-z]|\\[^\sA-Za-z0-9]')
+NUMBER_REGEX = re.compile(r'[0-9]+|[０-９]+')
+_TOKEN_REGEX = re.compile(f'(?P<code>{CONTROL_CODE_REGEX.pattern})|(?P<number>{NUMBER_REGEX.pattern})')
+# {c0} stands for the first control code of a line and {n0} for its first number. Source texts with
+# braces are never translated (see string_classifier), so placeholders can't clash with the text.
+PLACEHOLDER_REGEX = re.compile(r'\{([cn])(\d+)\}')
+
+
+def strip_control_codes(text):
+    return CONTROL_CODE_REGEX.sub('', text)
+
+
+def normalize(text):
+    """
+    Returns (template, args): the text with its control codes and numbers swapped for
+    placeholders, and the swapped values in placeholder order as {'c': [...], 'n': [...]}.
+    Lines that only differ in their codes or numbers share one template. args is None when
+    there was nothing to swap, or when the template would not give the text back exactly.
+    """
+    args = {'c': [], 'n': []}
+
+    def swap(match):
+        kind = 'c' if match.lastgroup == 'code' else 'n'
+        args[kind].append(match.group())
+        return f'{{{kind}{len(args[kind]) - 1}}}'
+
+    template = _TOKEN_REGEX.sub(swap, text)
+    if not args['c'] and not args['n']:
+        return text, None
+    if restore(template, args) != text:
+        return text, None
+    return template, args
+
+
+def restore(template, args):
+    # Puts a line's own codes and numbers back into a (translated) template. Returns None unless
+    # every placeholder of args appears exactly once, so a mangled translation is never written.
+    expected = sorted((kind, str(i)) for kind, values in args.items() for i in range(len(values)))
+    if sorted(PLACEHOLDER_REGEX.findall(template)) != expected:
+        return None
+    return PLACEHOLDER_REGEX.sub(lambda match: args[match.group(1)][int(match.group(2))], template)
+
+
+def placeholders_match(template, translation):
+    # Every placeholder of the template must appear in the translation exactly once, and nothing else
+    return sorted(PLACEHOLDER_REGEX.findall(template)) == sorted(PLACEHOLDER_REGEX.findall(translation))
@@ -1,111 +1,358 @@
 import os
+import io
 import json
-import csv
-import uuid
+import hashlib
 import re
-from rpgmv_translator.utils import is_valid_field_to_translate
+from concurrent.futures import ProcessPoolExecutor
+from rpgmv_translator.control_codes import normalize, restore
+from rpgmv_translator.json_stream import JSONStringScanner, patch_spans, string_value_spans
+from rpgmv_translator.project_store import ProjectStore
+from rpgmv_translator.rpgmaker_schema import has_text_layout, text_field_group, walk_text_fields
+from rpgmv_translator.snapshot_store import SNAPSHOT_DIRECTORY
+from rpgmv_translator.string_classifier import StringClassifier, KEEP, HINT
+from rpgmv_translator.string_pool import StringPool, string_id
+
+# Files larger than this are scanned with the streaming scanner instead of json.load
+STREAMING_THRESHOLD = 16 * 1024 * 1024
+
+# Per-process state for the extraction pool, set once by _init_extraction_worker
+_worker_handler = None
+
+
+def _init_extraction_worker(directory, settings):
+    # settings: the parent handler's extraction settings, see JSONHandler.extraction_settings
+    global _worker_handler
+    _worker_handler = JSONHandler(directory, **settings)
+
+
+def _extract_file_in_worker(file_path):
+    return _worker_handler._process_file(file_path)
+
+
+class _LocatedString(str):
+    # A string value of a parsed file that remembers the byte span of its token in the file
+    def __new__(cls, value, start, end):
+        located = super().__new__(cls, value)
+        located.start = start
+        located.end = end
+        return located
+
 
 class JSONHandler:
-    def __init__(self, directory, specific_file=None):
+    def __init__(self, directory, specific_file=None, store=None, streaming_threshold=STREAMING_THRESHOLD,
+                 schema_aware=True, source_language='Japanese', normalize_templates=True):
         self.directory = directory
         self.specific_file = specific_file
-        self.original_csv = os.path.join(directory, 'original.csv')
-        self.translated_csv = os.path.join(directory, 'translated.csv')
+        self.store = store
+        self.streaming_threshold = streaming_threshold
+        # Only visit the known text fields of RPG Maker data files, recursing into unknown files only
+        self.schema_aware = schema_aware
+        self.source_language = source_language
+        self.classifier = StringClassifier(source_language)
+        # Store lines as templates with placeholders for their control codes and numbers (see control_codes)
+        self.normalize_templates = normalize_templates
+        # Context group (file and event or database entry) of the string being extracted
+        self._current_group = None
+        # Lines stored as templates and the distinct templates they use, for the extraction report
+        self.template_lines = 0
+        self.templates = set()
 
-    def read_and_process_jsons(self):
-        existing_entries = self._load_existing_entries(self.original_csv)
-        new_entries = {}
+    def _get_store(self):
+        if self.store is None:
+            self.store = ProjectStore(self.directory)
+        return self.store
 
+    def _list_json_files(self):
+        # Sorted so that extraction order, and therefore string order, is the same on every run
+        file_paths = []
         for dirpath, dirnames, filenames in os.walk(self.directory):
+            dirnames[:] = [name for name in dirnames if name != SNAPSHOT_DIRECTORY]
             for file_name in filenames:
                 if file_name.endswith('.json') and (self.specific_file is None or file_name == self.specific_file):
-                    file_path = os.path.join(dirpath, file_name)
-                    with open(file_path, 'r', encoding='utf-8') as file:
-                        data = json.load(file)
-                        self._process_json(data, existing_entries, new_entries)
-                    with open(file_path, 'w', encoding='utf-8') as file:
-                        json.dump(data, file, ensure_ascii=False, indent=4)
+                    file_paths.append(os.path.join(dirpath, file_name))
+        return sorted(file_paths)
+
+    def file_hash(self, file_path):
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _relative_path(self, file_path):
+        return os.path.relpath(file_path, self.directory).replace(os.sep, '/')
+
+    def find_changed_files(self):
+        # Files whose content is not what the translator last wrote: new files and files replaced by a game update
+        known_hashes = self._get_store().load_file_hashes()
+        return [file_path for file_path in self._list_json_files()
+                if known_hashes.get(self._relative_path(file_path)) != self.file_hash(file_path)]
+
+    def record_current_files(self, needs_update):
+        # Takes the files as they are now as the translator's output, for projects started before the manifest
+        self._get_store().record_files((self._relative_path(file_path), self.file_hash(file_path), needs_update)
+                                       for file_path in self._list_json_files())
+
+    def read_and_process_jsons(self, workers=1):
+        # Only files that changed since the last run are extracted; the others keep their placeholders or translations
+        for file_path, pool in self.extract_files(self.find_changed_files(), workers):
+            self.commit_file(file_path, pool)
+        self.report_templates()
+
+    def extract_files(self, file_paths, workers=1):
+        # Yields (file_path, StringPool) in file order without touching the store, so that extraction can run
+        # on another thread than the one that owns the store. IDs come from the texts, so workers share nothing.
+        if workers > 1 and len(file_paths) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_extraction_worker,
+                                     initargs=(self.directory, self.extraction_settings())) as executor:
+                # map() returns the per-file pools in file order, which keeps the string order deterministic
+                yield from zip(file_paths, executor.map(_extract_file_in_worker, file_paths, chunksize=4))
+        else:
+            for file_path in file_paths:
+                yield file_path, self._process_file(file_path)
+
+    def extraction_settings(self):
+        # Keyword arguments that give a worker's handler the same extraction results as this one
+        return {'streaming_threshold': self.streaming_threshold, 'schema_aware': self.schema_aware,
+                'source_language': self.source_language, 'normalize_templates': self.normalize_templates}
+
+    def report_templates(self):
+        if self.template_lines:
+            print(f"{self.template_lines} lines with control codes or numbers share {len(self.templates)} templates")
+
+    def commit_file(self, file_path, pool):
+        # Each file's strings are stored together with its manifest entry, so an interrupted extraction resumes per file
+        store = self._get_store()
+        relative_path = self._relative_path(file_path)
+        for text_id, args in zip(pool.location_ids, pool.args):
+            if args is not None:
+                self.template_lines += 1
+                self.templates.add(text_id)
+        store.add_strings(pool.entries())
+        store.replace_locations(relative_path, pool.locations())
+        store.record_files([(relative_path, self.file_hash(file_path), True)], indexed=True)
+
+    def _should_stream(self, file_path):
+        return self.streaming_threshold is not None and os.path.getsize(file_path) > self.streaming_threshold
+
+    def _rewrite_streaming(self, file_path, process_string):
+        # Rewrites the file string by string; only the largest single string is ever held in memory
+        temp_path = file_path + '.tmp'
+        with open(file_path, 'rb') as file, open(temp_path, 'wb') as output:
+            scanner = JSONStringScanner(file, output)
+            for path, value, start, end in scanner:
+                updated_value = process_string(value)
+                if updated_value != value:
+                    scanner.replace(updated_value)
+            scanner.finish()
+        os.replace(temp_path, file_path)
+
+    def _process_file(self, file_path):
+        # Returns a StringPool with the file's translatable strings and their byte spans. The file itself
+        # is left untouched.
+        file_name = os.path.basename(file_path)
+        self._current_group = file_name
+        pool = StringPool()
+        process_string = lambda value: self._process_string(value, pool)
+        if self._should_stream(file_path):
+            with open(file_path, 'rb') as file:
+                self._scan_strings(file, file_name, pool)
+            return pool
+
+        with open(file_path, 'rb') as file:
+            content = file.read()
+        data = json.loads(content)
+        try:
+            self._locate_strings(data, content, iter(string_value_spans(content)))
+        except ValueError:
+            # Duplicate keys hide values from json.loads; fall back to the strings the scanner sees
+            self._scan_strings(io.BytesIO(content), file_name, pool)
+            return pool
+
+        # Classify all of the file's candidate strings in one batch first; processing them then only looks decisions up
+        located = []
+        def collect(value):
+            located.append((value, self._current_group))
+            return value
+        on_group = lambda group: setattr(self, '_current_group', f"{file_name}#{group}")
+        if self.schema_aware and walk_text_fields(file_name, data, collect, on_group):
+            # The schema visits the fields in its own order; the strings are added in document order, as
+            # _scan_strings adds them, so a file gives the same strings and batches however it is read
+            located.sort(key=lambda item: item[0].start)
+            self.classifier.classify_batch([value for value, _ in located])
+            for value, group in located:
+                self._current_group = group
+                process_string(value)
+            return pool
+
+        candidates = []
+        self._collect_strings(data, candidates)
+        self.classifier.classify_batch(candidates)
+        self._process_json(data, pool)
+        return pool
+
+    def _scan_strings(self, file, file_name, pool):
+        # Extraction without the object tree. Known files keep only the strings at the paths of their
+        # text fields, so that both ways of reading a file find the same strings.
+        schema_aware = self.schema_aware and has_text_layout(file_name)
+        scanner = JSONStringScanner(file, scalar_keys=('code',))
+        code_at = lambda depth: scanner.scalar(depth, 'code')
+        for path, value, start, end in scanner:
+            if schema_aware:
+                is_text, group = text_field_group(file_name, path, code_at)
+                if not is_text:
+                    continue
+                self._current_group = f"{file_name}#{group}" if group is not None else file_name
+            self._process_string(_LocatedString(value, start, end), pool)
+
+    def _locate_strings(self, data, content, spans, root=True):
+        # Swaps every string value for a _LocatedString; json.loads and the spans both follow document order
+        for key, value in (data.items() if isinstance(data, dict) else enumerate(data)):
+            if isinstance(value, str):
+                start, end = next(spans, (None, None))
+                if start is None or self._decode_token(content, start, end) != value:
+                    raise ValueError("String values do not match the scanned file")
+                data[key] = _LocatedString(value, start, end)
+            elif isinstance(value, (dict, list)):
+                self._locate_strings(value, content, spans, root=False)
+        if root and next(spans, None) is not None:
+            raise ValueError("String values do not match the scanned file")
 
-        self._write_new_entries_to_csv(new_entries, self.original_csv)
+    def _decode_token(self, content, start, end):
+        token = content[start + 1:end - 1]
+        return json.loads(content[start:end]) if b'\\' in token else token.decode('utf-8')
 
-    def _process_json(self, data, existing_entries, new_entries):
+    def _process_json(self, data, pool):
         if isinstance(data, dict):
             for key, value in data.items():
                 if isinstance(value, (dict, list)):
-                    self._process_json(value, existing_entries, new_entries)
+                    self._process_json(value, pool)
                 elif isinstance(value, str):
-                    data[key] = self._process_string(value, existing_entries, new_entries)
+                    data[key] = self._process_string(value, pool)
         elif isinstance(data, list):
             for i, item in enumerate(data):
                 if isinstance(item, (dict, list)):
-                    self._process_json(item, existing_entries, new_entries)
+                    self._process_json(item, pool)
                 elif isinstance(item, str):
-                    data[i] = self._process_string(item, existing_entries, new_entries)
+                    data[i] = self._process_string(item, pool)
 
-    def _process_string(self, value, existing_entries, new_entries):
-        if self._is_xml_like(value):
-            return self._process_xml_like_field(value, existing_entries, new_entries)
-        elif is_valid_field_to_translate(value):
-            entry_uuid = existing_entries.get(value, str(uuid.uuid4()))
-            existing_entries[value] = entry_uuid
-            new_entries[value] = entry_uuid
-            return entry_uuid
-        else:
-            return value
+    def _collect_strings(self, data, strings):
+        if isinstance(data, dict):
+            data = data.values()
+        for item in data:
+            if isinstance(item, str):
+                strings.append(item)
+            elif isinstance(item, (dict, list)):
+                self._collect_strings(item, strings)
 
-    def _load_existing_entries(self, csv_path):
-        entries = {}
-        try:
-            with open(csv_path, mode='r', encoding='utf-8') as csv_file:
-                reader = csv.reader(csv_file)
-                for row in reader:
-                    entries[row[1]] = row[0]  # Assuming format: uuid, text
-        except FileNotFoundError:
-            pass
-        return entries
+    def _process_string(self, value, pool):
+        # value is a _LocatedString; its span is recorded when it holds something to translate
+        decision = self.classifier.classify(value)
+        if decision == HINT:
+            if self._process_xml_like_field(value, pool):
+                pool.locate(value.start, value.end)
+        elif decision == KEEP:
+            text, args = normalize(str(value)) if self.normalize_templates else (str(value), None)
+            args = json.dumps(args, ensure_ascii=False, separators=(',', ':')) if args is not None else None
+            pool.locate(value.start, value.end, pool.add(text, self._current_group), args)
+        return value
 
     def _is_xml_like(self, value):
         # Determine if the value is XML-like
         return '<' in value and '>' in value
 
-    def _process_xml_like_field(self, value, existing_entries, new_entries):
-        # Process only specific parts of the XML-like field
-        def replace_func(match):
-            original_text = match.group(1)
-            entry_uuid = existing_entries.get(original_text, str(uuid.uuid4()))
-            existing_entries[original_text] = entry_uuid
-            new_entries[original_text] = entry_uuid
-            return f"<hintId:{entry_uuid}>"
+    def _process_xml_like_field(self, value, pool):
+        # Extracts only the <hint:...> parts of the XML-like field; returns whether there were any
+        hints = re.findall(r'<hint:(.*?)>', value)
+        for original_text in hints:
+            pool.add(original_text, self._current_group)
+        return bool(hints)
 
-        return re.sub(r'<hint:(.*?)>', replace_func, value)
+    def update_jsons_with_translations(self):
+        # Only files extracted since their last reinjection are considered, and only the ones with
+        # translated strings are rewritten
+        store = self._get_store()
+        legacy_translations = None
+        for relative_path, indexed in store.get_files_needing_update():
+            file_path = os.path.join(self.directory, relative_path)
+            if not os.path.exists(file_path):
+                continue
+            if indexed:
+                self.reinject_file(file_path)
+            else:
+                if legacy_translations is None:
+                    legacy_translations = store.load_legacy_translations()
+                self._update_placeholder_file(file_path, legacy_translations)
 
-    def _write_new_entries_to_csv(self, new_entries, csv_path):
-        # Check if the file is new or empty (i.e., needs a header)
-        file_is_new = not os.path.exists(csv_path) or os.stat(csv_path).st_size == 0
+    def reinject_file(self, file_path):
+        # Patches one extracted file with the translations its strings have so far. The store joins each
+        # span with its translation, so no table of all the translations is ever loaded.
+        self._patch_file(file_path, self._get_store().get_located_translations(self._relative_path(file_path)))
 
-        with open(csv_path, mode='a', encoding='utf-8', newline='') as csv_file:
-            writer = csv.writer(csv_file)
+    def _patch_file(self, file_path, locations):
+        # Swaps the byte spans of translated strings in the original bytes, keeping the file's own formatting
+        store = self._get_store()
+        relative_path = self._relative_path(file_path)
+        # The spans are only valid for the content they were recorded against, which is the hash stored at
+        # extraction until the file is rewritten
+        record = store.get_file_record(relative_path)
+        if record is None or not record[1] or record[0] != self.file_hash(file_path):
+            raise ValueError(f"{relative_path} changed since its strings were extracted. "
+                             "Run the translation again to extract it anew.")
 
-            # If the file is new, write the header first
-            if file_is_new:
-                writer.writerow(['uuid', 'text'])
+        def replace_with(translation):
+            encoded = json.dumps(translation, ensure_ascii=False).encode('utf-8')
+            return lambda token: encoded
 
-            # Write the new entries
-            for text, entry_uuid in new_entries.items():
-                writer.writerow([entry_uuid, text])
+        def replace_hint(match):
+            # <hint:...> texts have no span of their own; their IDs are derived from the text
+            return "<hint:{}>".format(store.get_translation(string_id(match.group(1))) or match.group(1))
 
-    def update_jsons_with_translations(self):
-        translated_entries = self._load_translated_entries(self.translated_csv, self.original_csv)
+        def replace_hints(token):
+            value = json.loads(token)
+            updated = re.sub(r'<hint:(.*?)>', replace_hint, value)
+            return token if updated == value else json.dumps(updated, ensure_ascii=False).encode('utf-8')
 
-        for dirpath, dirnames, filenames in os.walk(self.directory):
-            for file_name in filenames:
-                if file_name.endswith('.json') and (self.specific_file is None or file_name == self.specific_file):
-                    file_path = os.path.join(dirpath, file_name)
-                    with open(file_path, 'r', encoding='utf-8') as file:
-                        data = json.load(file)
-                        self._update_json(data, translated_entries)
-                    with open(file_path, 'w', encoding='utf-8') as file:
-                        json.dump(data, file, ensure_ascii=False, indent=4)
+        spans = []
+        for start, end, entry_id, args, translation in locations:
+            if entry_id is None:
+                spans.append((start, end, replace_hints))
+            elif translation is not None:
+                if args is not None:
+                    # Translations are checked for their placeholders when accepted; anything else keeps the original
+                    translation = restore(translation, json.loads(args))
+                    if translation is None:
+                        continue
+                spans.append((start, end, replace_with(translation)))
+
+        temp_path = file_path + '.tmp'
+        changed = 0
+        if spans:
+            with open(file_path, 'rb') as source, open(temp_path, 'wb') as output:
+                changed = patch_spans(source, output, spans)
+        if not changed:
+            # Nothing translated: the file is not touched
+            if spans:
+                os.remove(temp_path)
+            store.mark_file_updated(relative_path, record[0])
+            return
+        # Recorded first: should the run stop before the replace, the original is only seen as changed and re-extracted
+        store.mark_file_updated(relative_path, self.file_hash(temp_path))
+        os.replace(temp_path, file_path)
+
+    def _update_placeholder_file(self, file_path, translated_entries):
+        # Files extracted by older versions hold uuid placeholders and are rewritten as a whole;
+        # translated_entries maps those uuids to the texts to write
+        if self._should_stream(file_path):
+            self._rewrite_streaming(file_path, lambda value: self._update_string(value, translated_entries))
+        else:
+            # Reinjection always recurses so that placeholders written by a generic extraction are found too
+            with open(file_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+                self._update_json(data, translated_entries)
+            with open(file_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False, indent=4)
+        self._get_store().mark_file_updated(self._relative_path(file_path), self.file_hash(file_path))
 
     def _update_json(self, data, translated_entries):
         if isinstance(data, dict):
@@ -113,14 +360,18 @@ class JSONHandler:
                 if isinstance(value, (dict, list)):
                     self._update_json(value, translated_entries)
                 elif isinstance(value, str):
-                    if self._is_xml_like(value):
-                        updated_value = self._update_xml_like_field(value, translated_entries)
-                        data[key] = updated_value
-                    elif value in translated_entries:
-                        data[key] = translated_entries[value]
+                    data[key] = self._update_string(value, translated_entries)
         elif isinstance(data, list):
-            for item in data:
-                self._update_json(item, translated_entries)
+            for i, item in enumerate(data):
+                if isinstance(item, (dict, list)):
+                    self._update_json(item, translated_entries)
+                elif isinstance(item, str):
+                    data[i] = self._update_string(item, translated_entries)
+
+    def _update_string(self, value, translated_entries):
+        if self._is_xml_like(value):
+            return self._update_xml_like_field(value, translated_entries)
+        return translated_entries.get(value, value)
 
     def _update_xml_like_field(self, value, translated_entries):
         # Update only specific parts of the XML-like field
@@ -130,17 +381,3 @@ class JSONHandler:
             return f"<hint:{translated_text}>"
 
         return re.sub(r'<hintId:(.*?)>', replace_func, value)
-
-    def _load_translated_entries(self, translated_csv, original_csv):
-        entries = {}
-        try:
-            with open(translated_csv, mode='r', encoding='utf-8') as csv_file:
-                reader = csv.reader(csv_file)
-                for row in reader:
-                    entries[row[0]] = row[1]  # Assuming format: uuid, translated_text
-        except FileNotFoundError:
-            with open(original_csv, mode='r', encoding='utf-8') as csv_file:
-                reader = csv.reader(csv_file)
-                for row in reader:
-                    entries[row[0]] = row[1]  # Assuming format: uuid, original_text
-        return entries
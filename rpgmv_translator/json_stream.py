@@ -0,0 +1,204 @@
+import json
+import re
+
+_WHITESPACE = re.compile(rb'[ \t\r\n]*')
+# Rest of a string token after its opening quote; fails to match while the closing quote is not buffered yet
+_STRING_BODY = re.compile(rb'(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR = re.compile(rb'[-+0-9.eEtrufalsn]+')
+# Comma separated scalars such as the tile data of a map, skipped in one regex match
+_SCALAR_RUN = re.compile(rb'[-+0-9.eEtrufalsn]+(?:[ \t\r\n]*,[ \t\r\n]*[-+0-9.eEtrufalsn]+)*')
+
+# A whole string token, followed by the colon when it is an object key
+_STRING_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"([ \t\r\n]*:)?', re.DOTALL)
+
+_OPEN_OBJECT, _CLOSE_OBJECT = ord('{'), ord('}')
+_OPEN_ARRAY, _CLOSE_ARRAY = ord('['), ord(']')
+_COMMA, _COLON, _QUOTE = ord(','), ord(':'), ord('"')
+
+
+class JSONStringScanner:
+    """
+    Walks a JSON file chunk by chunk without building the object tree and yields
+    (path, value, start, end) for every string value, where start/end are the byte
+    offsets of the string token. Memory use is bounded by the largest single string.
+
+    When an output file is given, the input is copied to it as it is consumed and
+    replace() swaps the string that was just yielded for a new value. The scalar values
+    of the object members named in scalar_keys, such as an event command's 'code', are
+    kept while their object is open and can be read with scalar().
+    """
+
+    def __init__(self, file, output=None, chunk_size=1 << 16, scalar_keys=()):
+        self.file = file
+        self.output = output
+        self.chunk_size = chunk_size
+        self.scalar_keys = frozenset(scalar_keys)
+        # Frames are [key or index, is_object, expecting_key, {scalar key: value}], one per open container
+        self.stack = []
+        self.buffer = b''
+        self.pos = 0
+        # Absolute offset of buffer[0] in the input
+        self.offset = 0
+        # Absolute offset up to which the input has been copied to the output
+        self.written = 0
+        self.start = None
+        self.end = None
+
+    def _fill(self):
+        # Drops the consumed part of the buffer, copying it to the output first, then reads the next chunk
+        if self.output is not None:
+            self.output.write(self.buffer[self.written - self.offset:self.pos])
+            self.written = self.offset + self.pos
+        self.buffer = self.buffer[self.pos:]
+        self.offset += self.pos
+        self.pos = 0
+
+        chunk = self.file.read(self.chunk_size)
+        self.buffer += chunk
+        return bool(chunk)
+
+    def _peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+
+    def __iter__(self):
+        stack = self.stack
+
+        while True:
+            char = self._peek()
+            if char is None:
+                break
+
+            if char == _OPEN_OBJECT or char == _OPEN_ARRAY:
+                if stack and not stack[-1][1]:
+                    stack[-1][0] += 1
+                stack.append([None, True, True, {}] if char == _OPEN_OBJECT else [-1, False, False, None])
+                self.pos += 1
+            elif char == _CLOSE_OBJECT or char == _CLOSE_ARRAY:
+                stack.pop()
+                self.pos += 1
+            elif char == _COMMA:
+                if stack[-1][1]:
+                    stack[-1][2] = True
+                self.pos += 1
+            elif char == _COLON:
+                stack[-1][2] = False
+                self.pos += 1
+            elif char == _QUOTE:
+                value = self._read_string()
+                if stack and stack[-1][1] and stack[-1][2]:
+                    stack[-1][0] = value
+                    continue
+                if stack and not stack[-1][1]:
+                    stack[-1][0] += 1
+                yield tuple(frame[0] for frame in stack), value, self.start, self.end
+            else:
+                self._skip_scalars(stack)
+
+    def _read_string(self):
+        start = self.offset + self.pos
+        while True:
+            match = _STRING_BODY.match(self.buffer, self.pos + 1)
+            if match:
+                break
+            if not self._fill():
+                raise ValueError(f"Unterminated string at byte {start}")
+
+        value = json.loads(self.buffer[self.pos:match.end()])
+        self.pos = match.end()
+        self.start, self.end = start, self.offset + self.pos
+        return value
+
+    def _skip_scalars(self, stack):
+        in_array = stack and not stack[-1][1]
+        pattern = _SCALAR_RUN if in_array else _SCALAR
+        while True:
+            match = pattern.match(self.buffer, self.pos)
+            if match is None:
+                raise ValueError(f"Invalid JSON at byte {self.offset + self.pos}")
+            if match.end() < len(self.buffer):
+                break
+
+            # The run may continue in the next chunk. Inside long arrays, consume the values
+            # that are known to be complete so the buffer doesn't grow with the array.
+            last_comma = self.buffer.rfind(b',', self.pos, match.end()) if in_array else -1
+            if last_comma != -1:
+                stack[-1][0] += self.buffer.count(b',', self.pos, last_comma + 1)
+                self.pos = last_comma + 1
+                return
+            if not self._fill():
+                match = pattern.match(self.buffer, self.pos)
+                break
+
+        if in_array:
+            stack[-1][0] += match.group().count(b',') + 1
+        elif stack and stack[-1][0] in self.scalar_keys:
+            try:
+                stack[-1][3][stack[-1][0]] = json.loads(match.group())
+            except ValueError:
+                pass
+        self.pos = match.end()
+
+    def scalar(self, depth, key):
+        # Scalar member key of the object at depth of the path just yielded, or None
+        if depth >= len(self.stack) or not self.stack[depth][1]:
+            return None
+        return self.stack[depth][3].get(key)
+
+    def replace(self, value):
+        # Replaces the string token that was just yielded in the output
+        self.output.write(self.buffer[self.written - self.offset:self.start - self.offset])
+        self.output.write(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        self.written = self.end
+
+    def finish(self):
+        # Copies whatever is left of the input to the output
+        if self.output is None:
+            return
+        self.output.write(self.buffer[self.written - self.offset:])
+        self.written = self.offset + len(self.buffer)
+        for chunk in iter(lambda: self.file.read(self.chunk_size), b''):
+            self.output.write(chunk)
+
+
+def string_value_spans(content):
+    """
+    Returns the (start, end) byte offsets of every string value token of an in-memory JSON
+    document in document order, object keys excluded. One regex pass, for files small enough
+    to be read whole.
+    """
+    return [(match.start(), match.end()) for match in _STRING_TOKEN.finditer(content) if match.group(1) is None]
+
+
+def patch_spans(source, output, spans, chunk_size=1 << 16):
+    """
+    Copies the source file to output, swapping byte spans. spans: (start, end, replace) sorted
+    by start, where replace(token) returns the bytes written instead of the original token.
+    Returns the number of spans whose bytes changed.
+    """
+    position = 0
+    changed = 0
+    for start, end, replace in spans:
+        _copy(source, output, start - position, chunk_size)
+        token = source.read(end - start)
+        replacement = replace(token)
+        output.write(replacement)
+        changed += replacement != token
+        position = end
+    _copy(source, output, None, chunk_size)
+    return changed
+
+
+def _copy(source, output, size, chunk_size):
+    # Copies size bytes, or everything that is left when size is None
+    while size is None or size > 0:
+        chunk = source.read(chunk_size if size is None else min(size, chunk_size))
+        if not chunk:
+            return
+        output.write(chunk)
+        if size is not None:
+            size -= len(chunk)
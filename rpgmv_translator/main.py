@@ -1,9 +1,28 @@
+import time
+_start_time = time.perf_counter()
+
 import argparse
+import importlib
 import os
 import sys
-from rpgmv_translator.translate import RPGMVTranslator  # Import the RPGMVTranslator class
-import rpgmv_translator.config_manager as config_manager
-import rpgmv_translator.utils as utils
+
+# Modules are imported by the command that needs them, so that commands which don't
+# translate never pay for openai, nltk or the Sudachi dictionary.
+_import_times = []
+
+
+def _import(module_name):
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _import_times.append((module_name, time.perf_counter() - start))
+    return module
+
+
+def _print_timings():
+    for module_name, seconds in _import_times:
+        print(f"Import {module_name}: {seconds * 1000:.1f} ms")
+    print(f"Total time: {(time.perf_counter() - _start_time) * 1000:.1f} ms")
+
 
 def main():
     parser = argparse.ArgumentParser(description="RPGMV Translator Command Line Tool")
@@ -11,31 +30,107 @@ def main():
     parser.add_argument('-showkey', '--showkey', action='store_true', help='Show API key')
     parser.add_argument('-reset', '--reset', action='store_true', help='Reset config')
     parser.add_argument('-translate', '--translate', type=str, nargs='?', const=os.getcwd(), default=None, help='Start translating. Specify the directory path (optional).')
-    parser.add_argument('-restore', '--restore', type=str, nargs='?', const=os.getcwd(), default=None, help='Restore data from .old backups. Specify the directory path (optional).')
+    parser.add_argument('-concurrency', '--concurrency', type=int, default=1, help='Number of batches sent to the API at the same time.')
+    parser.add_argument('-rpm', '--rpm', type=int, default=None, help='Requests per minute allowed by the API (optional).')
+    parser.add_argument('-tpm', '--tpm', type=int, default=None, help='Tokens per minute allowed by the API (optional).')
+    parser.add_argument('-baseurl', '--baseurl', type=str, default=None, help='Base URL of an OpenAI-compatible API (optional).')
+    parser.add_argument('-backends', '--backends', type=str, default=None, help='JSON file listing OpenAI-compatible backends to spread the batches over (optional).')
+    parser.add_argument('-metrics', '--metrics', type=str, default=None, help='JSONL file receiving a record per API request and batch (optional, default metrics.jsonl in the package).')
+    parser.add_argument('-nometrics', '--nometrics', action='store_true', help='Do not record metrics.')
+    parser.add_argument('-prometheus', '--prometheus', type=str, default=None, help='Write the run metrics to this file in Prometheus text format (optional).')
+    parser.add_argument('-models', '--models', type=str, default=None, help='Comma separated models to choose from for each batch, cheapest first (optional).')
+    parser.add_argument('-escalationmodel', '--escalationmodel', type=str, default='default', help='Model for the entries that keep failing; "none" disables escalation. The default is gpt-4 on the official API and none on a self-hosted server.')
+    parser.add_argument('-escalationbudget', '--escalationbudget', type=float, default=None, help='Maximum dollars spent on escalated entries (optional).')
+    parser.add_argument('-escalationshare', '--escalationshare', type=float, default=None, help='Maximum share of the entries that may be escalated, e.g. 0.05 (optional).')
+    parser.add_argument('-latencyweight', '--latencyweight', type=float, default=0.0, help='Dollars a second of latency per entry is worth when choosing among the models; 0 picks the cheapest per accepted entry.')
+    parser.add_argument('-contextbudget', '--contextbudget', type=int, default=4096, help='Tokens per request, prompt and expected reply included.')
+    parser.add_argument('-stream', '--stream', action='store_true', help='Stream replies and commit each entry as soon as it arrives.')
+    parser.add_argument('-pipeline', '--pipeline', action='store_true', help='Translate and rewrite files while the others are still being extracted.')
+    parser.add_argument('-bulkexport', '--bulkexport', type=str, nargs='?', const='', default=None, help='With -translate: write the batches to a JSONL request file for the OpenAI batch API instead of sending them. Specify the file path (optional).')
+    parser.add_argument('-bulkimport', '--bulkimport', type=str, nargs='+', default=None, help='With -translate: import the JSONL results files of the OpenAI batch API and write the failed entries to a follow-up request file.')
+    parser.add_argument('-workers', '--workers', type=int, default=1, help='Number of processes used to extract strings from the JSON files.')
+    parser.add_argument('-nomemory', '--nomemory', action='store_true', help='Do not use the cross-project translation memory.')
+    parser.add_argument('-clearmemory', '--clearmemory', type=str, nargs='?', const='all', default=None, help='Clear the translation memory. Specify a prompt version to only clear its entries (optional).')
+    parser.add_argument('-restore', '--restore', type=str, nargs='?', const=os.getcwd(), default=None, help='Restore the original data files. Specify the directory path (optional).')
+    parser.add_argument('-snapshot', '--snapshot', type=int, default=None, help='Snapshot to restore instead of the originals (see -snapshots).')
+    parser.add_argument('-snapshots', '--snapshots', type=str, nargs='?', const=os.getcwd(), default=None, help='List the snapshots of a project. Specify the directory path (optional).')
+    parser.add_argument('-timing', '--timing', action='store_true', help='Print import and total times of the command.')
 
     args = parser.parse_args()
+    if (args.bulkexport is not None or args.bulkimport) and args.translate is None:
+        parser.error("-bulkexport and -bulkimport need -translate with the game directory")
+    if args.latencyweight < 0:
+        parser.error("-latencyweight must not be negative")
 
     if args.addkey:
+        config_manager = _import('rpgmv_translator.config_manager')
         config_manager.add_key(args.addkey)
         print("API key added to config.")
     elif args.showkey:
+        config_manager = _import('rpgmv_translator.config_manager')
         key = config_manager.show_key()
         print(f"API Key: {key}")
     elif args.reset:
+        config_manager = _import('rpgmv_translator.config_manager')
         config_manager.reset_config()
         print("Config reset.")
+    elif args.clearmemory is not None:
+        memory = _import('rpgmv_translator.translation_memory').TranslationMemory()
+        removed = memory.invalidate(None if args.clearmemory == 'all' else args.clearmemory)
+        memory.close()
+        print(f"Removed {removed} entries from the translation memory.")
     elif args.restore is not None:
         try:
-            utils.restore_from_backup(args.restore)
+            _import('rpgmv_translator.utils').restore_from_backup(args.restore, args.snapshot)
             print(f"Data successfully restored from backups in {args.restore}")
         except Exception as e:
             print(f"Error: {e}")
+    elif args.snapshots is not None:
+        snapshots = _import('rpgmv_translator.snapshot_store').SnapshotStore(args.snapshots)
+        snapshot_list = snapshots.list()
+        for snapshot in snapshot_list:
+            created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['created_at']))
+            print(f"{snapshot['id']:>4}  {created_at}  {snapshot['label'] or '':<12}{len(snapshot['files'])} files")
+        if snapshot_list:
+            print(f"Snapshot store size: {snapshots.disk_usage() / 1024 / 1024:.1f} MB")
+        else:
+            print(f"No snapshots in {args.snapshots}")
     elif args.translate is not None:
         directory = args.translate
         print("Starting translation...")
-        translator = RPGMVTranslator(directory)
-        translator.translate()
-        print("Translation completed.")
+        RPGMVTranslator = _import('rpgmv_translator.translate').RPGMVTranslator
+        backends = None
+        if args.backends:
+            backends = _import('rpgmv_translator.translator.backends').load_backend_configs(args.backends)
+        metrics_file = None
+        if not args.nometrics:
+            metrics_file = args.metrics or _import('rpgmv_translator.metrics').METRICS_FILE
+        translator = RPGMVTranslator(directory, concurrency=args.concurrency,
+                                     requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+                                     use_translation_memory=not args.nomemory,
+                                     extraction_workers=args.workers, base_url=args.baseurl,
+                                     context_budget=args.contextbudget, streaming=args.stream,
+                                     backends=backends, metrics_file=metrics_file,
+                                     prometheus_file=args.prometheus,
+                                     models=args.models.split(',') if args.models else None,
+                                     escalation_model=None if args.escalationmodel.lower() == 'none' else args.escalationmodel,
+                                     escalation_budget=args.escalationbudget,
+                                     max_escalated_share=args.escalationshare,
+                                     latency_weight=args.latencyweight,
+                                     pipelined=args.pipeline)
+        if args.bulkimport:
+            request_file = translator.import_bulk(args.bulkimport, args.bulkexport or None)
+        elif args.bulkexport is not None:
+            request_file = translator.export_bulk(args.bulkexport or None)
+        else:
+            translator.translate()
+            print("Translation completed.")
+            request_file = None
+        if request_file:
+            print(f"Submit {request_file} to the batch API, then import its results with -bulkimport.")
+
+    if args.timing:
+        _print_timings()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+package_directory = os.path.dirname(os.path.abspath(__file__))
+METRICS_FILE = os.path.join(package_directory, 'metrics.jsonl')
+
+# USD per 1K prompt and completion tokens. Models are matched by prefix, so dated snapshots
+# such as gpt-4-0613 use their family's price; unknown (e.g. self-hosted) models cost nothing.
+MODEL_PRICES = {
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4o': (0.0025, 0.01),
+    'gpt-4o-mini': (0.00015, 0.0006),
+}
+# Only the most recent requests are used to calibrate estimates
+CALIBRATION_WINDOW = 5000
+# Share of the list price paid for requests sent through the batch API
+BULK_PRICE_FACTOR = 0.5
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+
+def model_price(model):
+    matches = [name for name in MODEL_PRICES if model == name or model.startswith(name + '-')]
+    return MODEL_PRICES[max(matches, key=len)] if matches else (0.0, 0.0)
+
+
+def request_cost(model, prompt_tokens, completion_tokens, bulk=False):
+    prompt_price, completion_price = model_price(model)
+    cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    return cost * BULK_PRICE_FACTOR if bulk else cost
+
+
+class Calibration:
+    """
+    Ratios between the planner's token estimates and what past requests actually used,
+    retries and follow-ups included, and the average price paid per token.
+    """
+
+    def __init__(self, records=(), models=()):
+        self.requests = 0
+        self.prompt_factor = 1.0
+        self.completion_factor = 1.0
+        # Without history the estimate uses the list price of the first model
+        self.prompt_price, self.completion_price = model_price(models[0]) if models else (0.0, 0.0)
+        estimated_prompt = estimated_completion = prompt = completion = cost_prompt = cost_completion = 0
+        for record in records:
+            if record.get('type') != 'request' or (models and record.get('model') not in models
+                                                    and record.get('escalated_from') not in models):
+                continue
+            self.requests += 1
+            if record.get('attempt') == 0:
+                estimated_prompt += record.get('estimated_prompt_tokens') or 0
+                estimated_completion += record.get('estimated_completion_tokens') or 0
+            prompt += record.get('prompt_tokens') or 0
+            completion += record.get('completion_tokens') or 0
+            prompt_price, completion_price = model_price(record.get('model') or '')
+            cost_prompt += (record.get('prompt_tokens') or 0) * prompt_price / 1000
+            cost_completion += (record.get('completion_tokens') or 0) * completion_price / 1000
+        if estimated_prompt and prompt:
+            self.prompt_factor = prompt / estimated_prompt
+            self.prompt_price = cost_prompt / prompt * 1000
+        if estimated_completion and completion:
+            self.completion_factor = completion / estimated_completion
+            self.completion_price = cost_completion / completion * 1000
+
+    def estimate(self, prompt_tokens, completion_tokens):
+        # Returns (prompt tokens, completion tokens, price) expected for the planned token counts
+        prompt_tokens = int(prompt_tokens * self.prompt_factor)
+        completion_tokens = int(completion_tokens * self.completion_factor)
+        price = (prompt_tokens * self.prompt_price + completion_tokens * self.completion_price) / 1000
+        return prompt_tokens, completion_tokens, price
+
+
+def load_records(file_path=METRICS_FILE, limit=CALIBRATION_WINDOW):
+    # The last records of a metrics file; lines cut short by an interrupted run are skipped
+    if not os.path.exists(file_path):
+        return []
+    records = deque(maxlen=limit)
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return list(records)
+
+
+class MetricsRecorder:
+    """
+    Appends one JSON line per API request and per batch to the metrics file and keeps the
+    totals of the run for the end-of-run report and the Prometheus export. Safe to share
+    between the worker threads.
+    """
+
+    def __init__(self, file_path=METRICS_FILE, project=None):
+        self.file_path = file_path
+        self.project = project
+        self.run_id = time.strftime('%Y%m%dT%H%M%S')
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.file = open(file_path, 'a', encoding='utf-8') if file_path else None
+        self.totals = {'requests': 0, 'errors': 0, 'retries': 0, 'validation_failures': 0, 'escalations': 0,
+                       'rejected_entries': 0, 'batches': 0, 'failed_batches': 0, 'lines': 0}
+        # {model: [requests, prompt tokens, completion tokens, cost, latency seconds]}
+        self.models = {}
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _write(self, record):
+        record = {'type': record.pop('type'), 'time': time.time(), 'run': self.run_id, 'project': self.project,
+                  **record}
+        if self.file is not None:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.file.flush()
+
+    def record_request(self, backend, model, attempt, entries, latency, prompt_tokens=None, completion_tokens=None,
+                       estimated_prompt_tokens=0, estimated_completion_tokens=0, accepted=0, rejected=0,
+                       parse_failed=False, escalated_from=None, streamed=False, error=None, bulk=False):
+        # Token counts are the ones reported in response.usage; the estimates stand in when a server sends none.
+        # Bulk requests were answered by the batch API, so they have no latency of their own.
+        usage_reported = prompt_tokens is not None
+        if not usage_reported:
+            prompt_tokens = estimated_prompt_tokens if error is None else 0
+            completion_tokens = estimated_completion_tokens if error is None else 0
+        cost = request_cost(model, prompt_tokens, completion_tokens, bulk)
+        with self.lock:
+            self.totals['requests'] += 1
+            self.totals['errors'] += error is not None
+            self.totals['retries'] += attempt > 0
+            self.totals['validation_failures'] += bool(parse_failed or rejected)
+            self.totals['rejected_entries'] += rejected
+            self.totals['escalations'] += escalated_from is not None
+            model_totals = self.models.setdefault(model, [0, 0, 0, 0.0, 0.0])
+            for i, value in enumerate((1, prompt_tokens, completion_tokens, cost, latency)):
+                model_totals[i] += value
+            if not bulk:
+                self.latency_counts[sum(latency > bucket for bucket in LATENCY_BUCKETS)] += 1
+            self._write({'type': 'request', 'backend': backend, 'model': model, 'attempt': attempt,
+                         'entries': entries, 'latency': round(latency, 4), 'prompt_tokens': prompt_tokens,
+                         'completion_tokens': completion_tokens, 'usage_reported': usage_reported,
+                         'estimated_prompt_tokens': estimated_prompt_tokens,
+                         'estimated_completion_tokens': estimated_completion_tokens, 'accepted': accepted,
+                         'rejected': rejected, 'parse_failed': parse_failed, 'escalated_from': escalated_from,
+                         'streamed': streamed, 'bulk': bulk, 'cost': round(cost, 6), 'error': error})
+
+    def record_batch(self, batch_id, entries, translated, seconds, error=None):
+        with self.lock:
+            self.totals['batches'] += 1
+            self.totals['failed_batches'] += error is not None
+            self.totals['lines'] += translated
+            self._write({'type': 'batch', 'batch_id': batch_id, 'entries': entries, 'translated': translated,
+                         'seconds': round(seconds, 4), 'error': error})
+
+    def summary(self):
+        with self.lock:
+            seconds = time.monotonic() - self.started
+            prompt = sum(totals[1] for totals in self.models.values())
+            completion = sum(totals[2] for totals in self.models.values())
+            cost = sum(totals[3] for totals in self.models.values())
+            lines = self.totals['lines']
+            return {**self.totals, 'seconds': seconds, 'prompt_tokens': prompt, 'completion_tokens': completion,
+                    'cost': cost, 'tokens_per_second': (prompt + completion) / seconds if seconds else 0.0,
+                    'cost_per_line': cost / lines if lines else 0.0,
+                    'latency_p50': self._latency_quantile(0.5), 'latency_p95': self._latency_quantile(0.95)}
+
+    def _latency_quantile(self, quantile):
+        # Upper bound of the histogram bucket holding the quantile
+        total = sum(self.latency_counts)
+        if not total:
+            return 0.0
+        count = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + (float('inf'),), self.latency_counts):
+            count += bucket_count
+            if count >= quantile * total:
+                return bound
+        return float('inf')
+
+    def close(self):
+        summary = self.summary()
+        with self.lock:
+            self._write({'type': 'run', **summary})
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        return summary
+
+    def write_prometheus(self, file_path):
+        # Prometheus text format, e.g. for node_exporter's textfile collector
+        project = (self.project or '').replace('\\', '\\\\').replace('"', '\\"')
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{label}"' for key, label in [('project', project)] + labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        summary = self.summary()
+        with self.lock:
+            models = {model: list(totals) for model, totals in self.models.items()}
+            latency_counts = list(self.latency_counts)
+        for name, index, help_text in (('requests', 0, 'API requests sent.'),
+                                       ('prompt_tokens', 1, 'Prompt tokens used.'),
+                                       ('completion_tokens', 2, 'Completion tokens used.'),
+                                       ('cost_dollars', 3, 'Estimated cost in USD.')):
+            metric(f'mvtrans_{name}_total', 'counter', help_text,
+                   [([('model', model)], totals[index]) for model, totals in models.items()])
+        for name, help_text in (('errors', 'Requests that failed.'),
+                                ('retries', 'Follow-up requests for missing or rejected entries.'),
+                                ('validation_failures', 'Replies that did not parse or had rejected entries.'),
+                                ('escalations', 'Requests sent to the escalation model.'),
+                                ('failed_batches', 'Batches left incomplete.'),
+                                ('lines', 'Lines translated.')):
+            metric(f'mvtrans_{name}_total', 'counter', help_text, [([], summary[name])])
+        metric('mvtrans_tokens_per_second', 'gauge', 'Prompt and completion tokens per second of the run.',
+               [([], round(summary['tokens_per_second'], 3))])
+
+        name = 'mvtrans_request_latency_seconds'
+        lines.append(f"# HELP {name} Latency of the API requests.")
+        lines.append(f"# TYPE {name} histogram")
+        count = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + ('+Inf',), latency_counts):
+            count += bucket_count
+            lines.append(f'{name}_bucket{{project="{project}",le="{bound}"}} {count}')
+        lines.append(f'{name}_sum{{project="{project}"}} {sum(totals[4] for totals in models.values())}')
+        lines.append(f'{name}_count{{project="{project}"}} {count}')
+
+        temp_path = file_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, file_path)
@@ -0,0 +1,197 @@
+import os
+import queue
+import threading
+from collections import deque
+from tqdm import tqdm
+
+# Extracted files waiting to be committed; extraction pauses when this many are queued
+FILE_QUEUE_SIZE = 8
+# Share of a request's capacity a batch needs before it is sent while files are still being extracted
+MIN_BATCH_FILL = 0.8
+
+
+class TranslationPipeline:
+    """
+    Runs extraction, translation and reinjection at the same time. Files are extracted on a
+    background thread into a bounded queue; their new strings are batched and sent as soon as
+    a batch is full, and each file is patched as soon as all of its strings are translated.
+    The calling thread owns the store and does every commit, like the sequential steps do.
+    """
+
+    def __init__(self, handler, controller, store, workers=1, file_queue_size=FILE_QUEUE_SIZE, on_extracted=None):
+        self.handler = handler
+        self.controller = controller
+        self.store = store
+        self.workers = workers
+        self.file_slots = threading.BoundedSemaphore(file_queue_size)
+        # Called once every file has been extracted and committed
+        self.on_extracted = on_extracted
+        # Batches queued in the executor besides the ones being sent, so that a worker never waits for planning
+        self.max_in_flight = max(1, controller.concurrency) * 2
+        self.events = queue.Queue()
+        self.buffer = []
+        # Strings already batched or translated, strings each file still waits for, and the reverse
+        self.scheduled = set()
+        self.waiting = {}
+        self.files_of = {}
+        self.seen = set()
+        self.reinjected = 0
+
+    def run(self):
+        """
+        Returns the number of batches that failed. Files whose strings all got translated are
+        reinjected; the others are left for update_jsons_with_translations.
+        """
+        store = self.store
+        controller = self.controller
+        store.abandon_unfinished_batches()
+        file_paths = self.handler.find_changed_files()
+        extractor = threading.Thread(target=self._extract, args=(file_paths,), daemon=True)
+        extractor.start()
+
+        jobs = deque()
+        in_flight = 0
+        extracting = True
+        failed_batches = 0
+        committed = {}
+        with controller._batch_executor() as executor, \
+                tqdm(total=0, desc="Translating...") as progress_bar:
+            self._resume(file_paths, progress_bar)
+            # The buffer only changes when a file is committed, so it is planned again only then
+            replan = bool(self.buffer)
+            while True:
+                if replan and self.buffer:
+                    jobs.extend(self._plan(final=not extracting))
+                replan = False
+                while jobs and in_flight < self.max_in_flight:
+                    entries, input_tokens = jobs.popleft()
+                    job = (store.create_batch(len({entry_id for entry_id, _ in entries}), input_tokens), entries)
+                    executor.submit(controller._run_job, job, self.events)
+                    in_flight += 1
+                if not extracting and not in_flight and not jobs and not self.buffer:
+                    break
+
+                event = self.events.get()
+                if event[0] == 'file':
+                    self._commit_file(*event[1:], progress_bar)
+                    self.file_slots.release()
+                    replan = True
+                elif event[0] == 'done':
+                    extracting = False
+                    replan = True
+                    self.handler.report_templates()
+                    if self.on_extracted is not None:
+                        self.on_extracted()
+                elif event[0] == 'error':
+                    raise event[1]
+                else:
+                    failed, entry_ids = controller._commit_event(store, event, committed, progress_bar)
+                    failed_batches += failed
+                    if event[3]:
+                        in_flight -= 1
+                    self._resolve(entry_ids)
+
+        print(f"Reinjected {self.reinjected} files while translating")
+        controller._print_summary()
+        return failed_batches
+
+    def _resume(self, file_paths, progress_bar):
+        # Strings left pending by an earlier run are sent along with the new ones. The files committed
+        # before it stopped are not extracted again, since they did not change, but still wait for them.
+        store = self.store
+        rows = store.get_pending_strings()
+        if not rows:
+            return
+        misses = self._count_tokens(self.controller._apply_translation_memory(rows, store, report=False))
+        self.buffer.extend(misses)
+        self.scheduled.update(row[0] for row in misses)
+        self.seen.update(row[0] for row in rows)
+        progress_bar.total += len(rows)
+        progress_bar.update(len(rows) - len(misses))
+
+        extracting = {os.path.normpath(file_path) for file_path in file_paths}
+        for relative_path, waiting in store.get_waiting_files().items():
+            file_path = os.path.join(self.handler.directory, relative_path)
+            if os.path.normpath(file_path) in extracting or not os.path.exists(file_path):
+                continue
+            if not waiting:
+                self._reinject(file_path)
+                continue
+            self.waiting[file_path] = waiting
+            for entry_id in waiting:
+                self.files_of.setdefault(entry_id, []).append(file_path)
+
+    def _extract(self, file_paths):
+        try:
+            for extracted in self.handler.extract_files(file_paths, self.workers):
+                self.file_slots.acquire()
+                self.events.put(('file',) + extracted)
+            self.events.put(('done',))
+        except Exception as e:
+            self.events.put(('error', e))
+
+    def _commit_file(self, file_path, pool, progress_bar):
+        store = self.store
+        self.handler.commit_file(file_path, pool)
+        rows = store.get_pending_strings(pool.ids)
+        new_rows = [row for row in rows if row[0] not in self.scheduled]
+        misses = self._count_tokens(self.controller._apply_translation_memory(new_rows, store, report=False))
+        self.buffer.extend(misses)
+        self.scheduled.update(row[0] for row in misses)
+        hits = {row[0] for row in new_rows} - {row[0] for row in misses}
+        waiting = {row[0] for row in rows} - hits
+
+        # The bar counts distinct strings, which only become known file by file
+        fresh = set(pool.ids) - self.seen
+        self.seen.update(fresh)
+        progress_bar.total += len(fresh)
+        progress_bar.update(len(fresh - {row[0] for row in misses}))
+        if not waiting:
+            self._reinject(file_path)
+            return
+        self.waiting[file_path] = waiting
+        for entry_id in waiting:
+            self.files_of.setdefault(entry_id, []).append(file_path)
+
+    def _count_tokens(self, rows):
+        # Only the file's own new strings are counted; scanning the store for them slows down with every file
+        uncounted = [row for row in rows if row[2] is None]
+        if not uncounted:
+            return rows
+        token_counts = self.controller.token_counter.get_token_counts([row[1] for row in uncounted])
+        self.store.save_token_counts(zip((row[0] for row in uncounted), token_counts))
+        counted = {row[0]: token_count for row, token_count in zip(uncounted, token_counts)}
+        return [row if row[2] is not None else (row[0], row[1], counted[row[0]]) + tuple(row[3:]) for row in rows]
+
+    def _plan(self, final):
+        # Batches for the buffered strings. While files are still coming, batches that are not full
+        # enough go back to the buffer to be packed with the next file's strings. Batches with chunks
+        # of a long entry are always sent, since its other chunks may be in a full batch.
+        plan = self.controller._plan(self.buffer)
+        if final:
+            self.buffer = []
+            return plan.batches
+        planner = self.controller.planner
+        ready, held = [], []
+        for entries, input_tokens in plan.batches:
+            if (planner.batch_cost(entries, input_tokens) >= planner.capacity * MIN_BATCH_FILL
+                    or any(entry_id in plan.split_entries for entry_id, _ in entries)):
+                ready.append((entries, input_tokens))
+            else:
+                held.extend(entry_id for entry_id, _ in entries)
+        held = set(held)
+        self.buffer = [row for row in self.buffer if row[0] in held]
+        return ready
+
+    def _resolve(self, entry_ids):
+        for entry_id in set(entry_ids):
+            for file_path in self.files_of.pop(entry_id, ()):
+                waiting = self.waiting[file_path]
+                waiting.discard(entry_id)
+                if not waiting:
+                    del self.waiting[file_path]
+                    self._reinject(file_path)
+
+    def _reinject(self, file_path):
+        self.handler.reinject_file(file_path)
+        self.reinjected += 1
@@ -0,0 +1,403 @@
+import csv
+import json
+import os
+import sqlite3
+import time
+from rpgmv_translator.string_pool import string_id
+
+PROJECT_DB = 'project.db'
+# Files written by older versions, imported once so their projects can resume
+LEGACY_FILES = ['original.csv', 'translated.csv', 'progress.log']
+
+# Tables keyed by the strings' IDs (see string_pool.string_id), created under a temporary name
+# when an older database is migrated. legacy_uuid is the uuid string older versions used as the
+# ID, still found as a placeholder in the files they extracted. The ID columns are still named
+# uuid, as they were when they held those strings, so that databases of every version share one
+# schema; they hold the integer IDs, which the code calls entry_id.
+STRING_TABLES = {
+    'strings': """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid INTEGER NOT NULL UNIQUE,
+            text TEXT NOT NULL UNIQUE,
+            token_count INTEGER,
+            group_key TEXT,
+            legacy_uuid TEXT UNIQUE
+        )""",
+    'translations': """
+        CREATE TABLE IF NOT EXISTS {name} (
+            uuid INTEGER PRIMARY KEY REFERENCES strings (uuid),
+            translated_text TEXT NOT NULL,
+            batch_id INTEGER REFERENCES batches (id)
+        )""",
+    'locations': """
+        CREATE TABLE IF NOT EXISTS {name} (
+            path TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL,
+            uuid INTEGER,
+            args TEXT
+        )""",
+}
+
+
+class ProjectStore:
+    """
+    Transactional per-project database holding the extracted source strings, their
+    translations, the status of every API batch, the completed pipeline steps and the
+    manifest of data files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.db_path = os.path.join(directory, PROJECT_DB)
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        self._import_legacy_files()
+
+    def _create_schema(self):
+        with self.connection:
+            self.connection.executescript(';'.join(table.format(name=name) for name, table in STRING_TABLES.items())
+                                          + """;
+                CREATE TABLE IF NOT EXISTS batches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    status TEXT NOT NULL,
+                    entry_count INTEGER NOT NULL,
+                    input_tokens INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS batches_status ON batches (status);
+                CREATE TABLE IF NOT EXISTS batch_entries (
+                    batch_id INTEGER NOT NULL REFERENCES batches (id),
+                    position INTEGER NOT NULL,
+                    uuid INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (batch_id, position)
+                );
+                CREATE TABLE IF NOT EXISTS split_entries (
+                    uuid INTEGER PRIMARY KEY,
+                    chunks TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS steps (
+                    step TEXT PRIMARY KEY,
+                    completed_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    needs_update INTEGER NOT NULL,
+                    indexed INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS locations_path ON locations (path, start);
+            """)
+            self._add_missing_columns('strings', {'token_count': 'INTEGER', 'group_key': 'TEXT'})
+            self._add_missing_columns('files', {'indexed': 'INTEGER NOT NULL DEFAULT 0'})
+            self._add_missing_columns('locations', {'args': 'TEXT'})
+        columns = {row[1]: row[2] for row in self.connection.execute("PRAGMA table_info(strings)")}
+        if columns['uuid'] == 'TEXT':
+            self._migrate_string_ids()
+
+    def _migrate_string_ids(self):
+        # Databases created before string IDs were integers: every string gets the ID derived from its text
+        # and keeps its uuid as legacy_uuid, and the translations and locations follow it
+        self.connection.create_function('string_id', 1, string_id, deterministic=True)
+        script = ['BEGIN']
+        script += [table.format(name=f'{name}_migrated') for name, table in STRING_TABLES.items()]
+        script += [
+            """INSERT INTO strings_migrated (id, uuid, text, token_count, group_key, legacy_uuid)
+               SELECT id, string_id(text), text, token_count, group_key, uuid FROM strings""",
+            """INSERT INTO translations_migrated (uuid, translated_text, batch_id)
+               SELECT s.uuid, t.translated_text, t.batch_id FROM translations t
+               JOIN strings_migrated s ON s.legacy_uuid = t.uuid""",
+            """INSERT INTO locations_migrated (path, start, end, uuid, args)
+               SELECT l.path, l.start, l.end, s.uuid, l.args FROM locations l
+               LEFT JOIN strings_migrated s ON s.legacy_uuid = l.uuid""",
+        ]
+        for name in STRING_TABLES:
+            script += [f'DROP TABLE {name}', f'ALTER TABLE {name}_migrated RENAME TO {name}']
+        script += ['CREATE INDEX locations_path ON locations (path, start)', 'COMMIT']
+        self.connection.executescript(';\n'.join(script) + ';')
+
+    def _add_missing_columns(self, table, columns):
+        # Upgrades databases created by older versions in place
+        existing = {row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns.items():
+            if name not in existing:
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    def _import_legacy_files(self):
+        original_csv, translated_csv, progress_log = (os.path.join(self.directory, name) for name in LEGACY_FILES)
+        if not os.path.exists(original_csv) or self.count_strings():
+            return
+
+        with open(original_csv, 'r', encoding='utf-8') as csv_file:
+            legacy_ids = {row['uuid']: (string_id(row['text']), row['text']) for row in csv.DictReader(csv_file)}
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO strings (uuid, text, legacy_uuid) VALUES (?, ?, ?)",
+                                        ((text_id, text, legacy_uuid)
+                                         for legacy_uuid, (text_id, text) in legacy_ids.items()))
+        if os.path.exists(translated_csv):
+            with open(translated_csv, 'r', encoding='utf-8') as csv_file:
+                self.save_translations((legacy_ids[row['uuid']][0], row['translated_text'])
+                                       for row in csv.DictReader(csv_file) if row['uuid'] in legacy_ids)
+        if os.path.exists(progress_log):
+            with open(progress_log, 'r') as file:
+                for line in file:
+                    step, status = line.strip().split(':')
+                    if status == 'completed':
+                        self.mark_step_completed(step)
+
+    # Steps
+
+    def is_step_completed(self, step):
+        row = self.connection.execute("SELECT 1 FROM steps WHERE step = ?", (step,)).fetchone()
+        return row is not None
+
+    def mark_step_completed(self, step):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO steps (step, completed_at) VALUES (?, ?)",
+                                    (step, time.time()))
+
+    def reset_steps(self, steps):
+        with self.connection:
+            self.connection.executemany("DELETE FROM steps WHERE step = ?", ((step,) for step in steps))
+
+    # File manifest
+
+    def has_file_manifest(self):
+        return self.connection.execute("SELECT 1 FROM files LIMIT 1").fetchone() is not None
+
+    def load_file_hashes(self):
+        # Returns {path: hash of the content last written by the translator}, paths relative to the project
+        return dict(self.connection.execute("SELECT path, content_hash FROM files"))
+
+    def record_files(self, rows, indexed=False):
+        # rows: iterable of (path, content_hash, needs_update). indexed files have their string locations
+        # stored and are patched in place; the others hold the uuid placeholders written by older versions.
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files (path, content_hash, needs_update, indexed) VALUES (?, ?, ?, ?)",
+                ((path, content_hash, int(needs_update), int(indexed)) for path, content_hash, needs_update in rows))
+
+    def get_file_record(self, path):
+        # Returns (content_hash, needs_update) of a file, or None when it is not in the manifest
+        row = self.connection.execute("SELECT content_hash, needs_update FROM files WHERE path = ?", (path,)).fetchone()
+        return (row[0], bool(row[1])) if row is not None else None
+
+    def mark_file_updated(self, path, content_hash):
+        with self.connection:
+            self.connection.execute("UPDATE files SET content_hash = ?, needs_update = 0 WHERE path = ?",
+                                    (content_hash, path))
+
+    def get_files_needing_update(self):
+        # Returns (path, indexed) for the files waiting for their translations
+        return self.connection.execute("SELECT path, indexed FROM files WHERE needs_update ORDER BY path").fetchall()
+
+    # String locations
+
+    def replace_locations(self, path, locations):
+        # locations: iterable of (start, end, id, args) byte spans of the file's translatable strings, where
+        # args holds the control codes and numbers of a string stored as a template (JSON, or None)
+        with self.connection:
+            self.connection.execute("DELETE FROM locations WHERE path = ?", (path,))
+            self.connection.executemany("INSERT INTO locations (path, start, end, uuid, args) VALUES (?, ?, ?, ?, ?)",
+                                        ((path,) + tuple(location) for location in locations))
+
+    def get_located_translations(self, path):
+        # Returns (start, end, id, args, translated_text) for the spans of one file, where translated_text
+        # is None for strings without a translation and for hint fields
+        return self.connection.execute("""
+            SELECT l.start, l.end, l.uuid, l.args, t.translated_text FROM locations l
+            LEFT JOIN translations t ON t.uuid = l.uuid
+            WHERE l.path = ? ORDER BY l.start""", (path,)).fetchall()
+
+    # Source strings
+
+    def add_strings(self, rows):
+        # rows: iterable of (id, text, group_key); strings that are already stored keep their group.
+        # Raises ValueError when an ID is already stored with another text, so a hash collision can never
+        # give one string the translation of another
+        rows = list(rows)
+        with self.connection:
+            changes = self.connection.total_changes
+            self.connection.executemany("INSERT OR IGNORE INTO strings (uuid, text, group_key) VALUES (?, ?, ?)", rows)
+            if self.connection.total_changes - changes < len(rows):
+                self._check_string_ids(rows)
+
+    def _check_string_ids(self, rows):
+        texts = {text_id: text for text_id, text, _ in rows}
+        entry_ids = list(texts)
+        for i in range(0, len(entry_ids), 500):
+            chunk = entry_ids[i:i + 500]
+            for text_id, stored_text in self.connection.execute(
+                    f"SELECT uuid, text FROM strings WHERE uuid IN ({','.join('?' * len(chunk))})", chunk):
+                if stored_text != texts[text_id]:
+                    raise ValueError(f"String ID {text_id} of {texts[text_id]!r} is already taken by {stored_text!r}")
+
+    def count_strings(self):
+        return self.connection.execute("SELECT COUNT(*) FROM strings").fetchone()[0]
+
+    def get_strings_without_token_count(self):
+        return self.connection.execute("SELECT uuid, text FROM strings WHERE token_count IS NULL").fetchall()
+
+    def save_token_counts(self, rows):
+        # rows: iterable of (id, token_count)
+        with self.connection:
+            self.connection.executemany("UPDATE strings SET token_count = ? WHERE uuid = ?",
+                                        ((token_count, entry_id) for entry_id, token_count in rows))
+
+    def get_pending_strings(self, entry_ids=None):
+        # Returns (id, text, token_count, group_key) in extraction order for strings without a translation,
+        # optionally only among the given ids
+        query = """
+            SELECT s.uuid, s.text, s.token_count, s.group_key, s.id FROM strings s
+            LEFT JOIN translations t ON t.uuid = s.uuid
+            WHERE t.uuid IS NULL"""
+        if entry_ids is None:
+            return [row[:4] for row in self.connection.execute(query + " ORDER BY s.id")]
+        entry_ids = list(entry_ids)
+        rows = []
+        # Kept well below SQLite's limit on bound parameters
+        for i in range(0, len(entry_ids), 500):
+            chunk = entry_ids[i:i + 500]
+            rows.extend(self.connection.execute(
+                query + f" AND s.uuid IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return [row[:4] for row in sorted(rows, key=lambda row: row[4])]
+
+    def count_pending_strings(self):
+        return self.connection.execute("""
+            SELECT COUNT(*) FROM strings s
+            LEFT JOIN translations t ON t.uuid = s.uuid
+            WHERE t.uuid IS NULL""").fetchone()[0]
+
+    def get_waiting_files(self):
+        # Returns {path: set of ids without a translation} for every indexed file still marked for an update;
+        # files whose strings are all translated map to an empty set
+        waiting = {path: set() for path, indexed in self.get_files_needing_update() if indexed}
+        for path, entry_id in self.connection.execute("""
+                SELECT DISTINCT l.path, l.uuid FROM locations l
+                JOIN files f ON f.path = l.path
+                LEFT JOIN translations t ON t.uuid = l.uuid
+                WHERE f.needs_update AND f.indexed AND l.uuid IS NOT NULL AND t.uuid IS NULL"""):
+            waiting[path].add(entry_id)
+        return waiting
+
+    # Translations
+
+    def save_translations(self, rows, batch_id=None):
+        # rows: iterable of (id, translated_text), committed in a single transaction
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO translations (uuid, translated_text, batch_id) VALUES (?, ?, ?)",
+                ((entry_id, translated_text, batch_id) for entry_id, translated_text in rows))
+
+    def get_translation(self, entry_id):
+        row = self.connection.execute("SELECT translated_text FROM translations WHERE uuid = ?", (entry_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def load_legacy_translations(self):
+        # Returns {legacy uuid: text} for the placeholders in files extracted by older versions, falling
+        # back to the original text for untranslated strings
+        return dict(self.connection.execute("""
+            SELECT s.legacy_uuid, COALESCE(t.translated_text, s.text) FROM strings s
+            LEFT JOIN translations t ON t.uuid = s.uuid
+            WHERE s.legacy_uuid IS NOT NULL"""))
+
+    # Batches
+
+    def abandon_unfinished_batches(self):
+        # Batches left pending by a crashed run are re-planned from the pending strings; submitted bulk
+        # batches are still waiting for their results
+        with self.connection:
+            self.connection.execute("UPDATE batches SET status = 'abandoned' WHERE status = 'pending'")
+
+    def create_batch(self, entry_count, input_tokens):
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO batches (status, entry_count, input_tokens, created_at) VALUES ('pending', ?, ?, ?)",
+                (entry_count, input_tokens, time.time()))
+        return cursor.lastrowid
+
+    def complete_batch(self, batch_id, rows):
+        # Saves the batch's translations and marks it completed atomically
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO translations (uuid, translated_text, batch_id) VALUES (?, ?, ?)",
+                ((entry_id, translated_text, batch_id) for entry_id, translated_text in rows))
+            self.connection.execute("UPDATE batches SET status = 'completed', finished_at = ? WHERE id = ?",
+                                    (time.time(), batch_id))
+
+    def fail_batch(self, batch_id, rows=()):
+        # rows: translations accepted before the batch failed, kept so that only the rest is retried
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO translations (uuid, translated_text, batch_id) VALUES (?, ?, ?)",
+                ((entry_id, translated_text, batch_id) for entry_id, translated_text in rows))
+            self.connection.execute("UPDATE batches SET status = 'failed', finished_at = ? WHERE id = ?",
+                                    (time.time(), batch_id))
+
+    # Bulk batches, sent in a request file and answered later (see bulk.BulkJob)
+
+    def submit_batches(self, batches):
+        # batches: list of (entries, input_tokens) where entries are (id, text). Returns the IDs of the
+        # batches, created as submitted with their entries in one transaction.
+        batch_ids = []
+        with self.connection:
+            for entries, input_tokens in batches:
+                cursor = self.connection.execute(
+                    "INSERT INTO batches (status, entry_count, input_tokens, created_at) VALUES ('submitted', ?, ?, ?)",
+                    (len({entry_id for entry_id, _ in entries}), input_tokens, time.time()))
+                self.connection.executemany(
+                    "INSERT INTO batch_entries (batch_id, position, uuid, text) VALUES (?, ?, ?, ?)",
+                    ((cursor.lastrowid, position, entry_id, text) for position, (entry_id, text) in enumerate(entries)))
+                batch_ids.append(cursor.lastrowid)
+        return batch_ids
+
+    def get_submitted_entries(self, batch_id):
+        # Returns the (id, text) entries of a submitted batch in request order, or None when the batch
+        # is not waiting for its results
+        row = self.connection.execute("SELECT status FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if row is None or row[0] != 'submitted':
+            return None
+        return self.connection.execute(
+            "SELECT uuid, text FROM batch_entries WHERE batch_id = ? ORDER BY position", (batch_id,)).fetchall()
+
+    def get_submitted_ids(self):
+        return {row[0] for row in self.connection.execute("SELECT DISTINCT uuid FROM batch_entries")}
+
+    def count_submitted_batches(self):
+        return self.connection.execute("SELECT COUNT(*) FROM batches WHERE status = 'submitted'").fetchone()[0]
+
+    def save_split_entries(self, rows):
+        # rows: iterable of (id, chunks) for the entries sent in chunks
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO split_entries (uuid, chunks) VALUES (?, ?)",
+                                        ((entry_id, json.dumps(chunks, ensure_ascii=False))
+                                         for entry_id, chunks in rows))
+
+    def load_split_entries(self, entry_ids):
+        # Returns {id: chunks} for those of the given ids that were sent in chunks
+        entry_ids = list(entry_ids)
+        split_entries = {}
+        for i in range(0, len(entry_ids), 500):
+            chunk = entry_ids[i:i + 500]
+            split_entries.update((entry_id, json.loads(chunks)) for entry_id, chunks in self.connection.execute(
+                f"SELECT uuid, chunks FROM split_entries WHERE uuid IN ({','.join('?' * len(chunk))})", chunk))
+        return split_entries
+
+    def release_batches(self, batch_ids, abandon=False):
+        # Forgets the entries of bulk batches whose results were committed, or that were never sent when
+        # abandon is set, and the chunks of entries no other submitted batch holds
+        with self.connection:
+            if abandon:
+                self.connection.executemany("UPDATE batches SET status = 'abandoned' WHERE id = ?",
+                                            ((batch_id,) for batch_id in batch_ids))
+            self.connection.executemany("DELETE FROM batch_entries WHERE batch_id = ?",
+                                        ((batch_id,) for batch_id in batch_ids))
+            self.connection.execute("DELETE FROM split_entries WHERE uuid NOT IN (SELECT uuid FROM batch_entries)")
+
+    def close(self):
+        self.connection.close()
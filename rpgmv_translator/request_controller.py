@@ -1,21 +1,81 @@
-import csv
 import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 # from rpgmv_translator.translator.gpt_translator import GPTTranslator  # Assuming GPTTranslator is in gpt_translator.py
 # from utils import estimate_token_count
-from rpgmv_translator.translator.gpt_translator import GPTTranslator
-from rpgmv_translator.tokenizer.english_tokenizer import EnglishTokenizer
-from rpgmv_translator.tokenizer.japanese_tokenizer import JapaneseTokenizer
+from rpgmv_translator.translator import (get_translator, DEFAULT_MODEL, DEFAULT_ESCALATION, PROMPT_VERSION,
+                                         TARGET_LANGUAGE, COMPATIBLE_PROMPT_VERSIONS)
+from rpgmv_translator.translator.backends import backend_models, backends_need_api_key, memory_model_key
+from rpgmv_translator.translator.model_scheduler import ModelScheduler
+from rpgmv_translator.translator.prompts import build_prompt
+from rpgmv_translator.batch_planner import BatchPlanner
+from rpgmv_translator.metrics import Calibration, load_records
+from rpgmv_translator.rate_limiter import TokenBucketRateLimiter
+from rpgmv_translator.text_splitter import join_chunks, split_text
+from rpgmv_translator.tokenizer import get_tokenizer, TOKENIZERS
 from tqdm import tqdm
 
 
 class GPTRequestController:
-    def __init__(self, max_tokens, language):
-        self.max_tokens = max_tokens
+    def __init__(self, context_budget, language, concurrency=1, requests_per_minute=None, tokens_per_minute=None,
+                 translation_memory=None, api_key=None, base_url=None, streaming=False, backends=None,
+                 metrics=None, models=None, escalation_model=DEFAULT_ESCALATION, escalation_budget=None,
+                 max_escalated_share=None, latency_weight=0.0):
+        self.context_budget = context_budget
         self.language = language
-        self.api_key = self._load_api_key_from_config('config.json')
-        self.translator = GPTTranslator(self.api_key)
-        self.tokenizer = self._select_tokenizer(language)
+        self.concurrency = concurrency
+        self.translation_memory = translation_memory
+        # Backend configs (see translator.backends) to route batches over; None sends everything to base_url
+        self.backends = backends
+        if api_key is None and (not backends or backends_need_api_key(backends)):
+            api_key = self._load_api_key_from_config('config.json')
+        self.api_key = api_key
+        # Any OpenAI-compatible server, e.g. the benchmark stub; None uses the official API
+        self.base_url = base_url
+        self.streaming = streaming
+        # Candidate models and escalation model when there are no backend configs
+        self.models = list(models) if models else [DEFAULT_MODEL]
+        self.escalation_model = escalation_model
+        self.scheduler = ModelScheduler(escalation_budget=escalation_budget, max_escalated_share=max_escalated_share,
+                                        latency_weight=latency_weight)
+        self.memory_model = memory_model_key(backends or [{'models': self.models}])
+        # Optional MetricsRecorder; its file's history also calibrates the price estimate
+        self.metrics = metrics
+        # One limiter shared by every in-flight batch
+        self.rate_limiter = TokenBucketRateLimiter(requests_per_minute, tokens_per_minute)
+        if language not in TOKENIZERS:
+            raise ValueError(f"Unsupported language: {language}")
+        self._translator = None
+        self._translator_lock = threading.Lock()
+        # Batching and price estimates use model tokens; the language tokenizer is only used to split long entries
+        self.token_counter = get_tokenizer('approximate')
+        self.planner = BatchPlanner(context_budget, prompt_overhead=self.token_counter.get_token_count(build_prompt([])))
+        # [chunks, {chunk: translation}, batch that completed it] of every entry split by the planner
+        self.split_entries = {}
+
+    @property
+    def translator(self):
+        # Built on first use, so runs answered entirely from the translation memory never load openai
+        with self._translator_lock:
+            if self._translator is None and self.backends:
+                self._translator = get_translator('router', self.backends, self.api_key,
+                                                  rate_limiter=self.rate_limiter, streaming=self.streaming,
+                                                  metrics=self.metrics, scheduler=self.scheduler,
+                                                  escalation_model=self.escalation_model)
+            elif self._translator is None:
+                self._translator = get_translator('gpt', self.api_key, rate_limiter=self.rate_limiter,
+                                                  base_url=self.base_url, streaming=self.streaming,
+                                                  metrics=self.metrics, model=self.models[0], models=self.models,
+                                                  escalation_model=self.escalation_model, scheduler=self.scheduler)
+        return self._translator
+
+    @property
+    def tokenizer(self):
+        return get_tokenizer(self.language)
 
     def _load_api_key_from_config(self, file_name):
         # Get the directory of the current script
@@ -33,114 +93,213 @@ class GPTRequestController:
             raise FileNotFoundError(f"Config file not found at path: {config_path}")
 
 
-    def _select_tokenizer(self, language):
-        if language == 'English':
-            return EnglishTokenizer()
-        elif language == 'Japanese':
-            return JapaneseTokenizer()
+    def _count_missing_tokens(self, store):
+        # Token counts are computed once per string and kept in the store for later runs
+        rows = store.get_strings_without_token_count()
+        if rows:
+            token_counts = self.token_counter.get_token_counts([text for _, text in rows])
+            store.save_token_counts(zip((entry_id for entry_id, _ in rows), token_counts))
+
+    def _count_tokens_and_estimate_price(self, plan):
+        # Planned tokens scaled by what earlier requests for the same models actually used
+        models = [model for config in self.backends for model in backend_models(config)] if self.backends else self.models
+        records = load_records(self.metrics.file_path) if self.metrics is not None and self.metrics.file_path else []
+        calibration = Calibration(records, models)
+        prompt_tokens, completion_tokens, estimated_price = calibration.estimate(plan.prompt_tokens + plan.input_tokens,
+                                                                                 plan.output_tokens)
+        return prompt_tokens + completion_tokens, estimated_price, calibration.requests
+
+    def process_store(self, store):
+        store.abandon_unfinished_batches()
+        total_rows = store.count_strings()
+        self._count_missing_tokens(store)
+        pending_rows = self._apply_translation_memory(store.get_pending_strings(), store)
+
+        plan = self._plan(pending_rows)
+        print(f"Expected requests: {plan.requests} for {len(pending_rows)} strings, "
+              f"{plan.total_tokens} tokens with replies (prompt overhead {plan.overhead_ratio:.1%})")
+        total_token_count, estimated_price, history = self._count_tokens_and_estimate_price(plan)
+        print(f"Total tokens to translate: {total_token_count}"
+              + (f" (calibrated from {history} earlier requests)" if history else ""))
+        print(f"Estimated price for translation: ${estimated_price:.2f}")
+        jobs = self._build_batches(plan, store)
+        failed_batches = 0
+        # Entries already committed for each batch still in flight
+        committed = {}
+
+        with tqdm(total=total_rows, initial=total_rows - len(pending_rows), desc="Translating...") as progress_bar:
+            for event in self._dispatch_batches(jobs):
+                failed, _ = self._commit_event(store, event, committed, progress_bar)
+                failed_batches += failed
+
+        self._print_summary()
+        if failed_batches:
+            raise Exception(f"{failed_batches} batches failed to translate. Run the translation again to retry them.")
+
+    def _commit_event(self, store, event, committed, progress_bar):
+        # Commits one event of _dispatch_batches. Returns whether it ends a batch that failed, and the
+        # ids it committed.
+        (batch_id, batch), results, error, finished = event
+        results = self._join_chunks(batch_id, results)
+        rows = [(entry_id, translated) for entry_id, _, translated in results]
+        if not finished:
+            # Entries are committed as soon as they arrive so that nothing is lost if the batch fails later
+            store.save_translations(rows, batch_id)
+            committed[batch_id] = committed.get(batch_id, 0) + len(rows)
+            progress_bar.update(len(rows))
+            return False, [entry_id for entry_id, _ in rows]
+
+        if error is not None:
+            # Entries accepted before the failure are kept; only the rest is retried next run
+            print(f"Batch {batch_id} failed: {error}")
+            store.fail_batch(batch_id, rows)
         else:
-            raise ValueError(f"Unsupported language: {language}")
+            # Each batch is committed in one transaction as soon as it finishes so that resume keeps working
+            store.complete_batch(batch_id, rows)
+        if self.translation_memory is not None and results:
+            self.translation_memory.store_many([(text, translated) for _, text, translated in results],
+                                               TARGET_LANGUAGE, self.memory_model, PROMPT_VERSION)
+        progress_bar.update(len(rows) - committed.pop(batch_id, 0))
+        return error is not None, [entry_id for entry_id, _ in rows]
 
-    def _count_tokens_and_estimate_price(self, original_csv_path):
-        total_token_count = 0
-        with open(original_csv_path, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                token_count = self.tokenizer.get_token_count(row['text'])
-                total_token_count += token_count
+    def _join_chunks(self, batch_id, results):
+        # Translated chunks are held back until every chunk of their entry is in. The joined entry is then
+        # committed with the batch that brought its last chunk, by each of that batch's events.
+        joined = []
+        for entry_id, text, translated in results or ():
+            entry = self.split_entries.get(entry_id)
+            if entry is None:
+                joined.append((entry_id, text, translated))
+                continue
+            chunks, translations, _ = entry
+            translations[text] = translated
+            if entry[2] is None and all(chunk in translations or not chunk.strip() for chunk in chunks):
+                entry[2] = batch_id
+            if entry[2] == batch_id and all(row[0] != entry_id for row in joined):
+                joined.append((entry_id, ''.join(chunks),
+                               join_chunks(chunks, [translations.get(chunk, chunk) for chunk in chunks])))
+        return joined
 
-        # Assuming a hypothetical price per token (e.g., $0.0001 per token)
-        price_per_token = 0.001/1000
-        estimated_price = total_token_count * price_per_token
+    def _print_summary(self):
+        if self._translator is not None:
+            stats = self._translator.stats
+            print(f"Follow-up requests: {stats['follow_up_requests']} for {stats['resubmitted_entries']} entries, "
+                  f"{stats['saved_tokens']} prompt tokens saved compared with full-batch retries")
+            if self.backends:
+                print(f"Failovers between backends: {stats['failovers']}")
+                for name, model, assigned, backend_stats in self._translator.backend_stats():
+                    print(f"  {name} ({model}): {assigned} batches, {backend_stats['requests']} requests")
+            self._print_scheduling(self.scheduler.summary())
+        if self.metrics is not None:
+            self._print_metrics(self.metrics.summary())
 
-        return total_token_count, estimated_price
+    def _print_scheduling(self, summary):
+        for model, stats in summary['models'].items():
+            print(f"  {model}: {stats['requests']} requests, {stats['success_rate']:.1%} of the entries accepted, "
+                  f"${stats['cost']:.4f}")
+        if summary['escalated_entries'] or summary['denied_escalations']:
+            print(f"Escalation: {summary['escalated_entries']} entries in {summary['escalation_requests']} requests "
+                  f"for ${summary['escalation_cost']:.4f} ({summary['cost_added']:+.4f} compared with retrying on the "
+                  f"original model), about {summary['time_saved']:.1f} s saved; "
+                  f"{summary['denied_escalations']} escalations refused by the budget")
 
-    def process_csv(self, original_csv_path, translated_csv_path):
-        total_token_count, estimated_price = self._count_tokens_and_estimate_price(original_csv_path)
-        print(f"Total tokens to translate: {total_token_count}")
-        print(f"Estimated price for translation: ${estimated_price:.2f}")
+    def _print_metrics(self, summary):
+        print(f"Requests: {summary['requests']} ({summary['retries']} retries, {summary['errors']} errors, "
+              f"{summary['validation_failures']} validation failures, {summary['escalations']} escalated)")
+        print(f"Tokens: {summary['prompt_tokens']} prompt, {summary['completion_tokens']} completion, "
+              f"{summary['tokens_per_second']:.0f} tokens/s, latency p50 <= {summary['latency_p50']} s, "
+              f"p95 <= {summary['latency_p95']} s")
+        print(f"Cost: ${summary['cost']:.4f} for {summary['lines']} lines (${summary['cost_per_line'] * 1000:.4f} per 1000 lines)")
 
-        max_tokens = self.max_tokens
-        processed_uuids = self._get_processed_uuids(translated_csv_path)
-        texts_to_translate = []
-        current_token_count = 0
-
-        with open(original_csv_path, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            total_rows = sum(1 for row in reader)  # Count total rows for tqdm
-            csvfile.seek(0)  # Reset CSV file to start
-            next(reader)  # Skip header
-
-            for row in tqdm(reader, total=total_rows, desc="Translating..."):
-                if row['uuid'] not in processed_uuids:
-                    token_count = self.tokenizer.get_token_count(row['text'])
-
-                    if token_count > max_tokens:
-                        # Handle long single entries immediately
-                        split_texts = self._split_text(row['text'], max_tokens)
-                        for text in split_texts:
-                            translated_text = self.translator.translate([text])[0]
-                            self._write_to_csv(translated_csv_path, row['uuid'], translated_text)
-                    else:
-                        # Accumulate (uuid, text) pairs until token limit is reached
-                        if current_token_count + token_count > max_tokens:
-                            # Translate accumulated texts
-                            uuids, texts = zip(*texts_to_translate)
-                            translated_texts = self.translator.translate(list(texts))
-                            for uuid, translated in zip(uuids, translated_texts):
-                                self._write_to_csv(translated_csv_path, uuid, translated)
-                            texts_to_translate = []
-                            current_token_count = 0
-
-                        texts_to_translate.append((row['uuid'], row['text']))
-                        current_token_count += token_count
-
-                # Translate any remaining texts
-            if texts_to_translate:
-                uuids, texts = zip(*texts_to_translate)
-                translated_texts = self.translator.translate(list(texts))
-                for uuid, translated in zip(uuids, translated_texts):
-                    self._write_to_csv(translated_csv_path, uuid, translated)
+    def _apply_translation_memory(self, pending_rows, store, report=True):
+        # Commits every row already known to the translation memory and returns the misses
+        if self.translation_memory is None or not pending_rows:
+            return pending_rows
 
-    def _split_text(self, text, max_tokens):
-        tokens = self.tokenizer.tokenize(text)
-        segments = []
-        current_segment = []
-        current_token_count = 0
-
-        for token in tokens:
-            if current_token_count + self.tokenizer.get_token_count(token) <= max_tokens:
-                current_segment.append(token)
-                current_token_count += self.tokenizer.get_token_count(token)
-            else:
-                segments.append(' '.join(current_segment))
-                current_segment = [token]
-                current_token_count = self.tokenizer.get_token_count(token)
-
-        if current_segment:
-            segments.append(' '.join(current_segment))
-
-        return segments
-
-    def _get_processed_uuids(self, translated_csv_path):
+        found = self.translation_memory.lookup_many([row[1] for row in pending_rows],
+                                                    TARGET_LANGUAGE, self.memory_model, COMPATIBLE_PROMPT_VERSIONS)
+        store.save_translations((row[0], found[row[1]]) for row in pending_rows if row[1] in found)
+        misses = [row for row in pending_rows if row[1] not in found]
+
+        if report:
+            print(f"Translation memory: {len(pending_rows) - len(misses)} hits, {len(misses)} misses")
+        return misses
+
+    def _plan(self, rows):
+        # Planning tokenizes long entries on the calling thread, because the tokenizers are not safe to
+        # share between workers
+        plan = self.planner.plan(rows, self._split_text)
+        for entry_id, chunks in plan.split_entries.items():
+            self.split_entries[entry_id] = [chunks, {}, None]
+        return plan
+
+    def _build_batches(self, plan, store):
+        # Returns a list of (batch_id, entries) jobs
+        return [(store.create_batch(len({entry_id for entry_id, _ in batch}), token_count), batch)
+                for batch, token_count in plan.batches]
+
+    def _translate_batch(self, batch, on_results=None):
+        # Returns (id, original_text, translated_text) triples for the batch and the number of texts
+        # that could not be translated. on_results receives the triples accepted while the batch is in flight.
+        # A chunk of a long entry may have the same text as another entry; such texts are sent once.
+        ids_of = {}
+        for entry_id, text in batch:
+            ids_of.setdefault(text, []).append(entry_id)
+        on_entries = None
+        if on_results is not None:
+            on_entries = lambda entries: on_results([(entry_id, text, value) for text, value in entries.items()
+                                                     for entry_id in ids_of[text]])
+        translations, missing = self.translator.translate_partial(list(ids_of), on_entries=on_entries)
+        return [(entry_id, text, translations[text]) for entry_id, text in batch if text in translations], len(missing)
+
+    def _run_job(self, job, events):
+        started = time.perf_counter()
         try:
-            with open(translated_csv_path, 'r', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                return {row['uuid'] for row in reader}
-        except FileNotFoundError:
-            return set()
+            results, missing = self._translate_batch(job[1], lambda results: events.put((job, results, None, False)))
+            results, error = self._batch_outcome(results, missing)
+        except Exception as e:
+            results, error = None, e
+        if self.metrics is not None:
+            self.metrics.record_batch(job[0], len(job[1]), len(results or ()), time.perf_counter() - started,
+                                      str(error) if error is not None else None)
+        events.put((job, results, error, True))
 
-    def _write_to_csv(self, file_path, uuid, translated_text):
-        file_exists = os.path.isfile(file_path)
-        with open(file_path, 'a', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['uuid', 'translated_text']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    def _dispatch_batches(self, jobs):
+        # Yields (job, results, error, finished): the entries of a batch as they are accepted (finished False),
+        # then its outcome once (finished True), where results may be partial when error is set. Everything is
+        # yielded on the calling thread, which owns the store's connection.
+        events = queue.Queue()
+        with self._batch_executor() as executor:
+            for job in jobs:
+                executor.submit(self._run_job, job, events)
+            pending = len(jobs)
+            while pending:
+                event = events.get()
+                if event[3]:
+                    pending -= 1
+                yield event
 
-            if not file_exists:
-                writer.writeheader()
+    @contextmanager
+    def _batch_executor(self):
+        # Runs _run_job for the batches submitted to it, self.concurrency at a time
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            try:
+                yield executor
+            except BaseException:
+                # Don't keep paying for queued batches once the run has been interrupted
+                executor.shutdown(cancel_futures=True)
+                raise
 
-            writer.writerow({'uuid': uuid, 'translated_text': translated_text})
+    def _batch_outcome(self, results, missing):
+        if missing:
+            return results, Exception(f"{missing} entries could not be translated")
+        return results, None
+
+    def _split_text(self, text, max_tokens):
+        # The language tokenizer is only loaded for sentences too long to fit a request on their own
+        return split_text(text, max_tokens, self.token_counter.get_token_count,
+                          lambda sentence: self.tokenizer.tokenize(sentence))
 
 # Example usage:
-# controller = GPTRequestController(max_tokens=100)
-# controller.process_csv('original.csv', 'translated.csv')
+# controller = GPTRequestController(context_budget=4096, language='Japanese', concurrency=4)
+# controller.process_store(ProjectStore('path/to/game'))
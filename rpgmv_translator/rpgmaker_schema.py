@@ -0,0 +1,221 @@
+import re
+
+# Event commands that carry player visible text, mapped to the indices of their text parameters.
+# 101 is the message header (parameter 4 is the MZ speaker name), 102 lists the choices,
+# 401/405 are message and scrolling text lines, 402 is the label of a choice branch and
+# 320/324/325 change an actor's name, nickname and profile.
+TEXT_COMMANDS = {
+    101: (4,),
+    102: (0,),
+    320: (1,),
+    324: (1,),
+    325: (1,),
+    401: (0,),
+    402: (1,),
+    405: (0,),
+}
+
+# Text fields of the database files. 'note' is kept for the <hint:...> tags.
+DATABASE_FIELDS = {
+    'Actors.json': ('name', 'nickname', 'profile', 'note'),
+    'Armors.json': ('name', 'description', 'note'),
+    'Classes.json': ('name', 'note'),
+    'Enemies.json': ('name', 'note'),
+    'Items.json': ('name', 'description', 'note'),
+    'Skills.json': ('name', 'description', 'message1', 'message2', 'note'),
+    'States.json': ('name', 'message1', 'message2', 'message3', 'message4', 'note'),
+    'Weapons.json': ('name', 'description', 'note'),
+}
+
+# Files without any player visible text (MapInfos names are only shown in the editor)
+NON_TEXT_FILES = ('Animations.json', 'MapInfos.json', 'Tilesets.json')
+
+MAP_FILE_REGEX = re.compile(r'^Map\d+\.json$')
+
+
+def walk_text_fields(file_name, data, process_string, on_group=None):
+    """
+    Calls process_string on every text field of a known RPG Maker MV/MZ data file and
+    stores the value it returns. on_group, when given, is called with the id of each
+    event or database entry before its fields are visited, so that strings can be kept
+    together with their context. Returns False when the file's layout is not known.
+    """
+    on_group = on_group or (lambda group: None)
+    if file_name in NON_TEXT_FILES:
+        return True
+    if file_name in DATABASE_FIELDS:
+        return _walk_database(data, DATABASE_FIELDS[file_name], process_string, on_group)
+    if MAP_FILE_REGEX.match(file_name):
+        return _walk_map(data, process_string, on_group)
+    if file_name == 'CommonEvents.json':
+        return _walk_common_events(data, process_string, on_group)
+    if file_name == 'Troops.json':
+        return _walk_troops(data, process_string, on_group)
+    if file_name == 'System.json':
+        return _walk_system(data, process_string)
+    return False
+
+
+def has_text_layout(file_name):
+    # Whether walk_text_fields and text_field_group know the file
+    return (file_name in NON_TEXT_FILES or file_name in DATABASE_FIELDS or bool(MAP_FILE_REGEX.match(file_name))
+            or file_name in ('CommonEvents.json', 'Troops.json', 'System.json'))
+
+
+def text_field_group(file_name, path, code_at):
+    """
+    The rules of walk_text_fields for one string of a file read by JSONStringScanner, which
+    never holds the whole document: path is the string's (key or index, ...) path and
+    code_at(depth) the 'code' of the object at that depth of it. Returns (whether the string
+    is a text field, its group or None outside of any entry). Entries are grouped by their
+    index, which is their id in files written by RPG Maker, as is writing a command's code
+    before its parameters.
+    """
+    if file_name in NON_TEXT_FILES or not path:
+        return False, None
+    if file_name in DATABASE_FIELDS:
+        return len(path) == 2 and isinstance(path[0], int) and path[1] in DATABASE_FIELDS[file_name], str(path[0])
+    if MAP_FILE_REGEX.match(file_name):
+        if path in (('displayName',), ('note',)):
+            return True, None
+        if len(path) < 3 or path[0] != 'events' or not isinstance(path[1], int):
+            return False, None
+        if path[2:] == ('note',):
+            return True, str(path[1])
+        return path[2] == 'pages' and _is_page_text(path, 3, code_at), str(path[1])
+    if file_name == 'CommonEvents.json':
+        return (isinstance(path[0], int) and path[1:2] == ('list',) and _is_command_text(path, 2, code_at),
+                str(path[0]))
+    if file_name == 'Troops.json':
+        return (isinstance(path[0], int) and path[1:2] == ('pages',) and _is_page_text(path, 2, code_at),
+                str(path[0]))
+    if file_name == 'System.json':
+        return _is_system_text(path), None
+    return False, None
+
+
+def _is_page_text(path, start, code_at):
+    # path[start] is the index of a page, whose 'list' holds the commands
+    return (len(path) > start + 1 and isinstance(path[start], int) and path[start + 1] == 'list'
+            and _is_command_text(path, start + 2, code_at))
+
+
+def _is_command_text(path, start, code_at):
+    # path[start:] is (command index, 'parameters', parameter index) and, for a list parameter, the item's index
+    rest = path[start:]
+    if len(rest) not in (3, 4) or not isinstance(rest[0], int) or rest[1] != 'parameters' \
+            or not all(isinstance(index, int) for index in rest[2:]):
+        return False
+    # The command object is the container whose member is 'parameters'
+    return rest[2] in TEXT_COMMANDS.get(code_at(start + 1), ())
+
+
+def _is_system_text(path):
+    if path in (('gameTitle',), ('currencyUnit',)):
+        return True
+    if len(path) == 2 and path[0] in ('armorTypes', 'elements', 'equipTypes', 'skillTypes', 'weaponTypes'):
+        return isinstance(path[1], int)
+    if len(path) == 3 and path[0] == 'terms':
+        if path[1] in ('basic', 'commands', 'params'):
+            return isinstance(path[2], int)
+        return path[1] == 'messages'
+    return False
+
+
+def _process_fields(obj, fields, process_string):
+    for field in fields:
+        value = obj.get(field)
+        if isinstance(value, str):
+            obj[field] = process_string(value)
+
+
+def _process_list(values, process_string):
+    for i, value in enumerate(values):
+        if isinstance(value, str):
+            values[i] = process_string(value)
+
+
+def _walk_database(data, fields, process_string, on_group):
+    if not isinstance(data, list):
+        return False
+    for entry in data:
+        if isinstance(entry, dict):
+            on_group(str(entry.get('id')))
+            _process_fields(entry, fields, process_string)
+    return True
+
+
+def _walk_commands(commands, process_string):
+    if not isinstance(commands, list):
+        return
+    for command in commands:
+        if not isinstance(command, dict) or command.get('code') not in TEXT_COMMANDS:
+            continue
+        parameters = command.get('parameters')
+        if not isinstance(parameters, list):
+            continue
+        for index in TEXT_COMMANDS[command['code']]:
+            if index >= len(parameters):
+                continue
+            if isinstance(parameters[index], str):
+                parameters[index] = process_string(parameters[index])
+            elif isinstance(parameters[index], list):
+                _process_list(parameters[index], process_string)
+
+
+def _walk_pages(pages, process_string):
+    if isinstance(pages, list):
+        for page in pages:
+            if isinstance(page, dict):
+                _walk_commands(page.get('list'), process_string)
+
+
+def _walk_map(data, process_string, on_group):
+    if not isinstance(data, dict):
+        return False
+    _process_fields(data, ('displayName', 'note'), process_string)
+    for event in data.get('events') or []:
+        if isinstance(event, dict):
+            on_group(str(event.get('id')))
+            _process_fields(event, ('note',), process_string)
+            _walk_pages(event.get('pages'), process_string)
+    return True
+
+
+def _walk_common_events(data, process_string, on_group):
+    if not isinstance(data, list):
+        return False
+    for common_event in data:
+        if isinstance(common_event, dict):
+            on_group(str(common_event.get('id')))
+            _walk_commands(common_event.get('list'), process_string)
+    return True
+
+
+def _walk_troops(data, process_string, on_group):
+    if not isinstance(data, list):
+        return False
+    for troop in data:
+        if isinstance(troop, dict):
+            on_group(str(troop.get('id')))
+            _walk_pages(troop.get('pages'), process_string)
+    return True
+
+
+def _walk_system(data, process_string):
+    if not isinstance(data, dict):
+        return False
+    _process_fields(data, ('gameTitle', 'currencyUnit'), process_string)
+    for field in ('armorTypes', 'elements', 'equipTypes', 'skillTypes', 'weaponTypes'):
+        if isinstance(data.get(field), list):
+            _process_list(data[field], process_string)
+
+    terms = data.get('terms')
+    if isinstance(terms, dict):
+        for field in ('basic', 'commands', 'params'):
+            if isinstance(terms.get(field), list):
+                _process_list(terms[field], process_string)
+        messages = terms.get('messages')
+        if isinstance(messages, dict):
+            _process_fields(messages, list(messages), process_string)
+    return True
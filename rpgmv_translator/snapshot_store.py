@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; blobs are always compressed there
+    fcntl = None
+
+SNAPSHOT_DIRECTORY = '.snapshots'
+# ioctl that makes a copy-on-write clone of a file on btrfs, XFS and other reflink capable filesystems
+FICLONE = 0x40049409
+_CHUNK_SIZE = 1 << 20
+
+
+class SnapshotStore:
+    """
+    Restore points of a project's data files. File contents are stored once as blobs named
+    after their hash and shared by every snapshot, so a snapshot of unchanged files only
+    costs its manifest. Blobs are reflinked copies where the filesystem supports it and
+    zlib-compressed files otherwise.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.root = os.path.join(directory, SNAPSHOT_DIRECTORY)
+        self.objects = os.path.join(self.root, 'objects')
+        self.manifests = os.path.join(self.root, 'snapshots')
+
+    @staticmethod
+    def file_hash(file_path):
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def relative_path(self, file_path):
+        # Key of a file in the manifests
+        return os.path.relpath(file_path, self.directory).replace(os.sep, '/')
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.objects, content_hash[:2], content_hash[2:])
+
+    def _find_blob(self, content_hash):
+        # Returns (path, compressed) of a stored blob, or None
+        path = self._blob_path(content_hash)
+        if os.path.exists(path):
+            return path, False
+        if os.path.exists(path + '.z'):
+            return path + '.z', True
+        return None
+
+    def _store_blob(self, file_path, content_hash):
+        if self._find_blob(content_hash) is not None:
+            return
+        path = self._blob_path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        if _clone(file_path, temp_path):
+            os.replace(temp_path, path)
+            return
+        compressor = zlib.compressobj(6)
+        with open(file_path, 'rb') as source, open(temp_path, 'wb') as output:
+            for chunk in iter(lambda: source.read(_CHUNK_SIZE), b''):
+                output.write(compressor.compress(chunk))
+            output.write(compressor.flush())
+        os.replace(temp_path, path + '.z')
+
+    def create(self, file_paths, label=None, base=None):
+        """
+        Stores the given files and returns the new snapshot's id. Files of the base snapshot
+        that are not given are carried over, so partial snapshots stay complete.
+        """
+        files = dict(self.load(base)['files']) if base is not None else {}
+        # Created on the first snapshot only, so listing the snapshots of any directory leaves it alone
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.manifests, exist_ok=True)
+        for file_path in file_paths:
+            content_hash = self.file_hash(file_path)
+            self._store_blob(file_path, content_hash)
+            files[self.relative_path(file_path)] = content_hash
+
+        snapshot_id = max((snapshot['id'] for snapshot in self.list()), default=0) + 1
+        manifest = {'id': snapshot_id, 'label': label, 'created_at': time.time(), 'files': files}
+        temp_path = os.path.join(self.manifests, f'{snapshot_id}.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(self.manifests, f'{snapshot_id}.snapshot'))
+        return snapshot_id
+
+    def load(self, snapshot_id):
+        path = os.path.join(self.manifests, f'{snapshot_id}.snapshot')
+        if not os.path.exists(path):
+            raise ValueError(f"Snapshot {snapshot_id} does not exist.")
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def list(self):
+        # Manifests of every snapshot, oldest first; a directory without a store has none
+        if not os.path.isdir(self.manifests):
+            return []
+        snapshots = [self.load(name[:-len('.snapshot')]) for name in os.listdir(self.manifests)
+                     if name.endswith('.snapshot')]
+        return sorted(snapshots, key=lambda snapshot: snapshot['id'])
+
+    def latest(self, label=None):
+        snapshots = [snapshot for snapshot in self.list() if label is None or snapshot['label'] == label]
+        return snapshots[-1]['id'] if snapshots else None
+
+    def restore(self, snapshot_id):
+        # Puts the snapshot's files back; files that already match are left alone. Returns the number rewritten.
+        restored = 0
+        for relative_path, content_hash in self.load(snapshot_id)['files'].items():
+            file_path = os.path.join(self.directory, relative_path)
+            if os.path.exists(file_path) and self.file_hash(file_path) == content_hash:
+                continue
+            blob = self._find_blob(content_hash)
+            if blob is None:
+                raise FileNotFoundError(f"Snapshot {snapshot_id} is missing the content of {relative_path}")
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            temp_path = file_path + '.tmp'
+            blob_path, compressed = blob
+            if compressed:
+                decompressor = zlib.decompressobj()
+                with open(blob_path, 'rb') as source, open(temp_path, 'wb') as output:
+                    for chunk in iter(lambda: source.read(_CHUNK_SIZE), b''):
+                        output.write(decompressor.decompress(chunk))
+                    output.write(decompressor.flush())
+            elif not _clone(blob_path, temp_path):
+                shutil.copyfile(blob_path, temp_path)
+            os.replace(temp_path, file_path)
+            restored += 1
+        return restored
+
+    def remove(self, snapshot_id):
+        # Deletes a snapshot and the blobs no other snapshot uses
+        os.remove(os.path.join(self.manifests, f'{snapshot_id}.snapshot'))
+        used = {content_hash for snapshot in self.list() for content_hash in snapshot['files'].values()}
+        for prefix in os.listdir(self.objects):
+            for name in os.listdir(os.path.join(self.objects, prefix)):
+                if prefix + name.split('.')[0] not in used:
+                    os.remove(os.path.join(self.objects, prefix, name))
+
+    def disk_usage(self):
+        return sum(os.path.getsize(os.path.join(dirpath, name))
+                   for dirpath, _, names in os.walk(self.root) for name in names)
+
+
+def _clone(source_path, target_path):
+    # Reflinks source to target; returns False when the platform or filesystem can't
+    if fcntl is None:
+        return False
+    try:
+        with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError:
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        return False
@@ -0,0 +1,70 @@
+import re
+from rpgmv_translator.control_codes import strip_control_codes
+
+KEEP = 'keep'
+SKIP = 'skip'
+# XML-like values whose <hint:...> tags are translated separately
+HINT = 'hint'
+
+
+class ClassificationRules:
+    """
+    Decides which strings of a given source language are worth translating.
+    script_ranges: codepoint ranges of the source language's script; a string must contain one.
+    reject_characters: characters that mark code, paths or formulas rather than text.
+    control_codes: ignore RPG Maker message codes such as \\C[2], which are swapped for
+    placeholders before translation (see control_codes).
+    """
+
+    def __init__(self, script_ranges, reject_characters='$=/<>{}_', allow_newline_escapes=True, control_codes=True):
+        self.control_codes = control_codes
+        self.script_regex = re.compile('[' + ''.join(f'{chr(start)}-{chr(end)}' for start, end in script_ranges) + ']')
+        reject = '[' + re.escape(reject_characters) + ']'
+        # Backslashes only appear in control codes, except for escaped newlines
+        reject += r'|\\(?!n)' if allow_newline_escapes else r'|\\'
+        self.reject_regex = re.compile(reject)
+
+
+RULE_SETS = {
+    # Hiragana, Katakana and CJK ideographs
+    'Japanese': ClassificationRules([(0x3040, 0x309F), (0x30A0, 0x30FF), (0x4E00, 0x9FFF)]),
+    'Chinese': ClassificationRules([(0x4E00, 0x9FFF), (0x3400, 0x4DBF)]),
+    'Korean': ClassificationRules([(0xAC00, 0xD7A3), (0x1100, 0x11FF), (0x3130, 0x318F)]),
+}
+
+
+class StringClassifier:
+    def __init__(self, language='Japanese', rules=None):
+        if rules is None:
+            if language not in RULE_SETS:
+                raise ValueError(f"Unsupported language: {language}")
+            rules = RULE_SETS[language]
+        self.rules = rules
+        self._decisions = {}
+
+    def _classify_uncached(self, text):
+        if self.rules.control_codes:
+            text = strip_control_codes(text)
+        if '<' in text and '>' in text:
+            return HINT
+        if self.rules.script_regex.search(text) and not self.rules.reject_regex.search(text):
+            return KEEP
+        return SKIP
+
+    def classify(self, text):
+        decision = self._decisions.get(text)
+        if decision is None:
+            decision = self._decisions[text] = self._classify_uncached(text)
+        return decision
+
+    def classify_batch(self, texts):
+        # Each distinct string is classified once; game files repeat the same strings a lot
+        decisions = self._decisions
+        classify = self._classify_uncached
+        result = []
+        for text in texts:
+            decision = decisions.get(text)
+            if decision is None:
+                decision = decisions[text] = classify(text)
+            result.append(decision)
+        return result
@@ -0,0 +1,70 @@
+import hashlib
+from array import array
+
+
+def string_id(text):
+    """
+    ID of a source string, derived from its text: every extraction worker and every run over
+    the same game give the same string the same ID without sharing a table. 63 bits keep it a
+    positive SQLite integer; two of a million strings share an ID with a chance of about 1 in 20
+    million.
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big') >> 1
+
+
+class StringPool:
+    """
+    The strings extracted from one file: each distinct text once, in the order it was first
+    seen, with its ID and context group, and the byte span of every place it occurs. IDs and
+    spans are kept in arrays of 64-bit integers, which keeps a file's result small and pickles
+    it to a few buffers on its way back from an extraction worker.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.texts = []
+        self.groups = []
+        self.starts = array('q')
+        self.ends = array('q')
+        # ID of the string at each span; 0 for an XML-like field whose <hint:...> parts are translated
+        self.location_ids = array('q')
+        # Control codes and numbers of a string stored as a template (JSON), or None
+        self.args = []
+        self._seen = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_seen']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._seen = set(self.ids)
+
+    def add(self, text, group=None):
+        # Returns the text's ID; the group of its first occurrence is kept
+        text_id = string_id(text)
+        if text_id not in self._seen:
+            self._seen.add(text_id)
+            self.ids.append(text_id)
+            self.texts.append(text)
+            self.groups.append(group)
+        return text_id
+
+    def locate(self, start, end, text_id=None, args=None):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.location_ids.append(text_id or 0)
+        self.args.append(args)
+
+    def entries(self):
+        # (id, text, group) of every distinct string
+        return zip(self.ids, self.texts, self.groups)
+
+    def locations(self):
+        # (start, end, id, args) of every span, with None as the id of hint fields
+        return ((start, end, text_id or None, args)
+                for start, end, text_id, args in zip(self.starts, self.ends, self.location_ids, self.args))
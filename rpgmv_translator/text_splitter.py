@@ -0,0 +1,77 @@
+import re
+from rpgmv_translator.control_codes import CONTROL_CODE_REGEX, PLACEHOLDER_REGEX
+
+# A sentence ends with a line break, or with 。！？!? and any closing quotes after them; the whitespace
+# that follows stays with it. A \! or \. control code is not an end of sentence.
+SENTENCE_END_REGEX = re.compile(r'(?:\n|(?<!\\)[。！？!?]+[」』）)”’"\']*)\s*')
+
+
+def _sentences(text):
+    start = 0
+    for match in SENTENCE_END_REGEX.finditer(text):
+        yield text[start:match.end()]
+        start = match.end()
+    if start < len(text):
+        yield text[start:]
+
+
+def _cut_sentence(sentence, max_tokens, count_tokens, tokenize):
+    # Cuts a sentence that is too long on its own between the tokenizer's words, never inside
+    # a placeholder or a control code
+    protected = [match.span() for regex in (PLACEHOLDER_REGEX, CONTROL_CODE_REGEX) for match in regex.finditer(sentence)]
+    blocked = set()
+    for start, end in protected:
+        blocked.update(range(start + 1, end))
+
+    pieces = []
+    start = position = 0
+    piece_tokens = 0
+    for word in tokenize(sentence):
+        offset = sentence.find(word, position)
+        if offset < 0:
+            # The tokenizer changed the word; the rest of the sentence is kept in one piece
+            break
+        word_tokens = count_tokens(word)
+        if piece_tokens and piece_tokens + word_tokens > max_tokens and offset not in blocked:
+            pieces.append((sentence[start:offset], piece_tokens))
+            start, piece_tokens = offset, 0
+        piece_tokens += word_tokens
+        position = offset + len(word)
+    if start < len(sentence):
+        pieces.append((sentence[start:], count_tokens(sentence[start:])))
+    return pieces
+
+
+def split_text(text, max_tokens, count_tokens, tokenize):
+    """
+    Returns (chunk, token_count) pairs of at most max_tokens each that join back into text.
+    Chunks end on line breaks and sentence ends where possible; only sentences too long for
+    a chunk of their own are cut between the words given by tokenize. Every part of the text
+    is tokenized once.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for sentence in _sentences(text):
+        tokens = count_tokens(sentence)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append((''.join(current), current_tokens))
+            current, current_tokens = [], 0
+        if tokens > max_tokens:
+            chunks.extend(_cut_sentence(sentence, max_tokens, count_tokens, tokenize))
+            continue
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append((''.join(current), current_tokens))
+    return chunks
+
+
+def join_chunks(chunks, translations):
+    # The model drops the line breaks around a chunk, so each translation gets its chunk's own back
+    parts = []
+    for chunk, translation in zip(chunks, translations):
+        stripped = chunk.strip()
+        lead = chunk[:chunk.index(stripped)] if stripped else chunk
+        trail = chunk[len(lead) + len(stripped):]
+        parts.append(lead + translation.strip() + trail if stripped else chunk)
+    return ''.join(parts)
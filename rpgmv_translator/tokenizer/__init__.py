@@ -0,0 +1,20 @@
+import importlib
+
+# Tokenizer backends are imported and built on first use: loading nltk or the
+# Sudachi dictionary is slow, and most commands never need either.
+TOKENIZERS = {
+    'English': ('rpgmv_translator.tokenizer.english_tokenizer', 'EnglishTokenizer'),
+    'Japanese': ('rpgmv_translator.tokenizer.japanese_tokenizer', 'JapaneseTokenizer'),
+    'approximate': ('rpgmv_translator.tokenizer.approximate_tokenizer', 'ApproximateTokenizer'),
+}
+
+_instances = {}
+
+
+def get_tokenizer(name):
+    if name not in _instances:
+        if name not in TOKENIZERS:
+            raise ValueError(f"Unsupported language: {name}")
+        module_name, class_name = TOKENIZERS[name]
+        _instances[name] = getattr(importlib.import_module(module_name), class_name)()
+    return _instances[name]
@@ -0,0 +1,25 @@
+import math
+import re
+from rpgmv_translator.tokenizer.tokenizer_base import AbstractTokenizer
+
+# Kana and kanji are mostly one BPE token per character in the GPT vocabularies,
+# ASCII words are roughly one token per four characters and any other symbol is one token.
+_CJK = r'\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF'
+_CJK_REGEX = re.compile(f'[{_CJK}]')
+_WORD_REGEX = re.compile(r'[A-Za-z0-9]+')
+_SYMBOL_REGEX = re.compile(f'[^\\sA-Za-z0-9{_CJK}]')
+_PIECE_REGEX = re.compile(f'[{_CJK}]|[A-Za-z0-9]+|[^\\sA-Za-z0-9{_CJK}]')
+
+
+class ApproximateTokenizer(AbstractTokenizer):
+    """
+    Fast estimate of the number of model tokens in a text, close enough to the API's
+    own accounting for batching and price estimates without loading a dictionary.
+    """
+
+    def tokenize(self, text):
+        return _PIECE_REGEX.findall(text)
+
+    def get_token_count(self, text):
+        word_tokens = sum(math.ceil(len(word) / 4) for word in _WORD_REGEX.findall(text))
+        return len(_CJK_REGEX.findall(text)) + word_tokens + len(_SYMBOL_REGEX.findall(text))
@@ -11,10 +11,12 @@ def download_nltk_punkt_if_missing():
         # If not present, download 'punkt'
         nltk.download('punkt')
 
-download_nltk_punkt_if_missing()
-
 class EnglishTokenizer(AbstractTokenizer):
 
+    def __init__(self):
+        # Done here rather than at import time so that importing this module stays cheap
+        download_nltk_punkt_if_missing()
+
     def tokenize(self, text):
         return word_tokenize(text)
 
@@ -15,4 +15,14 @@ class AbstractTokenizer(ABC):
         """
         Return the count of tokens in the given text.
         """
-        pass
\ No newline at end of file
+        pass
+
+    def get_token_counts(self, texts):
+        """
+        Return the token count of every text, counting each distinct text only once.
+        """
+        counts = {}
+        for text in texts:
+            if text not in counts:
+                counts[text] = self.get_token_count(text)
+        return [counts[text] for text in texts]
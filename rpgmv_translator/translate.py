@@ -1,12 +1,51 @@
 import os
 import sys
-from rpgmv_translator.utils import is_rpgmv_folder, duplicate_json_files
+import time
+from rpgmv_translator.utils import is_rpgmv_folder
+from rpgmv_translator.snapshot_store import SnapshotStore
 from rpgmv_translator.json_handler import JSONHandler
+from rpgmv_translator.project_store import ProjectStore
 from rpgmv_translator.request_controller import GPTRequestController
-from rpgmv_translator.utils import read_progress_log, update_progress_log
+from rpgmv_translator.translation_memory import TranslationMemory
+from rpgmv_translator.metrics import MetricsRecorder, METRICS_FILE
+from rpgmv_translator.pipeline import TranslationPipeline
+from rpgmv_translator.bulk import BulkJob
+from rpgmv_translator.translator import DEFAULT_ESCALATION
 
 class RPGMVTranslator:
-    def __init__(self, path):
+    def __init__(self, path, concurrency=1, requests_per_minute=None, tokens_per_minute=None,
+                 use_translation_memory=True, extraction_workers=1, api_key=None, base_url=None,
+                 stage_listener=None, context_budget=4096, streaming=False, backends=None,
+                 metrics_file=METRICS_FILE, prometheus_file=None, models=None, escalation_model=DEFAULT_ESCALATION,
+                 escalation_budget=None, max_escalated_share=None, latency_weight=0.0, pipelined=False):
+        self.concurrency = concurrency
+        # Tokens per request, prompt and reply included
+        self.context_budget = context_budget
+        self.streaming = streaming
+        self.extraction_workers = extraction_workers
+        self.use_translation_memory = use_translation_memory
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.api_key = api_key
+        self.base_url = base_url
+        # Backend configs to route the batches over, see translator.backends
+        self.backends = backends
+        # Model scheduling, see ModelScheduler; backend configs carry their own models
+        self.models = models
+        self.escalation_model = escalation_model
+        self.escalation_budget = escalation_budget
+        self.max_escalated_share = max_escalated_share
+        self.latency_weight = latency_weight
+        # JSONL file receiving a record per request and per batch (None disables it) and an
+        # optional Prometheus text file written at the end of the run
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        # Translate and reinject files while the others are still being extracted
+        self.pipelined = pipelined
+        # Optional callable(step, 'start' | 'end') used by the benchmarks to sample each step
+        self.stage_listener = stage_listener
+        self.stage_timings = {}
+
         # Check if the path is an existing file
         if os.path.isfile(path) and path.endswith('.json'):
             self.directory = os.path.dirname(path)
@@ -26,7 +65,8 @@ class RPGMVTranslator:
             self.specific_file = None
 
 
-        self.json_handler = JSONHandler(self.directory, self.specific_file)
+        self.store = None
+        self.json_handler = None
 
         print(f"Operating on directory: {self.directory}")
         if self.specific_file:
@@ -36,28 +76,198 @@ class RPGMVTranslator:
 
 
     def translate(self):
+        self._open_project()
+        self._detect_changed_files()
+
+        # Step names match the old progress.log so that projects started before the store still resume
+        self._run_step('duplicate_json_files', lambda: self._snapshot('original'))
+        if self.pipelined and not self.store.is_step_completed('read_and_process_jsons'):
+            # Resumed runs whose extraction already finished go through the steps below as usual
+            self._run_step('pipeline', self._run_pipeline)
+        self._run_step('read_and_process_jsons',
+                       lambda: self.json_handler.read_and_process_jsons(workers=self.extraction_workers))
+        self._run_step('process_csv', self._translate_strings)
+        self._finish()
+
+    def export_bulk(self, file_path=None):
+        """
+        Extracts the strings like translate(), then writes the batches of the pending ones to a
+        JSONL request file for the OpenAI batch API instead of sending them. Returns the file's
+        path, or None when there was nothing to send.
+        """
+        self._open_project()
+        self._detect_changed_files()
+        self._run_step('duplicate_json_files', lambda: self._snapshot('original'))
+        self._run_step('read_and_process_jsons',
+                       lambda: self.json_handler.read_and_process_jsons(workers=self.extraction_workers))
+        return self._run_bulk(None, file_path)
+
+    def import_bulk(self, result_paths, file_path=None):
+        """
+        Commits the batch API's results files and writes the entries that failed to a follow-up
+        request file, whose path is returned (None when nothing is left to send). Files changed
+        since the export are extracted again and their new strings go into the same file. The
+        files are rewritten once every submitted batch is in.
+        """
+        self._open_project()
+        if not self.store.is_step_completed('read_and_process_jsons'):
+            self.store.close()
+            raise ValueError("Nothing was extracted from this project yet, export a bulk request file first.")
+        self._detect_changed_files()
+        self._run_step('read_and_process_jsons',
+                       lambda: self.json_handler.read_and_process_jsons(workers=self.extraction_workers))
+        return self._run_bulk(result_paths, file_path)
+
+    def _open_project(self):
         if not is_rpgmv_folder(self.directory):
             raise ValueError("The path is not a valid RPGMV folder.")
 
-        progress = read_progress_log(self.directory)
+        self.store = ProjectStore(self.directory)
+        self.json_handler = JSONHandler(self.directory, self.specific_file, store=self.store)
+
+    def _finish(self):
+        self._run_step('update_jsons_with_translations', self.json_handler.update_jsons_with_translations)
+        self._run_step('snapshot_translated', lambda: self._snapshot('translated'))
+
+        self.store.close()
+
+    def _detect_changed_files(self):
+        # After a game update only the replaced files are extracted, translated and rewritten again
+        if not self.store.is_step_completed('read_and_process_jsons'):
+            return
+        if not self.store.has_file_manifest():
+            # Projects extracted before the manifest existed: the files as they are now are our output
+            self.json_handler.record_current_files(
+                needs_update=not self.store.is_step_completed('update_jsons_with_translations'))
+            return
+
+        changed_files = self.json_handler.find_changed_files()
+        if not changed_files:
+            return
+        print(f"{len(changed_files)} files changed since the last run, translating them again.")
+        # The replaced files are the new originals
+        self._snapshot('original', changed_files)
+        self.store.reset_steps(['read_and_process_jsons', 'pipeline', 'process_csv',
+                                'update_jsons_with_translations', 'snapshot_translated'])
+
+    def _snapshot(self, label, file_paths=None):
+        # Snapshots share their file contents, so unchanged files cost nothing; files not given are
+        # carried over from the previous snapshot with the same label
+        snapshots = SnapshotStore(self.directory)
+        if file_paths is None:
+            file_paths = self.json_handler._list_json_files()
+        base = snapshots.latest(label)
+        translated = snapshots.latest('translated')
+        if label == 'original' and translated is not None:
+            # Files that are our own output, e.g. after the translated snapshot was restored, are no originals;
+            # the ones recorded before are kept for them
+            output = snapshots.load(translated)['files']
+            file_paths = [file_path for file_path in file_paths
+                          if output.get(snapshots.relative_path(file_path)) != snapshots.file_hash(file_path)]
+            if not file_paths and base is not None:
+                return
+        snapshot_id = snapshots.create(file_paths, label=label, base=base)
+        if label == 'translated' and base is not None:
+            # The translated files can be rebuilt from the originals and the store, so only the latest
+            # snapshot of them is kept; each run would otherwise leave a full copy of the output behind
+            for snapshot in snapshots.list():
+                if snapshot['label'] == label and snapshot['id'] != snapshot_id:
+                    snapshots.remove(snapshot['id'])
+
+    def _run_step(self, step, func):
+        if self.store.is_step_completed(step):
+            return
+
+        self._timed(step, func)
+        self.store.mark_step_completed(step)
+
+    def _timed(self, step, func):
+        # Time spent in a step, added up over the calls
+        if self.stage_listener is not None:
+            self.stage_listener(step, 'start')
+        start = time.perf_counter()
+        result = func()
+        self.stage_timings[step] = self.stage_timings.get(step, 0.0) + time.perf_counter() - start
+        if self.stage_listener is not None:
+            self.stage_listener(step, 'end')
+        return result
+
+    def _create_controller(self, translation_memory, metrics, api_key=None):
+        return GPTRequestController(context_budget=self.context_budget, language='Japanese',
+                                    concurrency=self.concurrency,
+                                    requests_per_minute=self.requests_per_minute,
+                                    tokens_per_minute=self.tokens_per_minute,
+                                    translation_memory=translation_memory,
+                                    api_key=self.api_key if api_key is None else api_key, base_url=self.base_url,
+                                    streaming=self.streaming, backends=self.backends,
+                                    metrics=metrics, models=self.models,
+                                    escalation_model=self.escalation_model,
+                                    escalation_budget=self.escalation_budget,
+                                    max_escalated_share=self.max_escalated_share,
+                                    latency_weight=self.latency_weight)
+
+    def _translate_strings(self):
+        translation_memory, metrics = self._open_run()
+        controller = self._create_controller(translation_memory, metrics)
+        try:
+            controller.process_store(self.store)
+        finally:
+            self._close_run(translation_memory, metrics)
+
+    def _run_pipeline(self):
+        translation_memory, metrics = self._open_run()
+        controller = self._create_controller(translation_memory, metrics)
+        pipeline = TranslationPipeline(self.json_handler, controller, self.store, workers=self.extraction_workers,
+                                       on_extracted=lambda: self.store.mark_step_completed('read_and_process_jsons'))
+        try:
+            failed_batches = pipeline.run()
+        finally:
+            self._close_run(translation_memory, metrics)
+        if failed_batches:
+            raise Exception(f"{failed_batches} batches failed to translate. Run the translation again to retry them.")
+        if self.store.count_pending_strings():
+            # Left to the process_csv and update_jsons_with_translations steps
+            return
+        # Only files still marked for an update are rewritten, which is usually none by now
+        self.json_handler.update_jsons_with_translations()
+        self.store.mark_step_completed('process_csv')
+        self.store.mark_step_completed('update_jsons_with_translations')
 
-        if not progress.get('duplicate_json_files'):
-            duplicate_json_files(self.directory, self.specific_file)
-            update_progress_log(self.directory, 'duplicate_json_files')
+    def _run_bulk(self, result_paths, file_path):
+        # Imports the results files, if any, then writes the requests for everything still to send
+        translation_memory, metrics = self._open_run()
+        # The request files are uploaded by the user, so no API key is needed here
+        controller = self._create_controller(translation_memory, metrics, api_key=self.api_key or '')
+        job = BulkJob(controller, self.store)
+        try:
+            if result_paths:
+                self._timed('bulk_import', lambda: job.import_results(result_paths))
+            file_path = self._timed('bulk_export', lambda: job.export(file_path))
+        finally:
+            self._close_run(translation_memory, metrics)
 
-        if not progress.get('read_and_process_jsons'):
-            self.json_handler.read_and_process_jsons()
-            update_progress_log(self.directory, 'read_and_process_jsons')
+        submitted = self.store.count_submitted_batches()
+        if submitted:
+            print(f"{submitted} batches are waiting for their results; import them to finish the translation.")
+            self.store.close()
+            return file_path
+        self.store.mark_step_completed('process_csv')
+        self._finish()
+        return None
 
-        if not progress.get('process_csv'):
-            # Assuming GPTRequestController has been properly implemented
-            controller = GPTRequestController(max_tokens=300, language='Japanese')
-            controller.process_csv('original.csv', 'translated.csv')
-            update_progress_log(self.directory, 'process_csv')
+    def _open_run(self):
+        # The translation memory and metrics recorder shared by the controller of one run
+        translation_memory = TranslationMemory() if self.use_translation_memory else None
+        metrics = MetricsRecorder(self.metrics_file, project=os.path.basename(os.path.abspath(self.directory)))
+        return translation_memory, metrics
 
-        if not progress.get('update_jsons_with_translations'):
-            self.json_handler.update_jsons_with_translations()
-            update_progress_log(self.directory, 'update_jsons_with_translations')
+    def _close_run(self, translation_memory, metrics):
+        metrics.close()
+        if self.prometheus_file:
+            metrics.write_prometheus(self.prometheus_file)
+        if translation_memory is not None:
+            print(f"Translation memory: {translation_memory.hits} hits, {translation_memory.misses} misses in total")
+            translation_memory.close()
 
 def main():
     directory = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
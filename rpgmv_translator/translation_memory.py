@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import time
+import unicodedata
+
+package_directory = os.path.dirname(os.path.abspath(__file__))
+MEMORY_FILE = os.path.join(package_directory, 'translation_memory.db')
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+
+class TranslationMemory:
+    """
+    On-disk cache of past translations shared by every project. Entries are keyed by
+    the normalized source text, target language, model and prompt version.
+    """
+
+    def __init__(self, db_path=MEMORY_FILE, max_entries=500000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(db_path)
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS memory (
+                    source TEXT NOT NULL,
+                    target_language TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (source, target_language, model, prompt_version)
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS memory_prompt_version ON memory (prompt_version)")
+
+    @staticmethod
+    def normalize(text):
+        return unicodedata.normalize('NFKC', text).strip()
+
+    @staticmethod
+    def _restore_padding(original, translation):
+        # Keys are stored stripped, so put the caller's surrounding whitespace back
+        stripped = original.strip()
+        if not stripped:
+            return translation
+        start = original.index(stripped)
+        return original[:start] + translation + original[start + len(stripped):]
+
+    def lookup_many(self, texts, target_language, model, prompt_version):
+        # Returns {original_text: translation} for every text found in memory. prompt_version may be
+        # a sequence of compatible versions; the first version that has an entry wins.
+        versions = [str(version) for version in
+                    (prompt_version if isinstance(prompt_version, (list, tuple)) else (prompt_version,))]
+        rank = {version: i for i, version in enumerate(versions)}
+        version_placeholders = ','.join('?' * len(versions))
+        normalized = {}
+        for text in texts:
+            normalized.setdefault(self.normalize(text), []).append(text)
+
+        found = {}
+        keys = list(normalized)
+        now = time.time()
+        for i in range(0, len(keys), _LOOKUP_CHUNK):
+            chunk = keys[i:i + _LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT source, translation, prompt_version FROM memory WHERE target_language = ? AND model = ? "
+                f"AND prompt_version IN ({version_placeholders}) AND source IN ({placeholders})",
+                [target_language, model] + versions + chunk).fetchall()
+            best = {}
+            for source, translation, version in rows:
+                if source not in best or rank[version] < rank[best[source][1]]:
+                    best[source] = (translation, version)
+            for source, (translation, _) in best.items():
+                for text in normalized[source]:
+                    found[text] = self._restore_padding(text, translation)
+
+            if best:
+                with self.connection:
+                    self.connection.executemany(
+                        "UPDATE memory SET last_used = ? WHERE target_language = ? AND model = ? "
+                        "AND prompt_version = ? AND source = ?",
+                        [(now, target_language, model, version, source) for source, (_, version) in best.items()])
+
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def store_many(self, pairs, target_language, model, prompt_version):
+        # pairs: iterable of (original_text, translated_text)
+        now = time.time()
+        rows = [(self.normalize(text), target_language, model, str(prompt_version), translation.strip(), now)
+                for text, translation in pairs if self.normalize(text)]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO memory (source, target_language, model, prompt_version, translation, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._evict()
+
+    def _evict(self):
+        # Drop the least recently used entries once the memory grows past max_entries
+        if not self.max_entries:
+            return
+        count = self.connection.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            with self.connection:
+                self.connection.execute(
+                    "DELETE FROM memory WHERE rowid IN (SELECT rowid FROM memory ORDER BY last_used LIMIT ?)",
+                    (excess,))
+
+    def invalidate(self, prompt_version=None):
+        # Remove every entry for a prompt version, or the whole memory if none is given
+        with self.connection:
+            if prompt_version is None:
+                cursor = self.connection.execute("DELETE FROM memory")
+            else:
+                cursor = self.connection.execute("DELETE FROM memory WHERE prompt_version = ?",
+                                                 (str(prompt_version),))
+        return cursor.rowcount
+
+    def close(self):
+        self.connection.close()
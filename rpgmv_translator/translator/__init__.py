@@ -0,0 +1,35 @@
+import importlib
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+# Model that the entries which keep failing are escalated to. DEFAULT_ESCALATION stands for it on the
+# official API and for no escalation on a self-hosted server, which rarely serves it.
+DEFAULT_ESCALATION_MODEL = "gpt-4"
+DEFAULT_ESCALATION = 'default'
+TARGET_LANGUAGE = "Chinese"
+# Bump whenever the prompt changes in a way that affects translations, so that
+# results cached in the translation memory under the old prompt are not reused.
+PROMPT_VERSION = 3
+# Versions whose translations are interchangeable with the current one, in order of preference.
+# 2 only changed the wire format (entries keyed by id instead of by the original text), and 3 only
+# added the placeholder instruction, which texts without placeholders don't depend on.
+COMPATIBLE_PROMPT_VERSIONS = (3, 2, 1)
+
+# Translator backends are imported on first use so that the openai client is only
+# loaded when something is actually sent to the API.
+TRANSLATORS = {
+    'gpt': ('rpgmv_translator.translator.gpt_translator', 'GPTTranslator'),
+    'router': ('rpgmv_translator.translator.router', 'BackendRouter'),
+}
+
+
+def resolve_escalation_model(escalation_model, base_url=None):
+    if escalation_model == DEFAULT_ESCALATION:
+        return None if base_url else DEFAULT_ESCALATION_MODEL
+    return escalation_model
+
+
+def get_translator(name, *args, **kwargs):
+    if name not in TRANSLATORS:
+        raise ValueError(f"Unsupported translator: {name}")
+    module_name, class_name = TRANSLATORS[name]
+    return getattr(importlib.import_module(module_name), class_name)(*args, **kwargs)
@@ -0,0 +1,51 @@
+import json
+from rpgmv_translator.translator import DEFAULT_MODEL
+
+# Kept apart from router so that backends files can be read without importing openai
+
+# Keys of a backend entry in a backends file, besides 'weight', 'requests_per_minute' and 'tokens_per_minute'
+BACKEND_OPTIONS = ('name', 'base_url', 'api_key', 'model', 'models', 'escalation_model', 'timeout',
+                   'max_concurrency')
+
+
+def load_backend_configs(file_path):
+    """
+    Reads a JSON list of backends, or an object with a "backends" list, e.g.
+    [{"name": "local", "base_url": "http://gpu-box:8000/v1", "model": "qwen2-7b-instruct",
+      "escalation_model": null, "max_concurrency": 8, "weight": 3},
+     {"models": ["gpt-3.5-turbo", "gpt-4o-mini"], "escalation_model": "gpt-4o"}]
+    "models" lists the candidates the scheduler picks from; "model" is a single candidate.
+    Without "escalation_model" a backend uses -escalationmodel, and a backend with a
+    base_url only escalates when that names a model.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        configs = json.load(file)
+    if isinstance(configs, dict):
+        configs = configs.get('backends')
+    if not isinstance(configs, list) or not configs:
+        raise ValueError(f"No backends found in {file_path}")
+    for config in configs:
+        if not isinstance(config, dict):
+            raise ValueError(f"Invalid backend in {file_path}: {config!r}")
+        unknown = set(config) - set(BACKEND_OPTIONS) - {'weight', 'requests_per_minute', 'tokens_per_minute'}
+        if unknown:
+            raise ValueError(f"Unknown backend options in {file_path}: {', '.join(sorted(unknown))}")
+        if config.get('weight', 1) <= 0:
+            raise ValueError(f"Backend weights must be positive: {config!r}")
+    return configs
+
+
+def backends_need_api_key(configs):
+    # Only backends on the official API fall back to the key from config.json
+    return any(not config.get('api_key') and not config.get('base_url') for config in configs)
+
+
+def backend_models(config):
+    return list(config.get('models') or [config.get('model', DEFAULT_MODEL)])
+
+
+def memory_model_key(configs):
+    # Translations are cached under the models that produced them
+    if not configs:
+        return DEFAULT_MODEL
+    return '+'.join(sorted({model for config in configs for model in backend_models(config)}))
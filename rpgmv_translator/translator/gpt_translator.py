@@ -1,131 +1,251 @@
-import json
-import re
 import os
 import openai
+import threading
 import time
+from rpgmv_translator.batch_planner import PER_ENTRY_OVERHEAD
+from rpgmv_translator.control_codes import placeholders_match
+from rpgmv_translator.metrics import request_cost
+from rpgmv_translator.translator import DEFAULT_MODEL, DEFAULT_ESCALATION, resolve_escalation_model
+from rpgmv_translator.translator.model_scheduler import ModelScheduler
+from rpgmv_translator.translator.prompts import (build_prompt, build_enhanced_prompt, parse_reply, accept_entries,
+                                                 ReplyStreamParser)
 from rpgmv_translator.translator.translator_base import AbstractTranslator
+from rpgmv_translator.rate_limiter import TokenBucketRateLimiter
+from rpgmv_translator.tokenizer import get_tokenizer
 from rpgmv_translator.utils import contains_japanese_strict
 
+# Rate limit errors a batch waits out before its remaining entries are given up
+MAX_RATE_LIMIT_RETRIES = 8
+
+
 class GPTTranslator(AbstractTranslator):
-    def __init__(self, api_key=None):
+    """
+    One OpenAI-compatible chat completions backend: the official API, or a self-hosted
+    server given by base_url. A single client is shared by every worker thread, so its
+    keep-alive connections are reused across batches; max_concurrency caps the requests
+    in flight and sizes the connection pool to match. Each batch is sent to one of models,
+    as chosen by the scheduler (see ModelScheduler).
+    """
+
+    def __init__(self, api_key=None, rate_limiter=None, base_url=None, streaming=False, model=DEFAULT_MODEL,
+                 escalation_model=DEFAULT_ESCALATION, timeout=120.0, max_concurrency=None, name=None, metrics=None,
+                 models=None, scheduler=None):
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
-        self.client = openai.OpenAI(api_key=self.api_key)
-        self.prompt = None
-
-    def translate(self, texts, model="gpt-3.5-turbo", split_attempt=False):
-        max_retries = 6 if not split_attempt else 2
+        self.name = name or base_url or 'openai'
+        self.model = model
+        # Candidates for the first request of a batch, in the order they are tried
+        self.models = list(models) if models else [model]
+        self.scheduler = scheduler or ModelScheduler()
+        # Model the entries that keep failing are sent to; None keeps them on the backend's model
+        self.escalation_model = resolve_escalation_model(escalation_model, base_url)
+        limits = openai.DEFAULT_CONNECTION_LIMITS
+        if max_concurrency:
+            limits = type(limits)(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        self.client = openai.OpenAI(api_key=self.api_key, base_url=base_url, timeout=timeout,
+                                    http_client=openai.DefaultHttpxClient(limits=limits))
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.rate_limiter = rate_limiter or TokenBucketRateLimiter()
+        # Streamed replies are parsed as they arrive, so entries are available before the reply ends
+        self.streaming = streaming
+        self.token_counter = get_tokenizer('approximate')
+        self.stats = {'requests': 0, 'follow_up_requests': 0, 'resubmitted_entries': 0, 'saved_tokens': 0}
+        self.stats_lock = threading.Lock()
+        # Optional MetricsRecorder that gets one record per request
+        self.metrics = metrics
+
+    def translate(self, texts, model=None):
+        translations, missing = self.translate_partial(texts, model)
+        if missing:
+            raise Exception(f"Failed to get valid translations for {len(missing)} of {len(texts)} texts after retries.")
+        return [translations[text] for text in texts]
+
+    def translate_partial(self, texts, model=None, on_entries=None, counted=False):
+        # Returns ({text: translation}, texts still missing). Good entries of a reply are kept and
+        # only the missing or rejected ones are sent again, in a smaller follow-up request.
+        # on_entries, when given, is called with {text: translation} as soon as entries are accepted.
+        # counted is set by callers that already counted the entries with the scheduler, e.g. the router.
+        remaining = list(dict.fromkeys(texts))
+        if not counted:
+            self.scheduler.count_entries(len(remaining))
+        if model is None and remaining:
+            entry_tokens = sum(self.token_counter.get_token_counts(remaining)) / len(remaining)
+            model = self.scheduler.choose(self.models, entry_tokens)
+        # Model the entries failed on if they get escalated, and the budget reserved for the escalation
+        base_model = model
+        reserved = 0.0
+        max_retries = 6
         attempts = 0
+        # Rate limit errors don't count as attempts, but a key that stays throttled is given up on
+        rate_limit_errors = 0
         retry_delay = 1
-        self.prompt = self._build_prompt(texts)
-
-        while attempts < max_retries:
+        build = self._build_prompt
+        translations = {}
+
+        while remaining and attempts < max_retries:
+            # Kept local: one translator is shared by all the controller's worker threads
+            prompt = build(remaining)
+            self.rate_limiter.acquire(self._estimate_request_tokens(prompt, remaining))
+            started = time.perf_counter()
             try:
-                response = self.client.chat.completions.create(
-                    messages=[{"role": "system", "content": self.prompt}],
-                    model=model,
-                )
-
-                response_text = response.choices[0].message.content
-                translated_dict = self._extract_dict_from_response(response_text)
-
-                if self._is_valid_response(texts, translated_dict):
-                    return [translated_dict.get(original_text, original_text) for original_text in texts]
-                else:
-                    print(f"Invalid response or format: {response_text}.")
-                    attempts += 1
-                    if attempts > 2 and model != "gpt-4":
-                        model = "gpt-4"
-                        print("Switching to GPT-4 model.")
-                    elif attempts > 4 and not split_attempt:
-                        midpoint = len(texts) // 2
-                        first_half = self.translate(texts[:midpoint], model, split_attempt=True)
-                        second_half = self.translate(texts[midpoint:], model, split_attempt=True)
-                        return first_half + second_half
-                    time.sleep(retry_delay)
+                reply, delivered, usage = self._request(prompt, model, remaining, on_entries)
             except openai.RateLimitError as e:
+                self._record_request(model, base_model, attempts, remaining, prompt, started, error=e)
+                rate_limit_errors += 1
+                if rate_limit_errors > MAX_RATE_LIMIT_RETRIES:
+                    print(f"Rate limit still exceeded after {MAX_RATE_LIMIT_RETRIES} retries, "
+                          f"giving up on {len(remaining)} entries: {e}")
+                    break
                 print(f"Rate limit exceeded, retrying in {retry_delay} seconds: {e}")
-                time.sleep(retry_delay)
+                # The shared limiter holds back every worker, so no one sleeps on their own
+                self.rate_limiter.penalize(retry_delay)
                 retry_delay *= 2
+                continue
             except (openai.APIConnectionError, openai.APITimeoutError, openai.AuthenticationError, openai.APIError) as e:
+                self._record_request(model, base_model, attempts, remaining, prompt, started, error=e)
+                self.scheduler.observe(model, attempts, len(remaining), 0, time.perf_counter() - started, 0, 0,
+                                       base_model if model != base_model else None, reserved)
                 print(f"API error: {e}")
                 break
 
-        raise Exception("Failed to get valid translation after retries.")
-
+            if attempts:
+                self._record_follow_up(build, texts, prompt, len(remaining))
+
+            accepted, too_much_japanese = self._accept_entries(remaining, reply)
+            prompt_tokens, completion_tokens = self._record_request(
+                model, base_model, attempts, remaining, prompt, started, usage, accepted=len(accepted),
+                rejected=len(remaining) - len(accepted), parse_failed=reply is None)
+            self.scheduler.observe(model, attempts, len(remaining), len(accepted), time.perf_counter() - started,
+                                   prompt_tokens, completion_tokens, base_model if model != base_model else None,
+                                   reserved)
+            reserved = 0.0
+            translations.update(accepted)
+            undelivered = {text: value for text, value in accepted.items() if text not in delivered}
+            if on_entries is not None and undelivered:
+                on_entries(undelivered)
+            remaining = [text for text in remaining if text not in accepted]
+            if not remaining:
+                break
 
+            print(f"Accepted {len(accepted)} entries of the reply, resubmitting {len(remaining)}.")
+            if too_much_japanese:
+                build = self._build_enhanced_prompt
+            attempts += 1
+            escalation_cost = self._estimate_cost(self.escalation_model, build, remaining) if self.escalation_model else 0.0
+            if self.scheduler.should_escalate(model, self.escalation_model, attempts, len(remaining), escalation_cost):
+                # Only the entries that keep failing are escalated
+                model = self.escalation_model
+                reserved = escalation_cost
+                print(f"Sending {len(remaining)} entries to the {model} model.")
+
+        return translations, remaining
+
+    def _request(self, prompt, model, texts, on_entries):
+        # Returns the parsed reply, the entries already handed to on_entries and the usage reported by the server
+        if self.slots is not None:
+            self.slots.acquire()
+        with self.stats_lock:
+            self.stats['requests'] += 1
+        try:
+            if self.streaming:
+                return self._stream_reply(prompt, model, texts, on_entries)
+            response = self.client.chat.completions.create(
+                messages=[{"role": "system", "content": prompt}],
+                model=model,
+            )
+            return self._extract_dict_from_response(response.choices[0].message.content), {}, response.usage
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    def _stream_reply(self, prompt, model, texts, on_entries):
+        # Returns the parsed reply, the entries already handed to on_entries and the usage. Entries without
+        # Japanese are delivered while the reply streams in; the others wait for the whole reply,
+        # which decides whether they are acceptable. A stream cut short keeps its finished entries.
+        stream = self.client.chat.completions.create(
+            messages=[{"role": "system", "content": prompt}],
+            model=model,
+            stream=True,
+            # The usage comes in a last chunk without choices
+            stream_options={"include_usage": True},
+        )
+        parser = ReplyStreamParser()
+        delivered = {}
+        usage = None
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if not content:
+                    continue
+                entries = {texts[i]: value for i, value in parser.feed(content).items()
+                           if i < len(texts) and value.strip() and not contains_japanese_strict(value)
+                           and placeholders_match(texts[i], value)}
+                if entries:
+                    delivered.update(entries)
+                    if on_entries is not None:
+                        on_entries(entries)
+        except Exception as e:
+            # Transport errors raised mid-stream depend on the HTTP client that openai was installed with
+            print(f"Stream interrupted after {len(parser.entries)} entries: {e}")
+        return parser.close(), delivered, usage
+
+    def _record_request(self, model, base_model, attempt, texts, prompt, started, usage=None, accepted=0,
+                        rejected=0, parse_failed=False, error=None):
+        # Returns the prompt and completion tokens of the request, estimated when the server reported no usage
+        estimated_prompt = self.token_counter.get_token_count(prompt)
+        estimated_completion = self._estimate_completion_tokens(texts)
+        if self.metrics is not None:
+            self.metrics.record_request(
+                self.name, model, attempt, len(texts), time.perf_counter() - started,
+                prompt_tokens=usage.prompt_tokens if usage is not None else None,
+                completion_tokens=usage.completion_tokens if usage is not None else None,
+                estimated_prompt_tokens=estimated_prompt, estimated_completion_tokens=estimated_completion,
+                accepted=accepted, rejected=rejected, parse_failed=parse_failed,
+                escalated_from=base_model if model != base_model else None,
+                streamed=self.streaming, error=str(error) if error is not None else None)
+        if usage is not None:
+            return usage.prompt_tokens, usage.completion_tokens
+        return estimated_prompt, estimated_completion
+
+    def _estimate_cost(self, model, build, texts):
+        prompt_tokens = self.token_counter.get_token_count(build(texts))
+        return request_cost(model, prompt_tokens, self._estimate_completion_tokens(texts))
+
+    def _record_follow_up(self, build, texts, prompt, entry_count):
+        # Tokens a full-batch retry would have sent compared with the follow-up that was sent
+        saved = self.token_counter.get_token_count(build(texts)) - self.token_counter.get_token_count(prompt)
+        with self.stats_lock:
+            self.stats['follow_up_requests'] += 1
+            self.stats['resubmitted_entries'] += entry_count
+            self.stats['saved_tokens'] += saved
+
+    def _estimate_completion_tokens(self, texts):
+        # Estimated the way the batch planner does, so that estimates can be calibrated against the usage
+        return sum(self.token_counter.get_token_counts(texts)) + PER_ENTRY_OVERHEAD * len(texts)
+
+    def _estimate_request_tokens(self, prompt, texts):
+        # Tokens the request takes from the tokens/min budget: its prompt and the reply expected for texts
+        return self.token_counter.get_token_count(prompt) + self._estimate_completion_tokens(texts)
 
     def _extract_dict_from_response(self, full_response):
-        # Find the index of the first open curly bracket
-        start_index = full_response.find('{')
-
-        # Find the index of the last close curly bracket
-        end_index = full_response.rfind('}')
-
-        if start_index != -1 and end_index != -1:
-            extracted_content = full_response[start_index:end_index + 1].strip()
-            try:
-                return json.loads(extracted_content)
-            except json.JSONDecodeError:
-                print("Failed to parse the extracted content as JSON.")
-                return None
-        else:
-            print("Failed to find dictionary-like content in the response.")
-            return None
+        # Returns {entry id: translation}; see prompts.parse_reply
+        entries = parse_reply(full_response)
+        if entries is None:
+            print("Failed to find an id-keyed JSON object in the response.")
+        return entries
 
     def _build_prompt(self, texts):
-        json_dict = json.dumps({str(i): text for i, text in enumerate(texts)}, ensure_ascii=False)
-        prompt = f"""Translate the following Japanese strings to Chinese. Return a single translated dictionary with the ORIGINAL JAPANESE TEXTS AS KEY and TRANSLATED CHINESE TEXTS AS VALUES. DO NOT USE INDICES AS KEYS. Don't translate English. Do not return anything other than a translated dictionary:\n{json_dict}
-
-        The following is an example response:
-        {{
-            'こんにちは': '你好',
-            'これはテストです': '这是一个测试',
-            '奴隷たち': '奴隶们',
-            'ククク、今回も教会で産ませてやろう。': '呵呵呵，这次也让她在教堂里生吧。',
-            '玉袋ン中の精液、': '在睾丸里的精液，',
-            'おいおい、挿れただけでか？': '喂喂，只是插入而已？'
-        }}"""
-        return prompt
+        return build_prompt(texts)
 
     def _build_enhanced_prompt(self, texts):
-        json_dict = json.dumps({str(i): text for i, text in enumerate(texts)}, ensure_ascii=False)
-        prompt = f"""TRANSLATE the following Japanese strings TO CHINESE. Return a single translated dictionary with the ORIGINAL JAPANESE TEXTS AS KEYS and TRANSLATED CHINESE TEXTS AS VALUES. DO NOT USE INDICES AS KEYS. Don't translate English. Do not return anything other than a translated dictionary. DO NOT LEAVE ANY JAPANESE UNTRANSLATED, and the values SHOULD NOT CONTAIN JAPANESE CHARACTERS:\n{json_dict}
-
-        The following is an example response:
-        {{
-            'こんにちは': '你好',
-            'これはテストです': '这是一个测试',
-            '奴隷たち': '奴隶们',
-            'ククク、今回も教会で産ませてやろう。': '呵呵呵，这次也让她在教堂里生吧。',
-            '玉袋ン中の精液、': '在睾丸里的精液，',
-            'おいおい、挿れただけでか？': '喂喂，只是插入而已？'
-        }}
-        """
-        return prompt
-
-    def _is_valid_response(self, original_texts, translated_texts):
-        if not isinstance(translated_texts, dict):
-            print("Invalid response: The response is not a dictionary.")
-            return False
-
-        if len(translated_texts) < len(original_texts) * 0.9:
-            print(f"Invalid response: Insufficient length. Expected at least {len(original_texts) * 0.9}, got {len(translated_texts)}.")
-            return False
-
-        if not all(key in original_texts for key in translated_texts.keys()):
-            print("Invalid response: Some keys in the translated text are not found in the original text.")
-            return False
-
-        japanese_count = sum(contains_japanese_strict(text) for text in translated_texts.values())
-        if japanese_count > len(translated_texts) * 0.2:
-            print(f"Invalid response: More than 20% of the translated texts contain Japanese.")
-            self.prompt = self._build_enhanced_prompt(original_texts)
-            return False
-
-        return True
+        return build_enhanced_prompt(texts)
+
+    def _accept_entries(self, texts, translated_texts):
+        # See prompts.accept_entries; bulk results are checked by the same rules
+        return accept_entries(texts, translated_texts)
 
 # Example usage:
 # translator = GPTTranslator("your_api_key_here")
 # japanese_texts = ["こんにちは", "これはテストです"]
-# chinese_texts = translator.translate_to_chinese(japanese_texts)
-# print(chinese_texts)
+# translated_texts = translator.translate(japanese_texts)
+# print(translated_texts)
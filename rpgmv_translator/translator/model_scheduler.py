@@ -0,0 +1,134 @@
+import threading
+from rpgmv_translator.metrics import model_price, request_cost
+
+# Requests a model gets before its observed figures are trusted over the list price
+MIN_SAMPLES = 3
+# Lowest success rate assumed when estimating how long retries on a model would take
+MIN_SUCCESS_RATE = 0.05
+
+
+class _ModelStats:
+    def __init__(self):
+        self.requests = 0
+        self.entries = 0
+        self.accepted = 0
+        self.latency = 0.0
+        self.cost = 0.0
+
+    def success_rate(self):
+        # One assumed success keeps a model that has barely been tried from scoring zero
+        return (self.accepted + 1) / (self.entries + 1)
+
+
+class ModelScheduler:
+    """
+    Picks the model of each request from what the models have done so far in the run, and
+    decides when entries that keep failing are sent to the escalation model. The first
+    request of a batch goes to the candidate with the lowest expected cost per accepted
+    entry, where each second of latency counts as latency_weight dollars (-latencyweight; the
+    default 0 ignores latency and picks the cheapest). Candidates are tried in the given order
+    until each has MIN_SAMPLES requests.
+
+    Only the entries still missing after escalate_after requests are escalated, and only
+    while escalation_budget (dollars) and max_escalated_share (of the entries seen) allow it.
+    Shared by every backend and worker thread of a run.
+    """
+
+    def __init__(self, escalate_after=3, escalation_budget=None, max_escalated_share=None, latency_weight=0.0):
+        self.escalate_after = escalate_after
+        self.escalation_budget = escalation_budget
+        self.max_escalated_share = max_escalated_share
+        self.latency_weight = latency_weight
+        self.models = {}
+        # Follow-up requests only: they carry the entries that failed before, like escalations do
+        self.retries = {}
+        self.lock = threading.Lock()
+        self.entries_seen = 0
+        self.escalated_entries = 0
+        self.escalation_requests = 0
+        self.escalation_cost = 0.0
+        # Dollars reserved by escalations that have not reported their cost yet
+        self.reserved = 0.0
+        self.denied_escalations = 0
+        self.time_saved = 0.0
+        self.cost_added = 0.0
+
+    def _stats(self, model, stats=None):
+        stats = self.models if stats is None else stats
+        if model not in stats:
+            stats[model] = _ModelStats()
+        return stats[model]
+
+    def _score(self, model, entry_tokens):
+        stats = self._stats(model)
+        if stats.entries:
+            cost = stats.cost / stats.entries
+            latency = stats.latency / stats.entries
+        else:
+            # List price of an entry and its reply
+            prompt_price, completion_price = model_price(model)
+            cost = entry_tokens * (prompt_price + completion_price) / 1000
+            latency = 0.0
+        return (cost + self.latency_weight * latency) / stats.success_rate()
+
+    def count_entries(self, entries):
+        # Entries of a new batch, which max_escalated_share is a share of; a batch sent on to another backend
+        # after a failover is not counted again
+        with self.lock:
+            self.entries_seen += entries
+
+    def choose(self, candidates, entry_tokens=50):
+        # Model for the first request of a batch whose entries have entry_tokens tokens on average
+        with self.lock:
+            for model in candidates:
+                if self._stats(model).requests < MIN_SAMPLES:
+                    return model
+            return min(candidates, key=lambda model: self._score(model, entry_tokens))
+
+    def should_escalate(self, model, escalation_model, attempts, entries, estimated_cost):
+        # Reserves estimated_cost of the budget when the entries may be escalated
+        if not escalation_model or model == escalation_model or attempts < self.escalate_after:
+            return False
+        with self.lock:
+            over_budget = (self.escalation_budget is not None
+                           and self.escalation_cost + self.reserved + estimated_cost > self.escalation_budget)
+            over_share = (self.max_escalated_share is not None
+                          and self.escalated_entries + entries > self.max_escalated_share * max(1, self.entries_seen))
+            if over_budget or over_share:
+                self.denied_escalations += 1
+                return False
+            self.reserved += estimated_cost
+            self.escalated_entries += entries
+            return True
+
+    def observe(self, model, attempt, entries, accepted, latency, prompt_tokens, completion_tokens,
+                escalated_from=None, reserved_cost=0.0):
+        cost = request_cost(model, prompt_tokens, completion_tokens)
+        with self.lock:
+            for stats in (self._stats(model),) + ((self._stats(model, self.retries),) if attempt else ()):
+                stats.requests += 1
+                stats.entries += entries
+                stats.accepted += accepted
+                stats.latency += latency
+                stats.cost += cost
+            if escalated_from is None:
+                return
+            self.escalation_requests += 1
+            self.escalation_cost += cost
+            self.reserved = max(0.0, self.reserved - reserved_cost)
+            # Compared with retrying the same entries on the model they failed on until they succeed
+            base = self.retries.get(escalated_from) or self._stats(escalated_from)
+            if base.requests:
+                attempts = 1 / max(base.success_rate(), MIN_SUCCESS_RATE)
+                self.time_saved += attempts * base.latency / base.requests - latency
+                self.cost_added += cost - attempts * base.cost / max(1, base.entries) * entries
+
+    def summary(self):
+        with self.lock:
+            models = {model: {'requests': stats.requests, 'success_rate': stats.accepted / stats.entries
+                              if stats.entries else 0.0, 'cost': stats.cost}
+                      for model, stats in self.models.items()}
+            return {'models': models, 'escalated_entries': self.escalated_entries,
+                    'escalation_requests': self.escalation_requests, 'escalation_cost': self.escalation_cost,
+                    'denied_escalations': self.denied_escalations, 'time_saved': self.time_saved,
+                    'cost_added': self.cost_added}
@@ -0,0 +1,164 @@
+import json
+import re
+from rpgmv_translator.control_codes import placeholders_match
+from rpgmv_translator.utils import contains_japanese_strict
+
+# Kept apart from gpt_translator so that batch planning can measure the prompt without importing openai
+
+# Entries are sent and answered under short numeric ids (PROMPT_VERSION 2). Version 1 asked for the
+# original texts as keys, which doubled the reply and failed whenever the model changed one character.
+# Version 3 asks to keep the {c0}/{n0} placeholders that stand for control codes and numbers.
+_EXAMPLE_REPLY = '{"0":"你好","1":"这是一个测试","2":"奴隶们","3":"呵呵呵，这次也让她在教堂里生吧。"}'
+
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def _entries(texts):
+    return json.dumps({str(i): text for i, text in enumerate(texts)}, ensure_ascii=False, separators=(',', ':'))
+
+
+def build_prompt(texts):
+    prompt = f"""Translate the values of the following JSON object from Japanese to Chinese. Reply with one JSON object that maps the SAME ID KEYS to the translated Chinese texts, one entry per id. Don't translate English. Keep placeholders such as {{c0}} or {{n0}} exactly as they are. Do not return anything other than the JSON object:
+{_entries(texts)}
+Example reply: {_EXAMPLE_REPLY}"""
+    return prompt
+
+
+def build_enhanced_prompt(texts):
+    prompt = f"""TRANSLATE the values of the following JSON object from Japanese TO CHINESE. Reply with one JSON object that maps the SAME ID KEYS to the translated Chinese texts, one entry per id. Don't translate English. Keep placeholders such as {{c0}} or {{n0}} exactly as they are. Do not return anything other than the JSON object. DO NOT LEAVE ANY JAPANESE UNTRANSLATED, and the values SHOULD NOT CONTAIN JAPANESE CHARACTERS:
+{_entries(texts)}
+Example reply: {_EXAMPLE_REPLY}"""
+    return prompt
+
+
+def parse_reply(content):
+    """
+    Returns {id: translation} from a model reply, or None when it holds no usable entry.
+    Prose around the JSON object is ignored; only string values under numeric ids are kept.
+    When no complete object parses, the complete pairs of a truncated one are salvaged.
+    """
+    decoder = json.JSONDecoder()
+    start = content.find('{')
+    first = start
+    while start != -1:
+        try:
+            reply, _ = decoder.raw_decode(content, start)
+        except json.JSONDecodeError:
+            reply = None
+        if isinstance(reply, dict):
+            entries = _id_entries(reply)
+            if entries:
+                return entries
+        start = content.find('{', start + 1)
+
+    if first == -1:
+        return None
+    return _id_entries(_salvage_pairs(content, first + 1)) or None
+
+
+def accept_entries(texts, entries):
+    """
+    Checks a parsed reply, {entry id: translation} where the ids are positions in texts.
+    Returns ({text: translation} for the acceptable entries, whether entries were rejected
+    for containing Japanese). Missing and empty values, and values whose placeholders differ
+    from the text's, are never accepted.
+    """
+    if not isinstance(entries, dict):
+        print("Invalid response: The response is not a dictionary.")
+        return {}, False
+
+    candidates = {}
+    for i, text in enumerate(texts):
+        value = entries.get(i)
+        # Translations that lost or invented a control code or number placeholder are retried
+        if isinstance(value, str) and value.strip() and placeholders_match(text, value):
+            candidates[text] = value
+
+    japanese = {text for text, value in candidates.items() if contains_japanese_strict(value)}
+    if candidates and len(japanese) > len(candidates) * 0.2:
+        # A few untranslated names are fine, but not when much of the reply is left in Japanese
+        print("Invalid response: More than 20% of the translated texts contain Japanese.")
+        return {text: value for text, value in candidates.items() if text not in japanese}, True
+    return candidates, False
+
+
+def _id_entries(reply):
+    return {int(key.strip()): value for key, value in reply.items()
+            if isinstance(key, str) and key.strip().isdigit() and isinstance(value, str)}
+
+
+def _salvage_pairs(content, position):
+    # Reads "key": value pairs one by one until the JSON stops parsing
+    decoder = json.JSONDecoder()
+    entries = {}
+    while True:
+        position = _SEPARATORS.match(content, position).end()
+        try:
+            key, position = decoder.raw_decode(content, position)
+            position = _SEPARATORS.match(content, position).end()
+            if not isinstance(key, str) or content[position:position + 1] != ':':
+                return entries
+            position = _SEPARATORS.match(content, position + 1).end()
+            value, position = decoder.raw_decode(content, position)
+        except json.JSONDecodeError:
+            return entries
+        entries[key] = value
+
+
+class ReplyStreamParser:
+    """
+    Incremental parse_reply for streamed completions: feed() returns the entries whose
+    value has been received completely since the last call.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.content = ''
+        self.position = None
+        self.entries = {}
+        # Set once the object ends or stops parsing as flat "id": "text" pairs
+        self.done = False
+
+    def feed(self, text):
+        self.content += text
+        if self.done:
+            return {}
+        if self.position is None:
+            start = self.content.find('{')
+            if start == -1:
+                return {}
+            self.position = start + 1
+
+        new_entries = {}
+        content = self.content
+        while True:
+            position = _SEPARATORS.match(content, self.position).end()
+            if content.startswith('}', position):
+                self.done = True
+                break
+            try:
+                key, position = self.decoder.raw_decode(content, position)
+                position = _SEPARATORS.match(content, position).end()
+                if position == len(content):
+                    break
+                if not isinstance(key, str) or content[position] != ':':
+                    self.done = True
+                    break
+                position = _SEPARATORS.match(content, position + 1).end()
+                value, position = self.decoder.raw_decode(content, position)
+            except json.JSONDecodeError:
+                # Most likely an entry that has not been received completely yet
+                break
+            if position == len(content) and not isinstance(value, str):
+                # A number or literal may still continue in the next chunk
+                break
+            self.position = position
+            entry = _id_entries({key: value})
+            new_entries.update(entry)
+        self.entries.update(new_entries)
+        return new_entries
+
+    def close(self):
+        # The whole reply, parsed again so that anything the incremental pass could not follow is kept
+        entries = parse_reply(self.content) or {}
+        return {**entries, **self.entries} if entries or self.entries else None
@@ -0,0 +1,97 @@
+import os
+import threading
+from rpgmv_translator.translator import DEFAULT_ESCALATION
+from rpgmv_translator.translator.backends import BACKEND_OPTIONS, backend_models
+from rpgmv_translator.translator.gpt_translator import GPTTranslator
+from rpgmv_translator.translator.model_scheduler import ModelScheduler
+from rpgmv_translator.translator.translator_base import AbstractTranslator
+from rpgmv_translator.rate_limiter import TokenBucketRateLimiter
+
+
+class BackendRouter(AbstractTranslator):
+    """
+    Spreads batches over several OpenAI-compatible backends in proportion to their weights.
+    Each batch goes to the backend with the fewest batches in flight for its weight; entries a
+    backend could not translate are sent once to the next backend before they are given up.
+    """
+
+    def __init__(self, configs, api_key=None, rate_limiter=None, streaming=False, metrics=None, scheduler=None,
+                 escalation_model=DEFAULT_ESCALATION):
+        # One scheduler for all backends, so that the escalation budget is shared
+        self.scheduler = scheduler or ModelScheduler()
+        self.backends = []
+        self.weights = []
+        for config in configs:
+            options = {key: config[key] for key in BACKEND_OPTIONS if key in config}
+            options['models'] = backend_models(config)
+            options['model'] = options['models'][0]
+            # A backend's own escalation_model, null included, wins over the one given for all of them
+            options.setdefault('escalation_model', escalation_model)
+            if not options.get('api_key'):
+                # Self-hosted servers usually ignore the key, but the client requires one
+                options['api_key'] = api_key or os.getenv('OPENAI_API_KEY') or ('unused' if config.get('base_url') else None)
+            if 'requests_per_minute' in config or 'tokens_per_minute' in config:
+                backend_limiter = TokenBucketRateLimiter(config.get('requests_per_minute'), config.get('tokens_per_minute'))
+            else:
+                backend_limiter = rate_limiter
+            self.backends.append(GPTTranslator(rate_limiter=backend_limiter, streaming=streaming,
+                                               metrics=metrics, scheduler=self.scheduler, **options))
+            self.weights.append(float(config.get('weight', 1)))
+        self.in_flight = [0] * len(self.backends)
+        self.assigned = [0] * len(self.backends)
+        self.failovers = 0
+        self.lock = threading.Lock()
+
+    @property
+    def stats(self):
+        # Totals over every backend, in the same form as GPTTranslator.stats
+        totals = {'failovers': self.failovers}
+        for backend in self.backends:
+            with backend.stats_lock:
+                for key, value in backend.stats.items():
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def translate(self, texts, model=None):
+        translations, missing = self.translate_partial(texts, model)
+        if missing:
+            raise Exception(f"Failed to get valid translations for {len(missing)} of {len(texts)} texts after retries.")
+        return [translations[text] for text in texts]
+
+    def translate_partial(self, texts, model=None, on_entries=None):
+        # Same contract as GPTTranslator.translate_partial; model overrides the backends' own models
+        translations = {}
+        remaining = list(dict.fromkeys(texts))
+        # Counted once, however many backends the batch is sent to
+        self.scheduler.count_entries(len(remaining))
+        tried = []
+        while remaining and len(tried) < min(2, len(self.backends)):
+            index = self._acquire(tried)
+            tried.append(index)
+            if len(tried) > 1:
+                print(f"Sending {len(remaining)} entries to backend {self.backends[index].name}.")
+                with self.lock:
+                    self.failovers += 1
+            try:
+                accepted, remaining = self.backends[index].translate_partial(remaining, model, on_entries, counted=True)
+            finally:
+                with self.lock:
+                    self.in_flight[index] -= 1
+            translations.update(accepted)
+        return translations, remaining
+
+    def _acquire(self, exclude):
+        # Least loaded backend for its weight; assignments so far break ties, which keeps
+        # sequential runs, where nothing else is in flight, in weighted round robin order
+        with self.lock:
+            index = min((i for i in range(len(self.backends)) if i not in exclude),
+                        key=lambda i: (self.in_flight[i] / self.weights[i],
+                                       (self.assigned[i] + 1) / self.weights[i], i))
+            self.in_flight[index] += 1
+            self.assigned[index] += 1
+        return index
+
+    def backend_stats(self):
+        # (name, model, batches assigned, stats) of every backend
+        return [(backend.name, backend.model, assigned, dict(backend.stats))
+                for backend, assigned in zip(self.backends, self.assigned)]
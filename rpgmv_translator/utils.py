@@ -1,25 +1,11 @@
 import os
 import shutil
 import re
+from rpgmv_translator.snapshot_store import SnapshotStore
 # import nltk
 # from nltk.tokenize import word_tokenize
 
 
-def read_progress_log(directory):
-    progress_log_path = os.path.join(directory, 'progress.log')
-    progress = {}
-    if os.path.exists(progress_log_path):
-        with open(progress_log_path, 'r') as file:
-            for line in file:
-                key, value = line.strip().split(':')
-                progress[key] = value == 'completed'
-    return progress
-
-def update_progress_log(directory, step):
-    progress_log_path = os.path.join(directory, 'progress.log')
-    with open(progress_log_path, 'a') as file:
-        file.write(f"{step}:completed\n")
-
 def is_rpgmv_folder(directory):
     required_folders = ['audio', 'data', 'img']
     www_path = os.path.join(directory, 'www')
@@ -31,54 +17,42 @@ def is_rpgmv_folder(directory):
     return False
 
 
-def duplicate_json_files(directory, specific_file=None):
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for filename in filenames:
-            if filename.endswith('.json') and (specific_file is None or filename == specific_file):
-                original_path = os.path.join(dirpath, filename)
-                backup_path = os.path.join(dirpath, f"{filename}.old")
-                if not os.path.exists(backup_path):
-                    shutil.copy2(original_path, backup_path)
-
-
-def restore_from_backup(directory):
+def restore_from_backup(directory, snapshot_id=None):
+    # Restores the given snapshot, by default the latest snapshot of the original files.
+    # Projects translated by older versions are restored from their .old copies.
     if not is_rpgmv_folder(directory):
         raise ValueError("The specified directory is not a valid RPGMV folder.")
 
-    # List of new files that should be removed if they exist
-    new_files = ['original.csv', 'translated.csv', 'progress.log']
-
-    # Remove new files if they exist
-    for new_file in new_files:
-        new_file_path = os.path.join(directory, new_file)
-        if os.path.exists(new_file_path):
-            os.remove(new_file_path)
-
-    restored_any = False
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for filename in filenames:
-            if filename.endswith('.json.old'):
-                backup_path = os.path.join(dirpath, filename)
-                original_path = os.path.join(dirpath, filename.replace('.old', ''))
-                shutil.copy2(backup_path, original_path)
-                os.remove(backup_path)
-                restored_any = True
-
-    if not restored_any:
+    snapshots = SnapshotStore(directory)
+    if snapshot_id is None:
+        snapshot_id = snapshots.latest('original')
+    if snapshot_id is not None:
+        # Raises for an unknown id before anything is touched
+        label = snapshots.load(snapshot_id)['label']
+        restored = snapshots.restore(snapshot_id)
+        if label != 'translated':
+            # The translated files are what the project state describes, so it is only dropped with the originals back
+            _remove_project_state(directory)
+        return restored
+
+    backups = [os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(directory)
+               for filename in filenames if filename.endswith('.json.old')]
+    if not backups:
         raise FileNotFoundError("No .old backup files found to restore.")
+    for backup_path in backups:
+        shutil.copy2(backup_path, backup_path[:-len('.old')])
+        os.remove(backup_path)
+    _remove_project_state(directory)
+    return len(backups)
 
 
-def contains_japanese(text):
-    # Regular expression that matches Japanese Hiragana and Katakana
-    # Hiragana: U+3040 to U+309F, Katakana: U+30A0 to U+30FF
-
-    japanese_regex = r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF]'
-
-    # Check for the presence of Hiragana, Katakana, or Kanji characters
-    if re.search(japanese_regex, text):
-        return True
+def _remove_project_state(directory):
+    # The project database and the files written by versions that kept their state in CSV files
+    for name in ['project.db', 'project.db-wal', 'project.db-shm', 'original.csv', 'translated.csv', 'progress.log']:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
 
-    return False
 
 def contains_japanese_strict(text):
     # Regular expression that matches Japanese Hiragana and Katakana characters
@@ -90,16 +64,3 @@ def contains_japanese_strict(text):
         return True
 
     return False
-def is_valid_field_to_translate(text):
-    # Detect Japanese using contains_japanese function
-    if contains_japanese(text):
-        # Check for the presence of equal sign, slash, or other non-Japanese characters
-        if re.search(r'[$=/<>{}_]', text):
-            return False
-        # Check for backslashes that are not followed by 'n'
-        if re.search(r'\\(?!n)', text):
-            return False
-        else:
-            return True
-    else:
-        return False
\ No newline at end of file
@@ -0,0 +1,18 @@
+import pytest
+from rpgmv_translator.benchmark.fake_openai_server import FakeOpenAIServer
+from rpgmv_translator.benchmark.project_generator import generate_project
+
+
+@pytest.fixture
+def server():
+    with FakeOpenAIServer() as server:
+        yield server
+
+
+@pytest.fixture
+def project(tmp_path):
+    # A small generated game; its data files are in www/data
+    directory = str(tmp_path / 'game')
+    generate_project(directory, maps=3, events_per_map=3, lines_per_event=4, common_events=5, database_entries=10)
+    return directory
+
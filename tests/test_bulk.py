@@ -0,0 +1,102 @@
+import json
+import os
+import re
+from rpgmv_translator.benchmark.fake_openai_server import FakeOpenAIServer
+from rpgmv_translator.bulk import CUSTOM_ID_PREFIX
+from rpgmv_translator.project_store import ProjectStore
+from rpgmv_translator.translate import RPGMVTranslator
+
+_KANA_REGEX = re.compile(r'[぀-ゟ゠-ヿ]')
+
+
+def _translator(project):
+    # A small context budget spreads the strings over several batches
+    return RPGMVTranslator(project, use_translation_memory=False, metrics_file=None, context_budget=1024)
+
+
+def _kana_left(project):
+    data_directory = os.path.join(project, 'www', 'data')
+    count = 0
+    for name in os.listdir(data_directory):
+        if name.endswith('.json'):
+            with open(os.path.join(data_directory, name), 'r', encoding='utf-8') as file:
+                count += len(_KANA_REGEX.findall(file.read()))
+    return count
+
+
+def _read_lines(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def _write_lines(file_path, lines):
+    with open(file_path, 'w', encoding='utf-8') as file:
+        for line in lines:
+            file.write(line if isinstance(line, str) else json.dumps(line, ensure_ascii=False))
+            file.write('\n')
+
+
+def _answer_until_done(translator, server, request_file, result_file):
+    rounds = 0
+    while request_file:
+        rounds += 1
+        server.answer_bulk_file(request_file, result_file)
+        request_file = translator.import_bulk([result_file])
+    return rounds
+
+
+def test_bulk_round_trip(project, tmp_path):
+    assert _kana_left(project)
+    translator = _translator(project)
+    request_file = translator.export_bulk()
+    requests = _read_lines(request_file)
+    assert requests and all(request['custom_id'].startswith(CUSTOM_ID_PREFIX) for request in requests)
+
+    assert _answer_until_done(translator, FakeOpenAIServer(), request_file, str(tmp_path / 'results.jsonl')) == 1
+    assert _kana_left(project) == 0
+    store = ProjectStore(project)
+    assert store.count_pending_strings() == 0
+    assert store.count_submitted_batches() == 0
+    store.close()
+
+
+def test_malformed_results_are_sent_again(project, tmp_path):
+    server = FakeOpenAIServer()
+    translator = _translator(project)
+    request_file = translator.export_bulk()
+    result_file = str(tmp_path / 'results.jsonl')
+    server.answer_bulk_file(request_file, result_file)
+
+    lines = _read_lines(result_file)
+    assert len(lines) >= 5
+    # An expired request, a server error, a reply without entries and one cut off in the middle
+    lines[0] = {'id': 'expired', 'custom_id': lines[0]['custom_id'], 'response': None,
+                'error': {'code': 'batch_expired', 'message': 'The completion window expired.'}}
+    lines[1]['response'] = {'status_code': 500, 'body': {'error': {'message': 'Server error'}}}
+    lines[2]['response']['body']['choices'][0]['message']['content'] = "Sorry, I can't help with that."
+    content = lines[3]['response']['body']['choices'][0]['message']['content']
+    lines[3]['response']['body']['choices'][0]['message']['content'] = content[:len(content) // 2]
+    _write_lines(result_file, lines + ['not json', {'custom_id': 'batch-unknown'}])
+
+    store = ProjectStore(project)
+    failed = [{text for _, text in store.get_submitted_entries(int(line['custom_id'][len(CUSTOM_ID_PREFIX):]))}
+              for line in lines[:4]]
+    store.close()
+
+    follow_up = translator.import_bulk([result_file])
+    assert follow_up is not None and follow_up != request_file
+    store = ProjectStore(project)
+    pending = {row[1] for row in store.get_pending_strings()}
+    store.close()
+    assert failed[0] | failed[1] | failed[2] <= pending <= failed[0] | failed[1] | failed[2] | failed[3]
+    assert pending & failed[3] != failed[3]
+    assert _kana_left(project)
+
+    # Lines of batches that were imported before are skipped
+    assert translator.import_bulk([result_file]) is None
+    store = ProjectStore(project)
+    assert {row[1] for row in store.get_pending_strings()} == pending
+    store.close()
+
+    assert _answer_until_done(translator, server, follow_up, str(tmp_path / 'follow_up_results.jsonl')) == 1
+    assert _kana_left(project) == 0
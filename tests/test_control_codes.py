@@ -0,0 +1,44 @@
+import pytest
+from rpgmv_translator.control_codes import normalize, placeholders_match, restore
+
+
+@pytest.mark.parametrize('text', [
+    '\\C[2]勇者\\C[0]は宝箱を開けた！',
+    '\\N[1]は100ゴールドと\\I[64]ポーションを3個手に入れた。',
+    '\\FS[24]大きな声\\{だ\\}\\!',
+    '\\n<リード>こんにちは\\.\\.\\|',
+    '１２３番目の\\V[5]',
+])
+def test_normalize_and_restore_give_the_text_back(text):
+    template, args = normalize(text)
+    assert args is not None
+    assert '\\' not in template
+    assert restore(template, args) == text
+
+
+def test_lines_that_only_differ_in_codes_and_numbers_share_a_template():
+    first, first_args = normalize('\\C[2]勇者\\C[0]は100ゴールドを手に入れた。')
+    second, second_args = normalize('\\C[3]勇者\\C[0]は25ゴールドを手に入れた。')
+    assert first == second == '{c0}勇者{c1}は{n0}ゴールドを手に入れた。'
+    assert first_args == {'c': ['\\C[2]', '\\C[0]'], 'n': ['100']}
+    assert restore('{c0}勇者{c1}获得了{n0}金币。', second_args) == '\\C[3]勇者\\C[0]获得了25金币。'
+
+
+def test_plain_text_is_left_alone():
+    assert normalize('こんにちは') == ('こんにちは', None)
+
+
+def test_translations_may_move_placeholders():
+    _, args = normalize('\\C[2]勇者\\C[0]は100ゴールド')
+    assert restore('{n0}金币给了{c0}勇者{c1}', args) == '100金币给了\\C[2]勇者\\C[0]'
+
+
+@pytest.mark.parametrize('translation', [
+    '{c0}勇者获得了金币',
+    '{c0}勇者{c1}获得了{n0}{n0}金币',
+    '{c0}勇者{c1}获得了{n1}金币',
+])
+def test_mangled_placeholders_are_never_restored(translation):
+    template, args = normalize('\\C[2]勇者\\C[0]は100ゴールド')
+    assert restore(translation, args) is None
+    assert not placeholders_match(template, translation)
@@ -0,0 +1,24 @@
+from rpgmv_translator.rate_limiter import TokenBucketRateLimiter
+from rpgmv_translator.translator import get_translator
+
+
+class _RecordingLimiter(TokenBucketRateLimiter):
+    def __init__(self):
+        super().__init__()
+        self.acquired = []
+
+    def acquire(self, tokens=0):
+        self.acquired.append(tokens)
+        return super().acquire(tokens)
+
+
+def test_requests_take_their_estimated_tokens_from_the_limiter(server):
+    limiter = _RecordingLimiter()
+    translator = get_translator('gpt', 'test', base_url=server.base_url, rate_limiter=limiter)
+    texts = [f'これは{i}番目のテストです。' for i in range(20)]
+    translator.translate(texts)
+
+    # The stub counts tokens like the translator's own counter, so the estimate lands close to the usage
+    used = server.stats['prompt_tokens'] + server.stats['completion_tokens']
+    assert len(limiter.acquired) == 1
+    assert used * 0.8 <= limiter.acquired[0] <= used * 1.2
@@ -0,0 +1,30 @@
+import json
+import os
+from rpgmv_translator.json_handler import JSONHandler
+
+
+def _extract(handler, file_path):
+    pool = handler._process_file(file_path)
+    return list(pool.entries()), list(pool.locations())
+
+
+def test_streaming_and_in_memory_extraction_agree(project):
+    in_memory = JSONHandler(project)
+    streaming = JSONHandler(project, streaming_threshold=0)
+    for file_path in in_memory._list_json_files():
+        assert _extract(in_memory, file_path) == _extract(streaming, file_path), file_path
+
+
+def test_strings_are_extracted_in_document_order(project):
+    # The schema lists the terms after the type lists; the file has them first
+    file_path = os.path.join(project, 'www', 'data', 'System.json')
+    system = {'terms': {'basic': ['レベル'], 'messages': {'victory': '%1の勝利！'}}, 'elements': ['', '炎'],
+              'gameTitle': 'テストゲーム', 'currencyUnit': 'ゴールド'}
+    with open(file_path, 'w', encoding='utf-8') as file:
+        json.dump(system, file, ensure_ascii=False)
+
+    expected = ['レベル', '%1の勝利！', '炎', 'テストゲーム', 'ゴールド']
+    for handler in (JSONHandler(project, normalize_templates=False), JSONHandler(project, streaming_threshold=0,
+                                                                              normalize_templates=False)):
+        entries, _ = _extract(handler, file_path)
+        assert [text for _, text, _ in entries] == expected
@@ -0,0 +1,77 @@
+import io
+import json
+from rpgmv_translator.json_stream import JSONStringScanner, patch_spans, string_value_spans
+
+# Escaped quotes, backslashes of control codes, \u escapes and a key that looks like a value
+DOCUMENT = ('{"name": "\\u52c7\\u8005", "list": [{"code": 401, "parameters": ["\\\\C[2]\\"\\u3042\\"\\\\C[0]"]},\n'
+            '  {"code": 102, "parameters": [["はい", "いいえ\\\\"], 0]}],\n'
+            '  "note": "<tag>\\n\\t", "\\"text\\"": "キー"}').encode('utf-8')
+VALUES = ['勇者', '\\C[2]"あ"\\C[0]', 'はい', 'いいえ\\', '<tag>\n\t', 'キー']
+
+
+def _patch(content, spans, replace):
+    output = io.BytesIO()
+    changed = patch_spans(io.BytesIO(content), output, [(start, end, replace) for start, end in spans], chunk_size=7)
+    return output.getvalue(), changed
+
+
+def _translate(token):
+    value = json.loads(token)
+    return json.dumps(f'[{value}]', ensure_ascii=False).encode('utf-8') if value != '<tag>\n\t' else token
+
+
+def test_streaming_scanner_finds_every_string_value():
+    # Chunks of a few bytes split tokens and escapes between reads
+    scanner = JSONStringScanner(io.BytesIO(DOCUMENT), chunk_size=5, scalar_keys=('code',))
+    found = [(path, value, DOCUMENT[start:end]) for path, value, start, end in scanner]
+    assert [value for _, value, _ in found] == VALUES
+    assert [json.loads(token) for _, _, token in found] == VALUES
+    assert [path for path, _, _ in found] == [('name',), ('list', 0, 'parameters', 0), ('list', 1, 'parameters', 0, 0),
+                                              ('list', 1, 'parameters', 0, 1), ('note',), ('"text"',)]
+
+
+def test_streaming_scanner_keeps_the_scalars_of_open_objects():
+    scanner = JSONStringScanner(io.BytesIO(DOCUMENT), chunk_size=5, scalar_keys=('code',))
+    codes = [scanner.scalar(2, 'code') for path, _, _, _ in scanner if path[0] == 'list']
+    assert codes == [401, 102, 102]
+
+
+def test_streaming_scanner_replaces_values_in_the_output():
+    output = io.BytesIO()
+    scanner = JSONStringScanner(io.BytesIO(DOCUMENT), output, chunk_size=5)
+    for path, value, _, _ in scanner:
+        if path[0] == 'name':
+            scanner.replace('英雄')
+    scanner.finish()
+    data = json.loads(output.getvalue())
+    assert data['name'] == '英雄'
+    assert data['list'][0]['parameters'] == ['\\C[2]"あ"\\C[0]']
+
+
+def test_string_value_spans_find_values_only():
+    assert [json.loads(DOCUMENT[start:end]) for start, end in string_value_spans(DOCUMENT)] == VALUES
+
+
+def test_streaming_scanner_finds_the_same_spans():
+    scanner = JSONStringScanner(io.BytesIO(DOCUMENT), chunk_size=5)
+    assert [(start, end) for _, _, start, end in scanner] == string_value_spans(DOCUMENT)
+
+
+def test_patch_spans_rewrites_escaped_strings():
+    patched, changed = _patch(DOCUMENT, string_value_spans(DOCUMENT), _translate)
+    assert changed == len(VALUES) - 1
+
+    data = json.loads(patched)
+    assert data['name'] == '[勇者]'
+    assert data['list'][0]['parameters'] == ['[\\C[2]"あ"\\C[0]]']
+    assert data['list'][1]['parameters'] == [['[はい]', '[いいえ\\]'], 0]
+    assert data['note'] == '<tag>\n\t'
+    assert data['"text"'] == '[キー]'
+    # Everything outside the spans is copied byte for byte
+    assert patched.startswith(b'{"name": "[')
+    assert b'"note": "<tag>\\n\\t", "\\"text\\"": ' in patched
+
+
+def test_patch_spans_without_changes_copies_the_file():
+    patched, changed = _patch(DOCUMENT, string_value_spans(DOCUMENT), lambda token: token)
+    assert (patched, changed) == (DOCUMENT, 0)
@@ -0,0 +1,22 @@
+from rpgmv_translator.translator import get_translator
+from rpgmv_translator.translator.model_scheduler import ModelScheduler
+
+
+def test_choose_gets_the_batch_token_estimate(server):
+    translator = get_translator('gpt', 'test', base_url=server.base_url, models=['gpt-3.5-turbo', 'gpt-4o-mini'])
+    choices = []
+    choose = translator.scheduler.choose
+    translator.scheduler.choose = lambda candidates, entry_tokens=50: choices.append(entry_tokens) or \
+        choose(candidates, entry_tokens)
+
+    texts = ['こんにちは', 'あ' * 95]
+    translator.translate(texts)
+    assert choices == [sum(translator.token_counter.get_token_counts(texts)) / 2]
+    assert translator.scheduler.entries_seen == 2
+
+
+def test_the_escalated_share_is_a_share_of_distinct_batches():
+    scheduler = ModelScheduler(max_escalated_share=0.5)
+    scheduler.count_entries(4)
+    assert scheduler.should_escalate('gpt-3.5-turbo', 'gpt-4', 3, 2, 0.0)
+    assert not scheduler.should_escalate('gpt-3.5-turbo', 'gpt-4', 3, 1, 0.0)
@@ -0,0 +1,76 @@
+import csv
+import os
+import sqlite3
+import pytest
+from rpgmv_translator.project_store import PROJECT_DB, ProjectStore
+from rpgmv_translator.string_pool import string_id
+
+# The tables keyed by uuid strings, as created by versions before integer string IDs
+LEGACY_SCHEMA = """
+    CREATE TABLE strings (id INTEGER PRIMARY KEY AUTOINCREMENT, uuid TEXT NOT NULL UNIQUE,
+                          text TEXT NOT NULL UNIQUE, token_count INTEGER, group_key TEXT);
+    CREATE TABLE translations (uuid TEXT PRIMARY KEY REFERENCES strings (uuid), translated_text TEXT NOT NULL,
+                               batch_id INTEGER REFERENCES batches (id));
+    CREATE TABLE locations (path TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL, uuid TEXT, args TEXT);
+"""
+
+
+def test_legacy_database_is_migrated_to_string_ids(tmp_path):
+    connection = sqlite3.connect(os.path.join(tmp_path, PROJECT_DB))
+    connection.executescript(LEGACY_SCHEMA)
+    connection.executemany("INSERT INTO strings (uuid, text, token_count, group_key) VALUES (?, ?, ?, ?)",
+                           [('uuid-a', 'こんにちは', 5, 'Map001.json'), ('uuid-b', 'さようなら', 5, None)])
+    connection.execute("INSERT INTO translations (uuid, translated_text) VALUES ('uuid-a', '你好')")
+    connection.executemany("INSERT INTO locations (path, start, end, uuid) VALUES (?, ?, ?, ?)",
+                           [('data/Map001.json', 10, 27, 'uuid-a'), ('data/Map001.json', 40, 57, 'uuid-b'),
+                            ('data/Map001.json', 60, 80, None)])
+    connection.commit()
+    connection.close()
+
+    store = ProjectStore(str(tmp_path))
+    hello, goodbye = string_id('こんにちは'), string_id('さようなら')
+    assert store.get_translation(hello) == '你好'
+    assert [row[:4] for row in store.get_pending_strings()] == [(goodbye, 'さようなら', 5, None)]
+    assert [row[:3] for row in store.get_located_translations('data/Map001.json')] == \
+        [(10, 27, hello), (40, 57, goodbye), (60, 80, None)]
+    assert dict(store.connection.execute("SELECT legacy_uuid, uuid FROM strings")) == \
+        {'uuid-a': hello, 'uuid-b': goodbye}
+    store.close()
+
+    # Opening it again leaves the migrated database as it is
+    store = ProjectStore(str(tmp_path))
+    assert store.count_strings() == 2
+    assert store.get_translation(hello) == '你好'
+    store.close()
+
+
+def test_legacy_csv_files_are_imported(tmp_path):
+    with open(os.path.join(tmp_path, 'original.csv'), 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerows([('uuid', 'text'), ('uuid-a', 'こんにちは'), ('uuid-b', 'さようなら')])
+    with open(os.path.join(tmp_path, 'translated.csv'), 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerows([('uuid', 'translated_text'), ('uuid-a', '你好'), ('uuid-unknown', '什么')])
+    with open(os.path.join(tmp_path, 'progress.log'), 'w') as file:
+        file.write('read_and_process_jsons:completed\nprocess_csv:started\n')
+
+    store = ProjectStore(str(tmp_path))
+    assert store.count_strings() == 2
+    assert store.get_translation(string_id('こんにちは')) == '你好'
+    assert [row[1] for row in store.get_pending_strings()] == ['さようなら']
+    assert store.is_step_completed('read_and_process_jsons')
+    assert not store.is_step_completed('process_csv')
+    store.close()
+
+
+def test_add_strings_refuses_a_taken_id(tmp_path):
+    store = ProjectStore(str(tmp_path))
+    store.add_strings([(1, 'こんにちは', 'a'), (2, 'さようなら', 'a')])
+    store.add_strings([(1, 'こんにちは', 'b'), (3, 'ありがとう', 'a')])
+    assert store.count_strings() == 3
+
+    with pytest.raises(ValueError):
+        store.add_strings([(4, 'はい', 'a'), (2, 'いいえ', 'a')])
+    # Nothing of the refused rows is stored
+    assert store.count_strings() == 3
+    store.close()
@@ -0,0 +1,73 @@
+from rpgmv_translator.translator.prompts import ReplyStreamParser, accept_entries, parse_reply
+
+REPLY = '{"0":"你好","1":"这是\\"测试\\"","2":"{c0}勇者{c1}"}'
+ENTRIES = {0: '你好', 1: '这是"测试"', 2: '{c0}勇者{c1}'}
+
+
+def test_parse_reply_ignores_prose_around_the_object():
+    assert parse_reply(f'Here you go:\n```json\n{REPLY}\n```\nEnjoy!') == ENTRIES
+
+
+def test_parse_reply_skips_objects_without_id_keys():
+    assert parse_reply('{"note": "ids below"} ' + REPLY) == ENTRIES
+
+
+def test_parse_reply_keeps_only_string_values_under_numeric_ids():
+    assert parse_reply('{"0": "你好", "1": 5, "x": "什么", " 2 ": "测试"}') == {0: '你好', 2: '测试'}
+
+
+def test_parse_reply_salvages_the_complete_pairs_of_a_truncated_reply():
+    assert parse_reply(REPLY[:REPLY.index('"2"') + 6]) == {0: '你好', 1: '这是"测试"'}
+
+
+def test_parse_reply_without_entries():
+    assert parse_reply("Sorry, I can't help with that.") is None
+    assert parse_reply('{"0": ') is None
+
+
+def test_stream_parser_returns_each_entry_once_it_is_complete():
+    parser = ReplyStreamParser()
+    received = {}
+    for i, character in enumerate(REPLY):
+        new_entries = parser.feed(character)
+        for key in new_entries:
+            # An entry is only returned once its closing quote has arrived
+            assert REPLY[:i + 1].count(f'"{key}":') == 1
+        received.update(new_entries)
+    assert received == ENTRIES
+    assert parser.close() == ENTRIES
+
+
+def test_stream_parser_salvages_a_cut_off_stream():
+    parser = ReplyStreamParser()
+    cut = REPLY[:REPLY.index('"2"') + 6]
+    assert parser.feed('Sure! ' + cut[:8]) == {}
+    assert parser.feed(cut[8:]) == {0: '你好', 1: '这是"测试"'}
+    assert parser.close() == {0: '你好', 1: '这是"测试"'}
+
+
+def test_stream_parser_falls_back_to_the_whole_reply():
+    # The first object holds no ids, which the incremental pass can't follow; close() parses everything
+    parser = ReplyStreamParser()
+    parser.feed('{"note": {"a": 1}} ' + REPLY)
+    assert parser.close() == ENTRIES
+
+
+def test_stream_parser_without_entries():
+    parser = ReplyStreamParser()
+    parser.feed("Sorry, I can't help with that.")
+    assert parser.close() is None
+
+
+def test_accept_entries_rejects_changed_placeholders():
+    texts = ['{c0}勇者{c1}', '{n0}ゴールド', 'こんにちは']
+    accepted, japanese = accept_entries(texts, {0: '{c0}勇者', 1: '{n0}金币', 2: ' '})
+    assert accepted == {'{n0}ゴールド': '{n0}金币'}
+    assert not japanese
+
+
+def test_accept_entries_drops_japanese_when_much_of_the_reply_is_untranslated():
+    texts = ['こんにちは', 'さようなら', 'ありがとう']
+    accepted, japanese = accept_entries(texts, {0: '你好', 1: 'さようなら', 2: 'ありがとう'})
+    assert accepted == {'こんにちは': '你好'}
+    assert japanese
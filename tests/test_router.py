@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from rpgmv_translator.benchmark.fake_openai_server import FakeOpenAIServer, fake_translate
+from rpgmv_translator.translator import get_translator
+
+
+def test_sequential_batches_follow_the_weights():
+    with FakeOpenAIServer() as heavy, FakeOpenAIServer() as light:
+        router = get_translator('router', [{'name': 'heavy', 'base_url': heavy.base_url, 'weight': 2},
+                                           {'name': 'light', 'base_url': light.base_url}], 'test')
+        for i in range(6):
+            assert router.translate([f'テスト{i}']) == [fake_translate(f'テスト{i}')]
+
+    assert router.assigned == [4, 2]
+    assert (heavy.stats['requests'], light.stats['requests']) == (4, 2)
+
+
+def test_concurrent_batches_follow_the_weights():
+    with FakeOpenAIServer(latency=0.02) as heavy, FakeOpenAIServer(latency=0.02) as light:
+        router = get_translator('router', [{'name': 'heavy', 'base_url': heavy.base_url, 'weight': 2},
+                                           {'name': 'light', 'base_url': light.base_url}], 'test')
+        with ThreadPoolExecutor(3) as executor:
+            list(executor.map(lambda i: router.translate([f'テスト{i}']), range(30)))
+
+    assert router.assigned == [20, 10]
+
+
+def test_failed_entries_go_to_the_next_backend(server):
+    # Nothing listens on the discard port, so every request to the first backend fails
+    router = get_translator('router', [{'name': 'dead', 'base_url': 'http://127.0.0.1:9/v1', 'weight': 5,
+                                        'timeout': 1},
+                                       {'name': 'live', 'base_url': server.base_url}], 'test')
+
+    assert router.translate(['こんにちは', 'テスト']) == [fake_translate('こんにちは'), fake_translate('テスト')]
+    assert router.stats['failovers'] == 1
+    assert router.assigned == [1, 1]
+    # The batch counts once towards the escalated share, although two backends saw it
+    assert router.scheduler.entries_seen == 2
+
+
+def test_entries_are_given_up_after_one_failover():
+    router = get_translator('router', [{'name': 'dead', 'base_url': 'http://127.0.0.1:9/v1', 'timeout': 1},
+                                       {'name': 'also dead', 'base_url': 'http://127.0.0.1:9/v1', 'timeout': 1},
+                                       {'name': 'never tried', 'base_url': 'http://127.0.0.1:9/v1'}], 'test')
+
+    translations, missing = router.translate_partial(['こんにちは'])
+    assert translations == {}
+    assert missing == ['こんにちは']
+    assert router.assigned == [1, 1, 0]
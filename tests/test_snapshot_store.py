@@ -0,0 +1,84 @@
+import os
+import re
+import pytest
+from rpgmv_translator.project_store import PROJECT_DB
+from rpgmv_translator.snapshot_store import SNAPSHOT_DIRECTORY, SnapshotStore
+from rpgmv_translator.translate import RPGMVTranslator
+from rpgmv_translator.utils import restore_from_backup
+
+_KANA_REGEX = re.compile(r'[぀-ゟ゠-ヿ]')
+
+
+def _map_text(project):
+    with open(os.path.join(project, 'www', 'data', 'Map001.json'), 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def _translate(project, server):
+    RPGMVTranslator(project, use_translation_memory=False, metrics_file=None, api_key='test',
+                    base_url=server.base_url).translate()
+
+
+def test_listing_a_directory_without_snapshots_leaves_it_alone(tmp_path):
+    snapshots = SnapshotStore(str(tmp_path))
+    assert snapshots.list() == []
+    assert snapshots.latest() is None
+    assert snapshots.disk_usage() == 0
+    with pytest.raises(ValueError):
+        snapshots.restore(1)
+    assert not os.path.exists(os.path.join(tmp_path, SNAPSHOT_DIRECTORY))
+
+
+def test_unknown_snapshot_keeps_the_project_state(project, server):
+    _translate(project, server)
+    with pytest.raises(ValueError):
+        restore_from_backup(project, 99)
+    assert os.path.exists(os.path.join(project, PROJECT_DB))
+
+
+def test_restoring_the_translated_files_keeps_the_originals(project, server):
+    original = _map_text(project)
+    _translate(project, server)
+    translated = _map_text(project)
+    assert not _KANA_REGEX.search(translated)
+
+    snapshots = SnapshotStore(project)
+    assert restore_from_backup(project) > 0
+    assert _map_text(project) == original
+    assert not os.path.exists(os.path.join(project, PROJECT_DB))
+
+    _translate(project, server)
+    with open(os.path.join(project, 'www', 'data', 'Map001.json'), 'w', encoding='utf-8') as file:
+        file.write('{}')
+    assert restore_from_backup(project, snapshots.latest('translated')) == 1
+    assert _map_text(project) == translated
+    assert os.path.exists(os.path.join(project, PROJECT_DB))
+
+    # The translated files are not taken for new originals by the next run
+    originals = [snapshot['id'] for snapshot in snapshots.list() if snapshot['label'] == 'original']
+    _translate(project, server)
+    assert [snapshot['id'] for snapshot in snapshots.list() if snapshot['label'] == 'original'] == originals
+    restore_from_backup(project)
+    assert _map_text(project) == original
+
+
+def test_restored_output_without_project_state_is_no_original(project, server):
+    original = _map_text(project)
+    _translate(project, server)
+    snapshots = SnapshotStore(project)
+    translated = snapshots.latest('translated')
+    restore_from_backup(project)
+    restore_from_backup(project, translated)
+    assert not os.path.exists(os.path.join(project, PROJECT_DB))
+
+    _translate(project, server)
+    restore_from_backup(project)
+    assert _map_text(project) == original
+
+
+def test_only_the_latest_translated_snapshot_is_kept(project, server):
+    _translate(project, server)
+    restore_from_backup(project)
+    _translate(project, server)
+    labels = [snapshot['label'] for snapshot in SnapshotStore(project).list()]
+    assert labels.count('translated') == 1
@@ -0,0 +1,49 @@
+import pytest
+from rpgmv_translator.request_controller import GPTRequestController
+from rpgmv_translator.text_splitter import join_chunks
+
+LONG_TEXT = ''.join(f"\\C[2]勇者\\C[0]「ここは第{i}の村です。本当に？」\n" for i in range(40))
+
+
+@pytest.fixture
+def controller():
+    # The approximate tokenizer cuts long sentences without loading a dictionary
+    return GPTRequestController(4096, 'approximate', api_key='test')
+
+
+def test_split_text_keeps_every_character(controller):
+    chunks = controller._split_text(LONG_TEXT, 60)
+    assert len(chunks) > 1
+    assert ''.join(chunk for chunk, _ in chunks) == LONG_TEXT
+    for chunk, tokens in chunks:
+        assert tokens == controller.token_counter.get_token_count(chunk)
+        assert tokens <= 60
+
+
+def test_split_text_ends_chunks_on_sentence_ends(controller):
+    for chunk, _ in controller._split_text(LONG_TEXT, 60):
+        assert chunk.endswith('\n')
+
+
+def test_split_text_never_cuts_a_control_code(controller):
+    sentence = 'あ' * 30 + '\\C[12]' + 'い' * 30
+    chunks = controller._split_text(sentence, 31)
+    assert ''.join(chunk for chunk, _ in chunks) == sentence
+    assert any('\\C[12]' in chunk for chunk, _ in chunks)
+
+
+def test_join_chunks_puts_the_line_breaks_back():
+    chunks = ['\nこんにちは。\n', '元気？\n\n', '  ']
+    assert join_chunks(chunks, ['你好。', ' 好吗？ ', '']) == '\n你好。\n好吗？\n\n  '
+
+
+def test_controller_joins_an_entry_once_every_chunk_is_in(controller):
+    chunks = ['こんにちは。\n', '元気？\n', 'さようなら。']
+    controller.split_entries[7] = [chunks, {}, None]
+
+    assert controller._join_chunks(1, [(7, chunks[0], '你好。'), (8, 'はい', '是')]) == [(8, 'はい', '是')]
+    joined = [(7, ''.join(chunks), '你好。\n好吗？\n再见。')]
+    assert controller._join_chunks(2, [(7, chunks[2], '再见。'), (7, chunks[1], '好吗？')]) == joined
+    # A later event of the completing batch commits the entry again; other batches don't
+    assert controller._join_chunks(2, [(7, chunks[1], '好吗？')]) == joined
+    assert controller._join_chunks(3, [(7, chunks[0], '你好。')]) == []